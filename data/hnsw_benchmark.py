@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Sweep HNSW parameters over the real embeddings of an index and report recall against exact search.
+
+Vectors are dumped once from the index (or read from a local export), a held-out sample of them is
+used as queries, and their exact nearest neighbors are computed by numpy. Every combination of m and
+ef_construction is built by hnswlib in process, or by a local OpenSearch, then queried with every
+ef_search, once per space type with exact neighbors of that space type. Each point reports recall@k,
+p50/p99 query latency, build time and graph memory.
+
+Example:
+    pip install -r requirements.txt hnswlib
+    python hnsw_benchmark.py --index semantic_search_knowledge_index --dump vectors.npy \\
+        --m 16 32 --ef-construction 128 256 --ef-search 32 64 128 256 --space-types l2 cosinesimil
+    python hnsw_benchmark.py --vectors vectors.npy --engine opensearch --opensearch-url http://localhost:9200
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+import boto3
+import numpy as np
+import requests
+
+from ingestion.bulk import BulkChunker, BulkIndexer
+from ingestion.local_export import VECTORS_FILE
+from ingestion.opensearch import HEADERS, delete_index, get_auth, get_host, normalize_host, scroll_documents
+
+logger = logging.getLogger(__name__)
+
+# opensearch space types and the hnswlib spaces which rank neighbors the same way
+SPACE_TYPES = {'l2': 'l2', 'cosinesimil': 'cosine', 'innerproduct': 'ip'}
+# the first opensearch version of which knn queries take method_parameters.ef_search
+QUERY_EF_SEARCH_VERSION = (2, 16)
+
+
+def dump_vectors(host, index_name, auth=None, vector_field='question_vector'):
+    vectors = [hit['_source'][vector_field]
+               for hit in scroll_documents(host, index_name, auth=auth, source=[vector_field])
+               if hit.get('_source', {}).get(vector_field) is not None]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def load_vectors(path):
+    """
+    Load a .npy matrix, or the vectors of a directory exported by ingest.py --export-local
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, VECTORS_FILE)
+    return np.load(path).astype(np.float32)
+
+
+def split_queries(vectors, query_count, seed=0):
+    """
+    Hold out query_count random vectors as queries, the others are indexed
+    """
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    return vectors[order[query_count:]], vectors[order[:query_count]]
+
+
+def exact_neighbors(corpus, queries, k, space_type='l2', block_rows=65536):
+    """
+    Exact top-k positions of each query in the corpus by squared l2 distance, cosine similarity
+    or inner product, as the space type ranks them
+    """
+    if space_type not in SPACE_TYPES:
+        raise ValueError(f'Unsupported space type {space_type}, expected one of {", ".join(SPACE_TYPES)}')
+    if space_type == 'cosinesimil':
+        corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    # the squared norm of queries doesn't change their ranking, the l2 distance omits it
+    squared_norms = np.einsum('ij,ij->i', corpus, corpus) if space_type == 'l2' else np.zeros(len(corpus), np.float32)
+    best_distances = np.full((len(queries), 0), np.inf, dtype=np.float32)
+    best_positions = np.zeros((len(queries), 0), dtype=np.int64)
+    for offset in range(0, len(corpus), block_rows):
+        block = corpus[offset:offset + block_rows]
+        distances = squared_norms[offset:offset + len(block)][None, :] - 2 * (queries @ block.T)
+        positions = np.broadcast_to(np.arange(offset, offset + len(block)), distances.shape)
+
+        distances = np.concatenate([best_distances, distances], axis=1)
+        positions = np.concatenate([best_positions, positions], axis=1)
+        top = np.argpartition(distances, min(k, distances.shape[1]) - 1, axis=1)[:, :k]
+        best_distances = np.take_along_axis(distances, top, axis=1)
+        best_positions = np.take_along_axis(positions, top, axis=1)
+    return best_positions
+
+
+def recall_at_k(found, truth, k):
+    return float(np.mean([len(set(row[:k]) & set(expected[:k])) / k for row, expected in zip(found, truth)]))
+
+
+class HnswlibRunner(object):
+    """
+    Build and query graphs by hnswlib in process, single threaded queries like the lambda
+    """
+
+    name = 'hnswlib'
+
+    def __init__(self, build_threads=0):
+        import hnswlib
+        self._hnswlib = hnswlib
+        self._build_threads = build_threads or os.cpu_count()
+        self._graph = None
+
+    def build(self, corpus, m, ef_construction, space_type='l2'):
+        graph = self._hnswlib.Index(space=SPACE_TYPES[space_type], dim=corpus.shape[1])
+        graph.init_index(max_elements=len(corpus), M=m, ef_construction=ef_construction)
+        graph.add_items(corpus, np.arange(len(corpus)), num_threads=self._build_threads)
+        graph.set_num_threads(1)
+        self._graph = graph
+
+    def memory_bytes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            graph_path = os.path.join(tmp_dir, 'graph.hnsw')
+            self._graph.save_index(graph_path)
+            return os.path.getsize(graph_path)
+
+    def search(self, query, k, ef_search):
+        self._graph.set_ef(max(ef_search, k))
+        labels, _ = self._graph.knn_query(query, k=k)
+        return labels[0].tolist()
+
+    def close(self):
+        self._graph = None
+
+
+class OpenSearchRunner(object):
+    """
+    Build and query indexes of a local OpenSearch, one shard without replicas force-merged to one segment.
+
+    From OpenSearch 2.16 ef_search is a parameter of the query. Before it, the ef_search index setting of
+    nmslib and faiss indexes is updated between the ef_search values, and lucene, which searches k candidates,
+    is queried with a k of ef_search and a size of k.
+    """
+
+    name = 'opensearch'
+
+    def __init__(self, host, auth=None, engine='lucene', index_prefix='hnsw-benchmark', bulk_docs=500):
+        self._host = host
+        self._auth = auth
+        self._engine = engine
+        self._index_prefix = index_prefix
+        self._bulk_docs = bulk_docs
+        self._index = None
+        self._index_ef_search = None
+        self._query_ef_search = None
+        self._session = requests.Session()
+        self._session.auth = auth
+
+    def build(self, corpus, m, ef_construction, space_type='l2'):
+        self._index = f'{self._index_prefix}-{space_type}-m{m}-efc{ef_construction}'
+        self._index_ef_search = None
+        delete_index(self._host, self._index, auth=self._auth)
+        self._request('PUT', self._index, {
+            'settings': {'index.knn': True, 'number_of_shards': 1, 'number_of_replicas': 0, 'refresh_interval': '-1'},
+            'mappings': {'properties': {'vector': {
+                'type': 'knn_vector',
+                'dimension': corpus.shape[1],
+                'method': {'name': 'hnsw', 'space_type': space_type, 'engine': self._engine,
+                           'parameters': {'m': m, 'ef_construction': ef_construction}},
+            }}},
+        })
+
+        indexer = BulkIndexer(self._host, auth=self._auth, pool_size=1)
+        chunker = BulkChunker(max_docs=self._bulk_docs)
+        for position, vector in enumerate(corpus):
+            for chunk in chunker.add(BulkChunker.index_action(self._index, {'vector': vector.tolist()}, str(position))):
+                indexer.send(chunk)
+        chunk = chunker.flush()
+        if chunk is not None:
+            indexer.send(chunk)
+
+        self._request('POST', f'{self._index}/_refresh')
+        self._request('POST', f'{self._index}/_forcemerge?max_num_segments=1', timeout=3600)
+        if self._engine != 'lucene':
+            self._request('GET', f'_plugins/_knn/warmup/{self._index}', timeout=3600)
+
+    def memory_bytes(self):
+        if self._engine != 'lucene':
+            stats = self._request('GET', '_plugins/_knn/stats/graph_memory_usage')
+            return sum(node.get('graph_memory_usage', 0) for node in stats['nodes'].values()) * 1024
+
+        # lucene graphs live in the page cache, report the size of the index on disk instead
+        stats = self._request('GET', f'{self._index}/_stats/store')
+        return stats['indices'][self._index]['total']['store']['size_in_bytes']
+
+    def search(self, query, k, ef_search):
+        ef_search = max(ef_search, k)
+        knn_query = {'vector': query.tolist(), 'k': k}
+        if self._takes_query_ef_search():
+            knn_query['method_parameters'] = {'ef_search': ef_search}
+        elif self._engine == 'lucene':
+            knn_query['k'] = ef_search
+        elif ef_search != self._index_ef_search:
+            # the warm-up queries of each ef_search come first, so timed queries don't wait for the update
+            self._request('PUT', f'{self._index}/_settings', {'index.knn.algo_param.ef_search': ef_search})
+            self._index_ef_search = ef_search
+        output = self._request('POST', f'{self._index}/_search', {
+            'size': k, '_source': False, 'query': {'knn': {'vector': knn_query}},
+        })
+        return [int(hit['_id']) for hit in output['hits']['hits']]
+
+    def close(self):
+        delete_index(self._host, self._index, auth=self._auth)
+
+    def _takes_query_ef_search(self):
+        if self._query_ef_search is None:
+            number = self._request('GET', '')['version']['number']
+            version = tuple(int(part) for part in number.split('-')[0].split('.')[:2])
+            self._query_ef_search = version >= QUERY_EF_SEARCH_VERSION
+            if not self._query_ef_search:
+                fallback = 'k of ef_search' if self._engine == 'lucene' else 'index setting'
+                logger.info(f"OpenSearch {number} doesn't take ef_search in queries, it is set by the {fallback}")
+        return self._query_ef_search
+
+    def _request(self, method, path, body=None, timeout=60):
+        response = self._session.request(method, self._host + path, headers=HEADERS, json=body, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+def sweep(runner, corpus, queries, truths, k, ms, ef_constructions, ef_searches, warm_up_queries=10):
+    """
+    Args:
+        :truths: dict of space type to the exact neighbors of the queries in that space, a sweep per space type
+    """
+    results = []
+    for space_type, truth in truths.items():
+        for m in ms:
+            for ef_construction in ef_constructions:
+                start = time.perf_counter()
+                runner.build(corpus, m, ef_construction, space_type)
+                build_seconds = time.perf_counter() - start
+                memory_bytes = runner.memory_bytes()
+
+                for ef_search in ef_searches:
+                    for query in queries[:warm_up_queries]:
+                        runner.search(query, k, ef_search)
+
+                    found = []
+                    latencies = []
+                    for query in queries:
+                        start = time.perf_counter()
+                        found.append(runner.search(query, k, ef_search))
+                        latencies.append(time.perf_counter() - start)
+
+                    results.append({
+                        'engine': runner.name,
+                        'space_type': space_type,
+                        'm': m,
+                        'ef_construction': ef_construction,
+                        'ef_search': ef_search,
+                        f'recall_at_{k}': recall_at_k(found, truth, k),
+                        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+                        'build_seconds': build_seconds,
+                        'memory_mb': memory_bytes / 1024 / 1024,
+                    })
+                    logger.info(f"Measured {results[-1]}")
+                runner.close()
+    return results
+
+
+def format_table(results):
+    columns = list(results[0].keys())
+    rows = [[f'{value:.4f}' if isinstance(value, float) else str(value) for value in result.values()]
+            for result in results]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    lines = ['  '.join(column.rjust(width) for column, width in zip(columns, widths))]
+    lines.extend('  '.join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', help='.npy matrix or directory of ingest.py --export-local, instead of the index')
+    parser.add_argument('--index', default='semantic_search_knowledge_index', help='index to dump vectors from')
+    parser.add_argument('--host', help='opensearch url of the index, read from secret OpenSearchHostURL if absent')
+    parser.add_argument('--username', help='opensearch user, read from secret VectorDBMasterUserCredentials if absent')
+    parser.add_argument('--password', help='opensearch password')
+    parser.add_argument('--vector-field', default='question_vector', help='vector field of the index')
+    parser.add_argument('--dump', help='save dumped vectors to this .npy file')
+    parser.add_argument('--queries', type=int, default=200, help='held-out vectors used as queries')
+    parser.add_argument('--k', type=int, default=10, help='neighbors per query, recall is measured at k')
+    parser.add_argument('--m', type=int, nargs='+', default=[16, 32], help='m values to build')
+    parser.add_argument('--ef-construction', type=int, nargs='+', default=[128, 256], help='ef_construction values')
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 32, 64, 128, 256],
+                        help='ef_search values, a query parameter of opensearch 2.16+, an index setting before')
+    parser.add_argument('--space-types', choices=list(SPACE_TYPES), nargs='+', default=['l2'],
+                        help='space types to build, each measured against its own exact neighbors')
+    parser.add_argument('--engine', choices=['hnswlib', 'opensearch'], default='hnswlib', help='graph implementation')
+    parser.add_argument('--opensearch-url', default='http://localhost:9200', help='local opensearch of --engine opensearch')
+    parser.add_argument('--opensearch-user', help='user of the local opensearch')
+    parser.add_argument('--opensearch-password', help='password of the local opensearch')
+    parser.add_argument('--opensearch-engine', choices=['lucene', 'faiss', 'nmslib'], default='lucene',
+                        help='knn engine of the benchmark indexes')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the query sample')
+    parser.add_argument('--output', default='hnsw_benchmark.json', help='json report')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.INFO,
+    )
+    args = parse_args(argv)
+
+    if args.vectors:
+        vectors = load_vectors(args.vectors)
+    else:
+        session = boto3.Session()
+        host = normalize_host(args.host) if args.host else get_host(session)
+        auth = (args.username, args.password) if args.username else get_auth(session)
+        vectors = dump_vectors(host, args.index, auth=auth, vector_field=args.vector_field)
+        if args.dump:
+            np.save(args.dump, vectors)
+    if len(vectors) <= args.queries:
+        raise SystemExit(f'Need more than {args.queries} vectors, got {len(vectors)}')
+
+    corpus, queries = split_queries(vectors, args.queries, seed=args.seed)
+    truths = {}
+    for space_type in dict.fromkeys(args.space_types):
+        start = time.perf_counter()
+        truths[space_type] = exact_neighbors(corpus, queries, args.k, space_type=space_type)
+        logger.info(f"Computed exact {space_type} neighbors of {len(queries)} queries in {len(corpus)} vectors "
+                    f"in {time.perf_counter() - start:.1f}s")
+
+    if args.engine == 'opensearch':
+        auth = (args.opensearch_user, args.opensearch_password) if args.opensearch_user else None
+        runner = OpenSearchRunner(normalize_host(args.opensearch_url), auth=auth, engine=args.opensearch_engine)
+    else:
+        runner = HnswlibRunner()
+
+    results = sweep(runner, corpus, queries, truths, args.k, args.m, args.ef_construction, args.ef_search)
+    print(format_table(results))
+    report = {'vectors': len(vectors), 'dimension': int(vectors.shape[1]), 'queries': len(queries), 'k': args.k,
+              'results': results}
+    with open(args.output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    logger.info(f"Wrote report to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
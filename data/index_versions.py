@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Manage the versioned indexes behind the alias which the semantic search lambda queries.
+
+Example:
+    python index_versions.py --alias semantic_search_knowledge_index list
+    python index_versions.py --alias semantic_search_knowledge_index rollback
+    python index_versions.py --alias semantic_search_knowledge_index swap semantic_search_knowledge_index-v20240501083000
+    python index_versions.py --alias semantic_search_knowledge_index gc --keep 2
+"""
+import logging
+import argparse
+
+import boto3
+
+from ingestion.opensearch import get_auth, get_host, normalize_host
+from ingestion.versioning import garbage_collect, get_alias_targets, list_versions, rollback, swap_alias
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--alias', default='semantic_search_knowledge_index', help='alias queried by the lambda')
+    parser.add_argument('--host', help='opensearch url, read from secret OpenSearchHostURL if absent')
+    parser.add_argument('--username', help='opensearch user, read from secret VectorDBMasterUserCredentials if absent')
+    parser.add_argument('--password', help='opensearch password')
+
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list versions and the one the alias points to')
+    commands.add_parser('rollback', help='point the alias to the version before the current one')
+    swap_parser = commands.add_parser('swap', help='point the alias to a version')
+    swap_parser.add_argument('version', help='versioned index name')
+    gc_parser = commands.add_parser('gc', help='delete old versions')
+    gc_parser.add_argument('--keep', type=int, default=2, help='newest versions to keep')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.INFO,
+    )
+    args = parse_args(argv)
+
+    session = boto3.Session()
+    host = normalize_host(args.host) if args.host else get_host(session)
+    auth = (args.username, args.password) if args.username else get_auth(session)
+
+    if args.command == 'list':
+        targets = get_alias_targets(host, args.alias, auth=auth)
+        for version in list_versions(host, args.alias, auth=auth):
+            print(f"{'*' if version in targets else ' '} {version}")
+    elif args.command == 'rollback':
+        rollback(host, args.alias, auth=auth)
+    elif args.command == 'swap':
+        swap_alias(host, args.alias, args.version, auth=auth)
+    elif args.command == 'gc':
+        garbage_collect(host, args.alias, keep=args.keep, auth=auth)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Ingest question-answer pairs from a csv file into the vector db.
+
+Only rows changed since the last run are embedded and indexed, rows removed from the csv are deleted,
+and a run interrupted half way is resumed from its checkpoint file.
+
+The run ends with an optimization stage: refresh and replicas are turned off during the bulk load of an
+index which is not searched yet and restored afterwards, then such an index is force merged and its knn graphs
+are warmed up. The index is only reported ready, or swapped in, when all steps completed.
+
+With --blue-green, --index is an alias: all rows are written to a new versioned index, which is optimized
+and checked before the alias is atomically pointed to it, so searches never see a partial index.
+
+Embedding calls are paced by an adaptive concurrency limit and retried with backoff, and rows which still
+fail are written to a dead letter file, which --replay-dead-letter ingests again later.
+
+With --suggest-index, the questions are also written into the prefix index of the /smart_search/suggest route,
+ranked by the counts of --popularity, e.g. ../lambda/semantic_search/suggest_index.json to ship it with the lambda.
+
+With --faq-table, the kNN hits of every question are searched once and written into the exact match table of
+the lambda, which answers a search equal to a question without embedding it while the index is unchanged.
+Every run which writes to the index records a new content version in its _meta, which the table is checked by.
+
+Vectors are kept in an embedding store keyed by the embedded text and the model id, so that rebuilding an
+index, e.g. with a new mapping or on a new cluster, streams the stored vectors instead of calling the model.
+
+Example:
+    python ingest.py --csv qa_samples.csv --index semantic_search_knowledge_index --create-index
+"""
+import os
+import csv
+import json
+import logging
+import argparse
+
+import boto3
+
+from ingestion.bulk import BulkIndexer
+from ingestion.embedding import SageMakerEmbeddingClient
+from ingestion.embedding_store import EmbeddingStore, StoredEmbeddingClient
+from ingestion.faq import build_faq_table, write_faq_table
+from ingestion.incremental import Checkpoint, DeadLetterFile, document_id, plan_changes
+from ingestion.local_export import export_local_vectors
+from ingestion.metadata import METADATA_FIELDS, normalize_metadata
+from ingestion.opensearch import (count_documents, create_index, delete_index, get_auth, get_host, index_exists,
+                                  load_content_hashes, normalize_host, refresh_index)
+from ingestion.optimize import IndexOptimizer
+from ingestion.pipeline import IngestionPipeline
+from ingestion.suggest import build_suggest_index, load_popularity, write_suggest_index
+from ingestion.throttling import AdaptiveEmbeddingClient, AimdController
+from ingestion.versioning import garbage_collect, new_content_version, new_version_name, set_content_version, swap_alias
+
+logger = logging.getLogger(__name__)
+
+
+def read_rows(csv_path, fields=('question', 'answers'), metadata_defaults=None):
+    """
+    Read rows of fields and of the metadata columns the csv has, e.g. category or updated_at
+    """
+    with open(csv_path, encoding='utf-8') as csv_file_handler:
+        reader = csv.DictReader(csv_file_handler)
+        metadata_fields = [field for field in METADATA_FIELDS if field in (reader.fieldnames or [])]
+        for row in reader:
+            yield normalize_metadata({field: row[field] for field in [*fields, *metadata_fields]}, metadata_defaults)
+
+
+def metadata_default(text):
+    field, _, value = text.partition('=')
+    if field not in METADATA_FIELDS or len(value) == 0:
+        raise argparse.ArgumentTypeError(f"Expected FIELD=VALUE with FIELD in {', '.join(METADATA_FIELDS)}, got {text}")
+    return field, value
+
+
+def create_embedding_client(args, session):
+    if args.embedding_provider == 'local':
+        # imported lazily so that the sagemaker provider does not need onnxruntime
+        from ingestion.local_embedding import LocalEmbeddingClient
+        return LocalEmbeddingClient(args.local_model_path, max_batch_tokens=args.local_max_batch_tokens)
+
+    # retries are left to AdaptiveEmbeddingClient, which sees the throttling that botocore would hide
+    return SageMakerEmbeddingClient(endpoint_name=args.endpoint_name,
+                                    boto3_session=session,
+                                    endpoint_url=args.embedding_endpoint_url,
+                                    max_attempts=1)
+
+
+def embedding_model_id(args):
+    """
+    Id of the embedding model in the embedding store, --model-id should be changed when the endpoint is redeployed
+    with another model under the same name
+    """
+    if args.model_id:
+        return args.model_id
+    if args.embedding_provider == 'local':
+        with open(os.path.join(args.local_model_path, 'embedding_config.json'), encoding='utf-8') as config_file:
+            model_id = json.load(config_file).get('model_id')
+        return f'local:{model_id or os.path.basename(os.path.normpath(args.local_model_path))}'
+    return f'sagemaker:{args.endpoint_name}'
+
+
+def publish_version(host, alias, version, expected_count, args, auth=None):
+    """
+    Check a built version, then point the alias to it and delete old versions
+    """
+    refresh_index(host, version, auth=auth)
+    indexed_count = count_documents(host, version, auth=auth)
+    if indexed_count != expected_count:
+        logger.warning(f"Version {version} has {indexed_count} docs instead of {expected_count}, alias {alias} is kept")
+        return False
+
+    swap_alias(host, alias, version, auth=auth, replace_index=args.replace_index)
+    garbage_collect(host, alias, keep=args.keep_versions, auth=auth)
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default='qa_samples.csv', help='csv file with question and answers columns')
+    parser.add_argument('--index', default='semantic_search_knowledge_index', help='target index name')
+    parser.add_argument('--host', help='opensearch url, read from secret OpenSearchHostURL if absent')
+    parser.add_argument('--username', help='opensearch user, read from secret VectorDBMasterUserCredentials if absent')
+    parser.add_argument('--password', help='opensearch password')
+    parser.add_argument('--embedding-provider', choices=['sagemaker', 'local'], default='sagemaker',
+                        help='embed by the sagemaker endpoint or by a local onnx model on CPU')
+    parser.add_argument('--local-model-path', help='directory of the model exported by export_onnx.py')
+    parser.add_argument('--local-max-batch-tokens', type=int, default=8192, help='max padded tokens of a local model run')
+    parser.add_argument('--endpoint-name', default='RAGSearchWithLLMEndpoint', help='embedding endpoint name')
+    parser.add_argument('--embedding-endpoint-url', help='sagemaker runtime url override, e.g. a local fake endpoint')
+    parser.add_argument('--dimension', type=int, default=768, help='embedding vector dimension')
+    parser.add_argument('--embedding-store', default='.embedding_store',
+                        help='directory of stored vectors, reused by later runs instead of calling the model')
+    parser.add_argument('--no-embedding-store', action='store_true', help='always call the model')
+    parser.add_argument('--model-id', help='model id of stored vectors, derived from the provider if absent')
+    parser.add_argument('--create-index', action='store_true', help='create the index before ingestion')
+    parser.add_argument('--recreate-index', action='store_true', help='delete and create the index before ingestion')
+    parser.add_argument('--embed-batch-size', type=int, default=16, help='sentences per embedding call')
+    parser.add_argument('--embed-workers', type=int, default=2, help='max concurrent embedding calls')
+    parser.add_argument('--embed-max-attempts', type=int, default=5, help='attempts of an embedding call')
+    parser.add_argument('--embed-latency-target', type=float, default=5.0,
+                        help='seconds above which an embedding call lowers the concurrency, 0 to ignore latency')
+    parser.add_argument('--index-workers', type=int, default=2, help='concurrent _bulk requests')
+    parser.add_argument('--bulk-max-docs', type=int, default=500, help='max documents per _bulk body')
+    parser.add_argument('--bulk-max-bytes', type=int, default=5 * 1024 * 1024, help='max bytes per _bulk body')
+    parser.add_argument('--queue-size', type=int, default=8, help='max batches waiting between stages')
+    parser.add_argument('--report-interval', type=float, default=10, help='seconds between throughput reports')
+    parser.add_argument('--metadata', nargs='+', type=metadata_default, default=[], metavar='FIELD=VALUE',
+                        help='metadata of rows without the column or value, e.g. source=qa_samples.csv category=machining')
+    parser.add_argument('--key-fields', nargs='+', default=['question'], help='fields hashed into document ids')
+    parser.add_argument('--full', action='store_true', help='re-embed and index all rows instead of the changed ones')
+    parser.add_argument('--checkpoint', help='checkpoint file, defaults to .<index>.checkpoint')
+    parser.add_argument('--dead-letter', help='file of rows whose embedding failed, defaults to .<index>.deadletter')
+    parser.add_argument('--replay-dead-letter', metavar='PATH',
+                        help='ingest the rows of a dead letter file into --index instead of the csv')
+    parser.add_argument('--blue-green', action='store_true',
+                        help='build a new versioned index and point the alias --index to it when it is ready')
+    parser.add_argument('--version', help='versioned index to build or resume, a new one if absent')
+    parser.add_argument('--keep-versions', type=int, default=2, help='versioned indexes kept after a blue/green swap')
+    parser.add_argument('--replace-index', action='store_true',
+                        help='delete an index named as --index in the blue/green swap, to migrate it to an alias')
+    parser.add_argument('--skip-optimize', action='store_true', help='skip the optimization stage')
+    parser.add_argument('--max-num-segments', type=int, default=1, help='segments per shard after force merge')
+    parser.add_argument('--force-merge', action='store_true',
+                        help='force merge a live index too, new and blue/green indexes are always merged')
+    parser.add_argument('--ready-file', help='write the index and the step timings to this json file when ready')
+    parser.add_argument('--suggest-index', metavar='PATH', help='write the prefix index of the suggest route to PATH')
+    parser.add_argument('--popularity', metavar='CSV', help='csv of question and count columns ranking suggestions')
+    parser.add_argument('--faq-table', metavar='PATH', help='write the exact match table of the lambda to PATH')
+    parser.add_argument('--faq-hits', type=int, default=6,
+                        help='k of the kNN search and hits stored per question in the faq table, the lambda serves '
+                             'the table to requests of this k, which is from + size unless a request sets k')
+    parser.add_argument('--export-local', help='export the index with vectors to this directory for the local search backend')
+    parser.add_argument('--export-hnsw', action='store_true', help='also build an HNSW graph in the export, requires hnswlib')
+    args = parser.parse_args(argv)
+    if args.replay_dead_letter and args.blue_green:
+        parser.error('--replay-dead-letter updates --index in place, re-run the --blue-green build to resume it')
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.INFO,
+    )
+    args = parse_args(argv)
+
+    session = boto3.Session()
+    host = normalize_host(args.host) if args.host else get_host(session)
+    auth = (args.username, args.password) if args.username else get_auth(session)
+
+    # a blue/green build writes to its own version, which is resumed like an index by its checkpoint
+    target_index = (args.version or new_version_name(args.index)) if args.blue_green else args.index
+    checkpoint = Checkpoint(args.checkpoint or f'.{target_index}.checkpoint')
+    dead_letter = DeadLetterFile(args.dead_letter or f'.{target_index}.deadletter')
+    if args.recreate_index and not args.blue_green:
+        delete_index(host, target_index, auth=auth)
+        checkpoint.clear()
+    created = False
+    if args.create_index or args.recreate_index or (args.blue_green and not index_exists(host, target_index, auth=auth)):
+        create_index(host, target_index, auth=auth, dimension=args.dimension)
+        created = True
+
+    delete_ids = []
+    if args.replay_dead_letter:
+        # rows which fail again are written to the dead letter file of this run
+        replayed = DeadLetterFile(args.replay_dead_letter)
+        all_rows = rows = replayed.load()
+        replayed.clear()
+        logger.info(f"Replay {len(rows)} rows of dead letter file {replayed.path}")
+    else:
+        all_rows = rows = list(read_rows(args.csv, metadata_defaults=dict(args.metadata)))
+    if not args.full and not args.replay_dead_letter:
+        plan = plan_changes(rows,
+                            indexed_hashes=load_content_hashes(host, target_index, auth=auth),
+                            done_hashes=checkpoint.load(),
+                            key_fields=args.key_fields)
+        logger.info(f"Incremental ingestion of {len(rows)} rows: {plan}")
+        rows, delete_ids = plan.upserts, plan.deletes
+
+    controller = AimdController(initial_limit=1, max_limit=args.embed_workers,
+                                latency_target=args.embed_latency_target or None)
+    adaptive_clients = []
+
+    def create_adaptive_client():
+        adaptive_clients.append(AdaptiveEmbeddingClient(create_embedding_client(args, session), controller,
+                                                        max_attempts=args.embed_max_attempts))
+        return adaptive_clients[-1]
+
+    store = None
+    if args.no_embedding_store:
+        embedding_client = create_adaptive_client()
+    else:
+        store = EmbeddingStore(args.embedding_store, embedding_model_id(args), args.dimension)
+        embedding_client = StoredEmbeddingClient(store, create_adaptive_client)
+
+    pipeline = IngestionPipeline(
+        embedding_client=embedding_client,
+        bulk_indexer=BulkIndexer(host, auth=auth, pool_size=args.index_workers),
+        index_name=target_index,
+        embed_batch_size=args.embed_batch_size,
+        embed_workers=args.embed_workers,
+        index_workers=args.index_workers,
+        bulk_max_docs=args.bulk_max_docs,
+        bulk_max_bytes=args.bulk_max_bytes,
+        queue_size=args.queue_size,
+        report_interval=args.report_interval,
+        key_fields=args.key_fields,
+        checkpoint=checkpoint,
+        dead_letter=dead_letter,
+    )
+    # refresh and replicas are only turned off, and segments merged, for an index which is not searched yet
+    fresh = args.blue_green or created
+    optimizer = None if args.skip_optimize else IndexOptimizer(host, target_index, auth=auth,
+                                                               max_num_segments=args.max_num_segments,
+                                                               force_merge=fresh or args.force_merge)
+    if optimizer is not None and fresh:
+        optimizer.begin_bulk()
+    try:
+        stats = pipeline.run(rows, delete_ids=delete_ids)
+    finally:
+        if optimizer is not None:
+            optimizer.end_bulk()
+        if store is not None:
+            store.flush()
+            logger.info(f"Embedding store served {embedding_client.hits} vectors, "
+                        f"the model generated {embedding_client.misses}")
+    if created or len(rows) > 0 or len(delete_ids) > 0:
+        # the faq table and the semantic cache of the lambda are valid for one content version of the index
+        set_content_version(host, target_index, new_content_version(), auth=auth)
+    if adaptive_clients:
+        logger.info(f"Embedding calls retried {adaptive_clients[0].retries} times, "
+                    f"concurrency: {controller.snapshot()}")
+    if stats['failed'] > 0:
+        logger.warning(f"{stats['failed']} docs failed, re-run to resume from checkpoint {checkpoint.path}")
+        if dead_letter.count > 0:
+            logger.warning(f"{dead_letter.count} rows couldn't be embedded, replay them from {dead_letter.path} "
+                           f"by --replay-dead-letter {dead_letter.path}")
+        return 1
+
+    checkpoint.clear()
+    if optimizer is not None:
+        try:
+            optimizer.optimize()
+        except Exception:
+            logger.warning(f"Index {target_index} is not ready as its optimization failed, re-run to optimize it")
+            return 1
+
+    expected_count = len({document_id(row, args.key_fields) for row in all_rows})
+    if args.blue_green and not publish_version(host, args.index, target_index, expected_count, args, auth=auth):
+        return 1
+
+    logger.info(f"Index {target_index} is ready, optimization steps: {optimizer.timings if optimizer else 'skipped'}")
+    if args.ready_file:
+        with open(args.ready_file, 'w', encoding='utf-8') as ready_file:
+            json.dump({'index': target_index,
+                       'alias': args.index if args.blue_green else None,
+                       'steps': optimizer.timings if optimizer else []}, ready_file, indent=2)
+
+    if args.suggest_index and not args.replay_dead_letter:
+        popularity = load_popularity(args.popularity) if args.popularity else None
+        write_suggest_index(args.suggest_index,
+                            build_suggest_index([row['question'] for row in all_rows], popularity=popularity))
+
+    if args.faq_table:
+        write_faq_table(args.faq_table, build_faq_table(host, args.index, auth=auth, hits_size=args.faq_hits))
+
+    if args.export_local:
+        export_local_vectors(host, args.index, args.export_local, auth=auth, dimension=args.dimension,
+                             hnsw=args.export_hnsw)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,140 @@
+import json
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class BulkChunk(object):
+    """
+    A ready-to-send _bulk body with its document count, ids and the content hashes of the indexed ones
+    """
+
+    def __init__(self, body: bytes, doc_count: int, doc_ids=None, content_hashes=None):
+        self.body = body
+        self.doc_count = doc_count
+        self.doc_ids = doc_ids or []
+        self.content_hashes = content_hashes or [None] * len(self.doc_ids)
+
+
+class BulkChunker(object):
+    """
+    Accumulate bulk actions and cut them into bodies bounded by document count and bytes
+    """
+
+    def __init__(self, max_docs=500, max_bytes=5 * 1024 * 1024):
+        """
+        Args:
+            :max_docs: max documents per _bulk body
+            :max_bytes: max bytes per _bulk body, a single larger document is sent alone
+        """
+        self._max_docs = max_docs
+        self._max_bytes = max_bytes
+        self._lines = []
+        self._doc_ids = []
+        self._content_hashes = []
+        self._doc_count = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def index_action(index_name, doc, doc_id=None):
+        action = {'_index': index_name}
+        if doc_id is not None:
+            action['_id'] = doc_id
+        return (json.dumps({'index': action}, ensure_ascii=False) + '\n'
+                + json.dumps(doc, ensure_ascii=False) + '\n').encode()
+
+    @staticmethod
+    def delete_action(index_name, doc_id):
+        return (json.dumps({'delete': {'_index': index_name, '_id': doc_id}}) + '\n').encode()
+
+    def add(self, action: bytes, doc_id=None, content_hash=None):
+        """
+        Add one serialized action, returns the chunks which became full
+
+        Args:
+            :action: serialized action
+            :doc_id: id of the document of the action
+            :content_hash: content hash of an indexed document, None for a delete
+        """
+        with self._lock:
+            chunks = []
+            if self._doc_count > 0 and self._bytes + len(action) > self._max_bytes:
+                chunks.append(self._cut())
+
+            self._lines.append(action)
+            if doc_id is not None:
+                self._doc_ids.append(doc_id)
+                self._content_hashes.append(content_hash)
+            self._doc_count += 1
+            self._bytes += len(action)
+            if self._doc_count >= self._max_docs or self._bytes >= self._max_bytes:
+                chunks.append(self._cut())
+            return chunks
+
+    def flush(self):
+        """
+        Returns the pending chunk or None
+        """
+        with self._lock:
+            return self._cut() if self._doc_count > 0 else None
+
+    def _cut(self):
+        chunk = BulkChunk(b''.join(self._lines), self._doc_count, self._doc_ids, self._content_hashes)
+        self._lines = []
+        self._doc_ids = []
+        self._content_hashes = []
+        self._doc_count = 0
+        self._bytes = 0
+        return chunk
+
+
+class BulkResult(object):
+    def __init__(self, indexed=0, failed=0, errors=None):
+        self.indexed = indexed
+        self.failed = failed
+        self.errors = errors or []
+
+
+class BulkIndexer(object):
+    """
+    Send _bulk bodies to opensearch over a pooled keep-alive session
+    """
+
+    def __init__(self, host: str, auth=None, pool_size=4, timeout=60):
+        """
+        Args:
+            :host: opensearch url ending with '/', e.g. https://my-domain.es.amazonaws.com/
+            :auth: (username, password)
+            :pool_size: connection pool size, should match the number of index workers
+            :timeout: request timeout in seconds
+        """
+        self._url = host + '_bulk'
+        self._timeout = timeout
+        self._session = requests.Session()
+        self._session.auth = auth
+        self._session.mount(host, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def send(self, chunk: BulkChunk):
+        response = self._session.post(self._url,
+                                      data=chunk.body,
+                                      headers={'Content-Type': 'application/x-ndjson'},
+                                      timeout=self._timeout)
+        response.raise_for_status()
+        return BulkIndexer._resolve_result(response.json())
+
+    @staticmethod
+    def _resolve_result(output):
+        result = BulkResult()
+        for item in output.get('items', []):
+            status = next(iter(item.values()))
+            if status.get('error') is not None:
+                result.failed += 1
+                result.errors.append({'id': status.get('_id'), 'error': status['error']})
+            else:
+                result.indexed += 1
+        return result
@@ -0,0 +1,77 @@
+import json
+import base64
+import struct
+import logging
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+_STRUCT_FORMATS = {'float32': 'f', 'float16': 'e'}
+
+
+def decode_vectors(output):
+    """
+    Decode pooled vectors returned by the custom inference handler of the embedding endpoint,
+    or the token embeddings of the default feature-extraction handler, of which the first token is kept
+    """
+    if isinstance(output, list):
+        return [vector[0][0] for vector in output]
+
+    encoding = output.get('encoding')
+    vectors = output.get('vectors') or []
+    if encoding == 'json':
+        return vectors
+
+    struct_format = _STRUCT_FORMATS[encoding]
+    dimension = output['dimension']
+    return [list(struct.unpack(f'<{dimension}{struct_format}', base64.b64decode(vector))) for vector in vectors]
+
+
+class SageMakerEmbeddingClient(object):
+    """
+    Generate sentence vectors in batches by the sagemaker embedding endpoint
+    """
+
+    def __init__(self,
+                 endpoint_name: str,
+                 boto3_session: boto3.Session = None,
+                 endpoint_url: str = None,
+                 encoding: str = 'float32',
+                 max_chars: int = 400,
+                 max_attempts: int = None):
+        """
+        Args:
+            :endpoint_name: A sagemaker endpoint name.
+            :boto3_session: A Boto3 session.
+            :endpoint_url: override of the sagemaker runtime url, e.g. a local fake endpoint
+            :encoding: vector encoding asked from the endpoint, json, float32 or float16
+            :max_chars: sentences are truncated to this length before embedding
+            :max_attempts: attempts of a call by botocore, 1 leaves retries to the caller, botocore's default if absent
+        """
+        session = boto3_session or boto3.Session()
+        self._endpoint_name = endpoint_name
+        self._encoding = encoding
+        self._max_chars = max_chars
+        config = Config(retries={'total_max_attempts': max_attempts, 'mode': 'standard'}) if max_attempts else None
+        self._client = session.client(service_name='sagemaker-runtime', endpoint_url=endpoint_url, config=config)
+
+    def generate_vectors(self, sentences: list[str]):
+        """
+        Generate one vector per sentence, raises if the endpoint fails or returns unmatched output
+
+        Args:
+            :sentences: sentences to embed in one endpoint call
+        """
+        inputs = [sentence[:self._max_chars] for sentence in sentences]
+        body = json.dumps({'inputs': inputs, 'parameters': {'pooling': 'cls', 'encoding': self._encoding}})
+        response = self._client.invoke_endpoint(EndpointName=self._endpoint_name,
+                                                ContentType='application/json',
+                                                Accept='application/json',
+                                                Body=body)
+        vectors = decode_vectors(json.loads(response['Body'].read()))
+        if len(vectors) != len(sentences):
+            raise ValueError(f'Endpoint {self._endpoint_name} returned {len(vectors)} vectors for {len(sentences)} sentences')
+
+        return vectors
@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def embedding_key(model_id, text):
+    """
+    Key of the vector of a text by a model, the text hash alone is not enough as a model change changes vectors
+    """
+    return hashlib.sha256(json.dumps([model_id, text], ensure_ascii=False).encode()).hexdigest()
+
+
+class EmbeddingStore(object):
+    """
+    A persistent store of the vectors generated by one embedding model, so that rebuilding an index,
+    e.g. with a new mapping, new HNSW params or on a new cluster, does not call the model again.
+
+    The store is a directory per model of append-only segments: a float32 matrix in vectors-<n>.npy and
+    the keys of its rows in keys-<n>.npy. Segments are memory mapped on open, and a segment only becomes
+    visible once manifest.json lists it, so a crashed run never leaves a half written segment behind.
+    """
+
+    def __init__(self, store_dir: str, model_id: str, dimension: int, segment_size=10000):
+        """
+        Args:
+            :store_dir: root directory of the store, shared by models
+            :model_id: id of the embedding model, e.g. sagemaker:RAGSearchWithLLMEndpoint
+            :dimension: vector dimension
+            :segment_size: new vectors buffered in memory before they are written as a segment
+        """
+        self._model_id = model_id
+        self._dimension = dimension
+        self._segment_size = segment_size
+        self._dir = os.path.join(store_dir, re.sub(r'[^\w.-]+', '_', model_id))
+        self._lock = threading.Lock()
+        self._segments = []
+        self._index = {}
+        self._pending = {}
+
+        os.makedirs(self._dir, exist_ok=True)
+        self._load()
+
+    @property
+    def model_id(self):
+        return self._model_id
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index) + len(self._pending)
+
+    def get(self, texts):
+        """
+        Returns the vector of each text as a list of floats, None for texts which are not stored
+        """
+        keys = [embedding_key(self._model_id, text) for text in texts]
+        with self._lock:
+            vectors = []
+            for key in keys:
+                if key in self._pending:
+                    vectors.append(self._pending[key])
+                elif key in self._index:
+                    segment, row = self._index[key]
+                    vectors.append(self._segments[segment][row].tolist())
+                else:
+                    vectors.append(None)
+            return vectors
+
+    def put(self, texts, vectors):
+        """
+        Store the vectors of texts, a segment is written once segment_size vectors are pending
+        """
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if len(vector) != self._dimension:
+                    raise ValueError(f'Vector of dimension {len(vector)} does not fit store {self._dir} '
+                                     f'of dimension {self._dimension}')
+                self._pending[embedding_key(self._model_id, text)] = vector
+            if len(self._pending) >= self._segment_size:
+                self._write_segment()
+
+    def flush(self):
+        """
+        Write the pending vectors as a segment
+        """
+        with self._lock:
+            if self._pending:
+                self._write_segment()
+
+    def _load(self):
+        manifest_path = os.path.join(self._dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return
+
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['dimension'] != self._dimension:
+            raise ValueError(f"Store {self._dir} has vectors of dimension {manifest['dimension']}, "
+                             f"expected {self._dimension}")
+
+        for name in manifest['segments']:
+            vectors = np.load(os.path.join(self._dir, f'vectors-{name}.npy'), mmap_mode='r')
+            keys = np.load(os.path.join(self._dir, f'keys-{name}.npy'))
+            segment = len(self._segments)
+            self._segments.append(vectors)
+            for row, key in enumerate(keys):
+                self._index[key.decode()] = (segment, row)
+        logger.info(f"Loaded {len(self._index)} vectors of model {self._model_id} "
+                    f"from {len(self._segments)} segments of {self._dir}")
+
+    def _write_segment(self):
+        name = f'{len(self._segments):06d}'
+        vectors = np.asarray(list(self._pending.values()), dtype='<f4')
+        keys = np.asarray(list(self._pending), dtype='S64')
+        for prefix, array in (('vectors', vectors), ('keys', keys)):
+            path = os.path.join(self._dir, f'{prefix}-{name}.npy')
+            with open(f'{path}.tmp', 'wb') as segment_file:
+                np.save(segment_file, array)
+            os.replace(f'{path}.tmp', path)
+
+        segment_names = [f'{segment:06d}' for segment in range(len(self._segments) + 1)]
+        manifest_path = os.path.join(self._dir, MANIFEST_FILE)
+        with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as manifest_file:
+            json.dump({'model_id': self._model_id, 'dimension': self._dimension, 'segments': segment_names},
+                      manifest_file)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+
+        segment = len(self._segments)
+        self._segments.append(np.load(os.path.join(self._dir, f'vectors-{name}.npy'), mmap_mode='r'))
+        for row, key in enumerate(self._pending):
+            self._index[key] = (segment, row)
+        logger.info(f"Stored {len(self._pending)} vectors of model {self._model_id} in segment {name}")
+        self._pending = {}
+
+
+class StoredEmbeddingClient(object):
+    """
+    An embedding client which serves vectors from an EmbeddingStore and only calls the model for the
+    sentences which are not stored yet, with the same generate_vectors interface as the clients it wraps
+    """
+
+    def __init__(self, store: EmbeddingStore, client_factory):
+        """
+        Args:
+            :store: the embedding store
+            :client_factory: creates the embedding client on the first miss, so a build served from the store
+                             never connects to the endpoint or loads a local model
+        """
+        self._store = store
+        self._client_factory = client_factory
+        self._client = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generate_vectors(self, sentences: list[str]):
+        vectors = self._store.get(sentences)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        with self._lock:
+            self.hits += len(sentences) - len(missing)
+            self.misses += len(missing)
+        if len(missing) == 0:
+            return vectors
+
+        missing_sentences = [sentences[i] for i in missing]
+        generated = self._get_client().generate_vectors(missing_sentences)
+        self._store.put(missing_sentences, generated)
+        for i, vector in zip(missing, generated):
+            vectors[i] = vector
+        return vectors
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
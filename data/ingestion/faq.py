@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import logging
+import unicodedata
+
+import requests
+
+from .opensearch import scroll_documents
+from .versioning import content_version
+
+logger = logging.getLogger(__name__)
+
+FAQ_TABLE_VERSION = 3
+
+
+def normalize_faq_question(text):
+    """
+    Casefold and drop punctuation and extra whitespace, must match lambda/semantic_search/faq.py
+    """
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = ''.join(' ' if unicodedata.category(char).startswith('P') else char for char in text)
+    return ' '.join(text.split())
+
+
+def faq_key(normalized_question):
+    return hashlib.blake2b(normalized_question.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _msearch_knn(host, index_name, vectors, hits_size, auth=None, vector_field='question_vector'):
+    lines = []
+    for vector in vectors:
+        lines.append(json.dumps({'index': index_name}))
+        lines.append(json.dumps({'size': hits_size, '_source': False,
+                                 'query': {'knn': {vector_field: {'vector': vector, 'k': hits_size}}}}))
+    response = requests.post(f'{host}_msearch', auth=auth, data='\n'.join(lines) + '\n',
+                             headers={'Content-Type': 'application/x-ndjson'})
+    response.raise_for_status()
+    responses = response.json()['responses']
+    for item in responses:
+        if item.get('error') is not None:
+            raise RuntimeError(f"kNN search of the faq table failed: {item['error']}")
+    return [[(hit['_id'], hit['_score']) for hit in item['hits']['hits']] for item in responses]
+
+
+def build_faq_table(host, index_name, auth=None, hits_size=10, batch_size=100, vector_field='question_vector'):
+    """
+    Build the exact match table of the semantic search lambda from an index.
+
+    A query equal to a question once normalized has the vector of that question, so its kNN hits are searched
+    here once per question by the stored vectors, and the lambda returns them without embedding the query.
+    Keys are 64 bit hashes of the normalized questions in a sorted array, and the lambda checks the question
+    of a matched key, so a hash collision is a miss rather than a wrong answer.
+
+    Only the ids and scores of hits are stored, the lambda fetches their sources when it serves them. The table
+    records the content version of the index it was built against, written to the index _meta by ingest.py,
+    so that the lambda stops serving the table once the index is written again until it is rebuilt. It also
+    records the k of the kNN searches, and serves only requests of the same k, as the hits of an approximate
+    search depend on k.
+
+    Args:
+        :host: opensearch url ending with '/'
+        :index_name: index or alias to read and search
+        :auth: (username, password)
+        :hits_size: k of the kNN search of a question, and the hits stored per question
+        :batch_size: kNN searches per _msearch request
+        :vector_field: field of the vectors
+    """
+    version = content_version(host, index_name, auth=auth)
+    doc_ids = []
+    positions = {}
+    entries = {}
+
+    def search_batch(batch):
+        searched = _msearch_knn(host, index_name, [vector for _, vector in batch], hits_size,
+                                auth=auth, vector_field=vector_field)
+        for (normalized, _), hits in zip(batch, searched):
+            key = faq_key(normalized)
+            if len(normalized) > 0 and key not in entries:
+                entries[key] = (normalized, hits)
+
+    # questions are searched while scrolling, so that only a batch of vectors is held in memory
+    batch = []
+    for hit in scroll_documents(host, index_name, auth=auth, source=['question', vector_field]):
+        source = hit['_source']
+        batch.append((normalize_faq_question(source.get('question')), source[vector_field]))
+        positions[hit['_id']] = len(doc_ids)
+        doc_ids.append(hit['_id'])
+        if len(batch) >= batch_size:
+            search_batch(batch)
+            batch = []
+    if len(batch) > 0:
+        search_batch(batch)
+
+    # hits refer to positions in ids, as the same documents are hits of many questions
+    for key, (normalized, hits) in entries.items():
+        entries[key] = (normalized, [[positions[doc_id], score] for doc_id, score in hits if doc_id in positions])
+
+    keys = sorted(entries)
+    return {
+        'version': FAQ_TABLE_VERSION,
+        'index_version': version,
+        'hits_size': hits_size,
+        'k': hits_size,
+        'keys': keys,
+        'questions': [entries[key][0] for key in keys],
+        'hits': [entries[key][1] for key in keys],
+        'ids': doc_ids,
+    }
+
+
+def write_faq_table(path, faq_table):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as table_file:
+        json.dump(faq_table, table_file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f'{path}.tmp', path)
+    logger.info(f"Wrote faq table of {len(faq_table['keys'])} questions to {path}")
@@ -0,0 +1,164 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONTENT_HASH_FIELD = 'content_hash'
+
+
+def document_id(row, key_fields=('question',)):
+    """
+    Deterministic document id from the key fields, so that retries and re-runs overwrite instead of duplicate
+    """
+    key = json.dumps([row.get(field) for field in key_fields], ensure_ascii=False)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def content_hash(row):
+    """
+    Hash of all source fields of a row, used to detect changed rows
+    """
+    content = json.dumps({k: v for k, v in row.items() if k != CONTENT_HASH_FIELD},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class Checkpoint(object):
+    """
+    An append-only file of the document ids and content hashes which have been indexed by the current run,
+    a crashed run is resumed by skipping the rows of which the same content was indexed.
+
+    Hashes rather than ids are kept, so that a row edited since, or a checkpoint left by a run which ended
+    with failed rows, can't make a later run skip a change.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path
+
+    def load(self):
+        """
+        Returns a dict of document id to the content hash indexed for it
+        """
+        done_hashes = {}
+        if not os.path.exists(self._path):
+            return done_hashes
+
+        with open(self._path, encoding='utf-8') as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    done_hashes.update((doc_id, doc_hash) for doc_id, doc_hash in json.loads(line))
+                except (json.JSONDecodeError, TypeError, ValueError):
+                    # the last line may be partially written by a crashed run, or be an id of an older checkpoint
+                    logger.warning(f"Skip a broken line in checkpoint {self._path}")
+        return done_hashes
+
+    def mark_done(self, done_hashes):
+        """
+        Args:
+            :done_hashes: list of (document id, content hash) of indexed documents
+        """
+        if len(done_hashes) == 0:
+            return
+        with self._lock, open(self._path, 'a', encoding='utf-8') as checkpoint_file:
+            checkpoint_file.write(json.dumps([list(pair) for pair in done_hashes]) + '\n')
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+
+    def clear(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class DeadLetterFile(object):
+    """
+    An append-only file of the rows which could not be embedded after all retries, with their error,
+    so that they can be replayed later instead of being indexed with a placeholder vector
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self.count = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    def write(self, rows, error):
+        with self._lock, open(self._path, 'a', encoding='utf-8') as dead_letter_file:
+            for row in rows:
+                dead_letter_file.write(json.dumps({'row': row, 'error': str(error)}, ensure_ascii=False) + '\n')
+            dead_letter_file.flush()
+            os.fsync(dead_letter_file.fileno())
+            self.count += len(rows)
+
+    def load(self):
+        rows = []
+        if not os.path.exists(self._path):
+            return rows
+
+        with open(self._path, encoding='utf-8') as dead_letter_file:
+            for line in dead_letter_file:
+                try:
+                    rows.append(json.loads(line)['row'])
+                except (json.JSONDecodeError, KeyError):
+                    logger.warning(f"Skip a broken line in dead letter file {self._path}")
+        return rows
+
+    def clear(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+class IncrementalPlan(object):
+    """
+    Changes to apply to the index so that it matches the source rows
+    """
+
+    def __init__(self):
+        self.upserts = []
+        self.deletes = []
+        self.unchanged = 0
+        self.resumed = 0
+
+    def __str__(self):
+        return (f"{len(self.upserts)} to upsert, {len(self.deletes)} to delete, "
+                f"{self.unchanged} unchanged, {self.resumed} done by a previous run")
+
+
+def plan_changes(rows, indexed_hashes, done_hashes=None, key_fields=('question',)):
+    """
+    Diff source rows against the index
+
+    Args:
+        :rows: source rows
+        :indexed_hashes: dict of document id to content hash currently in the index
+        :done_hashes: dict of document id to content hash indexed by a crashed run, from the checkpoint,
+            which may not be searchable yet, e.g. while refresh is off
+        :key_fields: fields that identify a row
+    """
+    done_hashes = done_hashes or {}
+    plan = IncrementalPlan()
+    source_ids = set()
+    for row in rows:
+        doc_id = document_id(row, key_fields)
+        source_ids.add(doc_id)
+        row_hash = content_hash(row)
+        if indexed_hashes.get(doc_id) == row_hash:
+            plan.unchanged += 1
+        elif done_hashes.get(doc_id) == row_hash:
+            plan.resumed += 1
+        else:
+            plan.upserts.append(row)
+
+    # deleting is idempotent, so deletes only depend on the index and not on the checkpoint
+    plan.deletes = [doc_id for doc_id in indexed_hashes if doc_id not in source_ids]
+    return plan
@@ -0,0 +1,91 @@
+import os
+import json
+import logging
+
+import numpy as np
+import onnxruntime
+from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = 'model.onnx'
+TOKENIZER_FILE = 'tokenizer.json'
+CONFIG_FILE = 'embedding_config.json'
+
+
+class LocalEmbeddingClient(object):
+    """
+    Generate embeddings in process on CPU by a model exported by infrastructure/embedding_model/export_onnx.py,
+    an alternative to SageMakerEmbeddingClient with the same generate_vectors interface.
+
+    Sentences of a call are dynamically re-batched: sorted by token length and cut into sub-batches bounded by
+    a token budget, so that short sentences are not padded to the longest one of the call.
+    """
+
+    def __init__(self, model_path: str, max_batch_tokens=8192, intra_op_threads=0):
+        """
+        Args:
+            :model_path: directory with model.onnx, tokenizer.json and embedding_config.json
+            :max_batch_tokens: max padded tokens of one model run
+            :intra_op_threads: onnxruntime intra op threads, 0 lets onnxruntime decide
+        """
+        with open(os.path.join(model_path, CONFIG_FILE), encoding='utf-8') as config_file:
+            config = json.load(config_file)
+        self._pooling = config.get('pooling', 'cls')
+        self._max_batch_tokens = max_batch_tokens
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_path, TOKENIZER_FILE))
+        self._tokenizer.enable_truncation(max_length=config.get('max_length', 128))
+        self._tokenizer.no_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = onnxruntime.InferenceSession(os.path.join(model_path, MODEL_FILE),
+                                                     sess_options=options,
+                                                     providers=['CPUExecutionProvider'])
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+        logger.info(f"Loaded local embedding model {config.get('model_id')} from {model_path}")
+
+    def generate_vectors(self, sentences: list[str]):
+        """
+        Generate one pooled vector per sentence, in the order of sentences
+        """
+        encodings = self._tokenizer.encode_batch(sentences)
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+
+        vectors = [None] * len(encodings)
+        start = 0
+        while start < len(order):
+            end = start + 1
+            # lengths grow along order, so the padded size of [start, end) is (end - start) * len(last)
+            while end < len(order) and (end + 1 - start) * len(encodings[order[end]].ids) <= self._max_batch_tokens:
+                end += 1
+
+            batch = order[start:end]
+            for i, vector in zip(batch, self._run([encodings[i] for i in batch])):
+                vectors[i] = vector
+            start = end
+
+        return vectors
+
+    def _run(self, encodings):
+        max_len = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(encodings), max_len), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), max_len), dtype=np.int64)
+        token_type_ids = np.zeros((len(encodings), max_len), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            length = len(encoding.ids)
+            input_ids[row, :length] = encoding.ids
+            attention_mask[row, :length] = encoding.attention_mask
+            token_type_ids[row, :length] = encoding.type_ids
+
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask, 'token_type_ids': token_type_ids}
+        last_hidden_state = self._session.run(None, {k: v for k, v in feeds.items() if k in self._input_names})[0]
+
+        if self._pooling == 'mean':
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        else:
+            pooled = last_hidden_state[:, 0]
+        return pooled.astype(np.float32).tolist()
@@ -0,0 +1,103 @@
+import os
+import json
+import logging
+import tempfile
+
+import numpy as np
+
+from .opensearch import scroll_documents
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+VECTORS_FILE = 'vectors.npy'
+METADATA_FILE = 'metadata.jsonl'
+HNSW_FILE = 'vectors.hnsw'
+
+
+class LocalVectorWriter(object):
+    """
+    Write documents into the files read by the local vector search backend of the semantic_search lambda:
+    a float32 matrix in vectors.npy, one json line of id and source per row in metadata.jsonl,
+    and optionally an HNSW graph of the matrix in vectors.hnsw
+    """
+
+    def __init__(self, out_dir: str, dimension: int, vector_field='question_vector'):
+        """
+        Args:
+            :out_dir: directory of the export
+            :dimension: vector dimension
+            :vector_field: field of the vector in a document
+        """
+        self._out_dir = out_dir
+        self._dimension = dimension
+        self._vector_field = vector_field
+        self._count = 0
+
+        os.makedirs(out_dir, exist_ok=True)
+        self._raw_file = tempfile.NamedTemporaryFile(dir=out_dir, suffix='.f32', delete=False)
+        self._metadata_file = open(os.path.join(out_dir, METADATA_FILE), 'w', encoding='utf-8')
+
+    def add(self, doc_id, doc):
+        source = {k: v for k, v in doc.items() if k != self._vector_field}
+        vector = np.asarray(doc[self._vector_field], dtype='<f4')
+        if vector.shape != (self._dimension,):
+            raise ValueError(f'Document {doc_id} has a vector of shape {vector.shape}, expected ({self._dimension},)')
+
+        self._raw_file.write(vector.tobytes())
+        self._metadata_file.write(json.dumps({'id': doc_id, 'source': source}, ensure_ascii=False) + '\n')
+        self._count += 1
+
+    def close(self, hnsw=False, m=32, ef_construction=256):
+        """
+        Finish the export, the matrix is streamed from a raw temp file so the corpus never sits in memory
+
+        Args:
+            :hnsw: also build an HNSW graph, requires hnswlib
+            :m: HNSW param m
+            :ef_construction: HNSW param ef_construction
+        """
+        self._raw_file.close()
+        self._metadata_file.close()
+        try:
+            vectors = np.memmap(self._raw_file.name, dtype='<f4', mode='r', shape=(self._count, self._dimension)) \
+                if self._count > 0 else np.zeros((0, self._dimension), dtype='<f4')
+            np.save(os.path.join(self._out_dir, VECTORS_FILE), vectors)
+            del vectors
+        finally:
+            os.remove(self._raw_file.name)
+
+        graph_path = os.path.join(self._out_dir, HNSW_FILE)
+        if os.path.exists(graph_path):
+            os.remove(graph_path)
+        if hnsw and self._count > 0:
+            self._build_hnsw(graph_path, m, ef_construction)
+
+        with open(os.path.join(self._out_dir, MANIFEST_FILE), 'w', encoding='utf-8') as manifest_file:
+            json.dump({'dimension': self._dimension, 'count': self._count, 'space_type': 'l2', 'hnsw': hnsw},
+                      manifest_file)
+
+        logger.info(f"Exported {self._count} vectors to {self._out_dir}")
+        return self._count
+
+    def _build_hnsw(self, graph_path, m, ef_construction):
+        import hnswlib
+
+        vectors = np.load(os.path.join(self._out_dir, VECTORS_FILE), mmap_mode='r')
+        graph = hnswlib.Index(space='l2', dim=self._dimension)
+        graph.init_index(max_elements=self._count, M=m, ef_construction=ef_construction)
+        for offset in range(0, self._count, 10000):
+            block = np.asarray(vectors[offset:offset + 10000])
+            graph.add_items(block, np.arange(offset, offset + len(block)))
+        graph.save_index(graph_path)
+
+
+def export_local_vectors(host, index_name, out_dir, auth=None, dimension=768, vector_field='question_vector',
+                         hnsw=False):
+    """
+    Export all documents of an index with their vectors for the local vector search backend
+    """
+    writer = LocalVectorWriter(out_dir, dimension=dimension, vector_field=vector_field)
+    for hit in scroll_documents(host, index_name, auth=auth):
+        writer.add(hit['_id'], hit['_source'])
+    return writer.close(hnsw=hnsw)
@@ -0,0 +1,45 @@
+import datetime
+
+# typed metadata fields of a document, filterable at search time
+METADATA_FIELDS = {
+    'category': 'keyword',
+    'source': 'keyword',
+    'language': 'keyword',
+    'updated_at': 'date',
+}
+
+
+def metadata_mappings():
+    return {field: {'type': field_type} for field, field_type in METADATA_FIELDS.items()}
+
+
+def normalize_date(value):
+    """
+    Normalize a date or datetime string to ISO 8601, e.g. 2024-05-01 or 2024-05-01T08:30:00
+    """
+    value = value.strip()
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).isoformat()
+
+
+def normalize_metadata(row, defaults=None):
+    """
+    Returns the row with its metadata fields typed, empty ones dropped and absent ones taken from defaults
+
+    Args:
+        :row: a row of question, answers and optional metadata fields
+        :defaults: metadata of all rows, e.g. {'source': 'qa_samples.csv'}
+    """
+    normalized = {k: v for k, v in row.items() if k not in METADATA_FIELDS}
+    for field, field_type in METADATA_FIELDS.items():
+        value = str(row.get(field) or '').strip() or str((defaults or {}).get(field) or '').strip()
+        if len(value) == 0:
+            continue
+
+        try:
+            normalized[field] = normalize_date(value) if field_type == 'date' else value
+        except ValueError:
+            raise ValueError(f'Invalid {field_type} {value!r} of field {field}')
+    return normalized
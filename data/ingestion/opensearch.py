@@ -0,0 +1,144 @@
+import json
+
+import boto3
+import requests
+
+from .metadata import metadata_mappings
+
+HEADERS = {"Content-Type": "application/json"}
+KNN_ENGINE = "lucene"
+
+
+def get_auth(boto3_session: boto3.Session = None):
+    """
+    Read the master user of the vector db from secrets manager
+    """
+    sm_client = (boto3_session or boto3.Session()).client('secretsmanager')
+    user_json = sm_client.get_secret_value(SecretId='VectorDBMasterUserCredentials')['SecretString']
+    data = json.loads(user_json)
+    return (data.get('username'), data.get('password'))
+
+
+def get_host(boto3_session: boto3.Session = None):
+    """
+    Read the vector db url from secrets manager, e.g. https://my-test-domain.us-east-1.es.amazonaws.com/
+    """
+    sm_client = (boto3_session or boto3.Session()).client('secretsmanager')
+    host_json = sm_client.get_secret_value(SecretId='OpenSearchHostURL')['SecretString']
+    return normalize_host(json.loads(host_json).get('host'))
+
+
+def normalize_host(host: str):
+    host = host if host.endswith('/') else host + '/'
+    return host if host.startswith('http://') or host.startswith('https://') else f'https://{host}'
+
+
+def index_payload(dimension=768):
+    # the lucene engine applies the filter of a knn query while it walks the graph, instead of after it
+    return {
+        "settings": {
+            "index.knn": True,
+            "knn.space_type": "l2"
+        },
+        "mappings": {
+            "properties": {
+                "question_vector": {
+                    "type": "knn_vector",
+                    "dimension": dimension,
+                    "method": {
+                        "name": "hnsw",
+                        "space_type": "l2",
+                        "engine": KNN_ENGINE,
+                        "parameters": {
+                            "ef_construction": 256,
+                            "m": 32
+                        }
+                    }
+                },
+                "question": {
+                    "type": "text"
+                },
+                "answers": {
+                    "type": "text"
+                },
+                "content_hash": {
+                    "type": "keyword"
+                },
+                **metadata_mappings()
+            }
+        }
+    }
+
+
+def create_index(host, index_name, auth=None, dimension=768):
+    response = requests.put(host + index_name, auth=auth, headers=HEADERS, json=index_payload(dimension))
+    response.raise_for_status()
+    return response.json()
+
+
+def index_exists(host, index_name, auth=None):
+    response = requests.head(host + index_name, auth=auth, headers=HEADERS)
+    return response.status_code == 200
+
+
+def refresh_index(host, index_name, auth=None):
+    response = requests.post(f'{host}{index_name}/_refresh', auth=auth, headers=HEADERS)
+    response.raise_for_status()
+
+
+def count_documents(host, index_name, auth=None):
+    response = requests.get(f'{host}{index_name}/_count', auth=auth, headers=HEADERS)
+    response.raise_for_status()
+    return response.json()['count']
+
+
+def warm_up_knn(host, index_name, auth=None, timeout=600):
+    """
+    Load the native knn graphs of the index into memory, so that the first searches are not cold
+    """
+    response = requests.get(f'{host}_plugins/_knn/warmup/{index_name}', auth=auth, headers=HEADERS, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def delete_index(host, index_name, auth=None):
+    response = requests.delete(host + index_name, auth=auth, headers=HEADERS)
+    if response.status_code != 404:
+        response.raise_for_status()
+
+
+def scroll_documents(host, index_name, auth=None, source=True, page_size=1000):
+    """
+    Scroll through the index and yield its hits, nothing if the index is absent
+
+    Args:
+        :source: _source filter of hits, e.g. a list of fields
+    """
+    response = requests.post(f'{host}{index_name}/_search?scroll=2m', auth=auth, headers=HEADERS,
+                             json={'size': page_size, '_source': source, 'query': {'match_all': {}}})
+    if response.status_code == 404:
+        return
+    response.raise_for_status()
+
+    output = response.json()
+    scroll_id = output.get('_scroll_id')
+    try:
+        while len(output['hits']['hits']) > 0:
+            yield from output['hits']['hits']
+
+            response = requests.post(f'{host}_search/scroll', auth=auth, headers=HEADERS,
+                                     json={'scroll': '2m', 'scroll_id': scroll_id})
+            response.raise_for_status()
+            output = response.json()
+            scroll_id = output.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id is not None:
+            requests.delete(f'{host}_search/scroll', auth=auth, headers=HEADERS, json={'scroll_id': scroll_id})
+
+
+def load_content_hashes(host, index_name, auth=None, page_size=1000):
+    """
+    Returns a dict of document id to its content hash, empty if the index is absent
+    """
+    return {hit['_id']: (hit.get('_source') or {}).get('content_hash')
+            for hit in scroll_documents(host, index_name, auth=auth, source=['content_hash'], page_size=page_size)}
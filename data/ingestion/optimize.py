@@ -0,0 +1,130 @@
+import time
+import logging
+
+import requests
+
+from .opensearch import HEADERS, KNN_ENGINE, refresh_index, warm_up_knn
+
+logger = logging.getLogger(__name__)
+
+_BULK_SETTINGS = {'index.refresh_interval': '-1', 'index.number_of_replicas': 0}
+
+
+class IndexOptimizer(object):
+    """
+    The optimization stage of an ingestion run.
+
+    Before the bulk load, refresh and replicas are turned off so that segments are not refreshed and
+    documents are not copied while loading. Afterwards the settings are restored, the index is refreshed,
+    optionally force merged to a target segment count, and its knn graphs are warmed up. Each step is timed,
+    and a failed step raises so that callers do not swap an alias to, or announce, a half optimized index.
+
+    The warmup api only loads the native graphs of the nmslib and faiss engines, lucene graphs are read
+    through the page cache, so a lucene index is warmed up by knn queries of some of its own vectors.
+    """
+
+    def __init__(self, host, index_name, auth=None, max_num_segments=1, timeout=3600, force_merge=True,
+                 engine=KNN_ENGINE, warm_up_queries=20, vector_field='question_vector'):
+        """
+        Args:
+            :host: opensearch url ending with '/'
+            :index_name: the index being loaded
+            :auth: (username, password)
+            :max_num_segments: segments per shard after force merge
+            :timeout: seconds of force merge and warmup requests
+            :force_merge: force merge the index, only meant for an index which is not searched yet
+            :engine: knn engine of the index, lucene, faiss or nmslib
+            :warm_up_queries: knn queries which warm up a lucene index
+            :vector_field: field of the vectors
+        """
+        self._host = host
+        self._index_name = index_name
+        self._auth = auth
+        self._max_num_segments = max_num_segments
+        self._timeout = timeout
+        self._force_merge_enabled = force_merge
+        self._engine = engine
+        self._warm_up_queries = warm_up_queries
+        self._vector_field = vector_field
+        self._original_settings = None
+        self.timings = []
+
+    def begin_bulk(self):
+        """
+        Turn off refresh and replicas for the bulk load, remembering the settings to restore
+        """
+        def apply():
+            self._original_settings = self._get_settings(list(_BULK_SETTINGS))
+            self._put_settings(_BULK_SETTINGS)
+
+        self._timed('bulk_settings', apply)
+
+    def end_bulk(self):
+        """
+        Restore the settings changed by begin_bulk, safe to call when it was not called or failed
+        """
+        if self._original_settings is None:
+            return
+        # absent settings are reset to their defaults by null
+        restored = {key: self._original_settings.get(key) for key in _BULK_SETTINGS}
+        self._timed('restore_settings', lambda: self._put_settings(restored))
+        self._original_settings = None
+
+    def optimize(self):
+        """
+        Refresh, force merge if enabled and warm up the index, returns the timings of all steps
+        """
+        self._timed('refresh', lambda: refresh_index(self._host, self._index_name, auth=self._auth))
+        if self._force_merge_enabled:
+            self._timed('force_merge', self._force_merge)
+        if self._engine == 'lucene':
+            self._timed('knn_warmup_queries', self._warm_up_by_queries)
+        else:
+            self._timed('knn_warmup', lambda: warm_up_knn(self._host, self._index_name, auth=self._auth,
+                                                          timeout=self._timeout))
+        return self.timings
+
+    def _timed(self, step, action):
+        start = time.perf_counter()
+        try:
+            action()
+        except Exception:
+            logger.exception(f"Optimization step {step} of index {self._index_name} failed")
+            raise
+        seconds = time.perf_counter() - start
+        self.timings.append({'step': step, 'seconds': seconds})
+        logger.info(f"Optimization step {step} of index {self._index_name} took {seconds:.2f}s")
+
+    def _get_settings(self, keys):
+        response = requests.get(f"{self._host}{self._index_name}/_settings/{','.join(keys)}",
+                                auth=self._auth, headers=HEADERS, params={'flat_settings': 'true'})
+        response.raise_for_status()
+        return next(iter(response.json().values()), {}).get('settings', {})
+
+    def _put_settings(self, settings):
+        response = requests.put(f'{self._host}{self._index_name}/_settings', auth=self._auth, headers=HEADERS,
+                                json=settings)
+        response.raise_for_status()
+
+    def _search(self, body):
+        response = requests.post(f'{self._host}{self._index_name}/_search', auth=self._auth, headers=HEADERS,
+                                 json=body, timeout=self._timeout)
+        response.raise_for_status()
+        return response.json()['hits']['hits']
+
+    def _warm_up_by_queries(self):
+        sampled = self._search({'size': self._warm_up_queries, '_source': [self._vector_field],
+                                'query': {'function_score': {'random_score': {}}}})
+        for hit in sampled:
+            vector = hit.get('_source', {}).get(self._vector_field)
+            if vector is not None:
+                self._search({'size': 10, '_source': False,
+                              'query': {'knn': {self._vector_field: {'vector': vector, 'k': 10}}}})
+
+    def _force_merge(self):
+        response = requests.post(f'{self._host}{self._index_name}/_forcemerge', auth=self._auth, headers=HEADERS,
+                                 params={'max_num_segments': self._max_num_segments}, timeout=self._timeout)
+        response.raise_for_status()
+        failed = response.json().get('_shards', {}).get('failed', 0)
+        if failed > 0:
+            raise RuntimeError(f'Force merge failed on {failed} shards')
@@ -0,0 +1,271 @@
+import time
+import queue
+import logging
+import threading
+
+from .bulk import BulkChunker
+from .incremental import CONTENT_HASH_FIELD, content_hash, document_id
+from .throttling import is_retryable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ThroughputMeter(object):
+    """
+    Thread-safe counters of the ingestion with docs/s and bytes/s since start
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._start = clock()
+        self._lock = threading.Lock()
+        self._embedded = 0
+        self._indexed = 0
+        self._failed = 0
+        self._bytes = 0
+
+    def record_embedded(self, doc_count):
+        with self._lock:
+            self._embedded += doc_count
+
+    def record_indexed(self, doc_count, byte_count):
+        with self._lock:
+            self._indexed += doc_count
+            self._bytes += byte_count
+
+    def record_failed(self, doc_count):
+        with self._lock:
+            self._failed += doc_count
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(self._clock() - self._start, 1e-9)
+            return {
+                'embedded': self._embedded,
+                'indexed': self._indexed,
+                'failed': self._failed,
+                'bytes': self._bytes,
+                'elapsed_seconds': elapsed,
+                'docs_per_second': self._indexed / elapsed,
+                'bytes_per_second': self._bytes / elapsed,
+            }
+
+    def report(self):
+        stats = self.snapshot()
+        logger.info(f"embedded {stats['embedded']}, indexed {stats['indexed']}, failed {stats['failed']} docs "
+                    f"in {stats['elapsed_seconds']:.1f}s, {stats['docs_per_second']:.1f} docs/s, "
+                    f"{stats['bytes_per_second'] / 1024:.1f} KB/s")
+        return stats
+
+
+class IngestionPipeline(object):
+    """
+    Ingest rows into opensearch with batched embedding calls and chunked _bulk requests.
+
+    Rows flow through two bounded queues, reader -> embed workers -> index workers, so a slow
+    stage blocks the one before it instead of buffering the whole corpus in memory.
+    """
+
+    def __init__(self,
+                 embedding_client,
+                 bulk_indexer,
+                 index_name: str,
+                 text_field='question',
+                 vector_field='question_vector',
+                 embed_batch_size=16,
+                 embed_workers=2,
+                 index_workers=2,
+                 bulk_max_docs=500,
+                 bulk_max_bytes=5 * 1024 * 1024,
+                 queue_size=8,
+                 report_interval=10,
+                 key_fields=('question',),
+                 checkpoint=None,
+                 dead_letter=None):
+        """
+        Args:
+            :embedding_client: client with generate_vectors(sentences)
+            :bulk_indexer: indexer with send(chunk)
+            :index_name: target index
+            :text_field: field of a row to embed
+            :vector_field: field to store the vector
+            :embed_batch_size: sentences per embedding call
+            :embed_workers: concurrent embedding calls
+            :index_workers: concurrent _bulk requests
+            :bulk_max_docs: max documents per _bulk body
+            :bulk_max_bytes: max bytes per _bulk body
+            :queue_size: max batches or chunks waiting between stages
+            :report_interval: seconds between throughput reports
+            :key_fields: fields of a row hashed into its document id
+            :checkpoint: optional checkpoint which records ids and content hashes once their _bulk request succeeded
+            :dead_letter: optional dead letter file which records the rows which failed before their _bulk request
+        """
+        self._embedding_client = embedding_client
+        self._bulk_indexer = bulk_indexer
+        self._index_name = index_name
+        self._text_field = text_field
+        self._vector_field = vector_field
+        self._embed_batch_size = embed_batch_size
+        self._embed_workers = embed_workers
+        self._index_workers = index_workers
+        self._bulk_max_docs = bulk_max_docs
+        self._bulk_max_bytes = bulk_max_bytes
+        self._queue_size = queue_size
+        self._report_interval = report_interval
+        self._key_fields = key_fields
+        self._checkpoint = checkpoint
+        self._dead_letter = dead_letter
+
+    def run(self, rows, delete_ids=()):
+        """
+        Ingest all rows and returns the final throughput stats
+
+        Args:
+            :rows: iterable of dict, each is upserted as a document with its vector and content hash
+            :delete_ids: ids of documents to delete from the index
+        """
+        embed_queue = queue.Queue(maxsize=self._queue_size)
+        index_queue = queue.Queue(maxsize=self._queue_size)
+        chunker = BulkChunker(max_docs=self._bulk_max_docs, max_bytes=self._bulk_max_bytes)
+        meter = ThroughputMeter()
+        reporting = threading.Event()
+
+        embed_threads = [threading.Thread(target=self._embed_loop, args=(embed_queue, index_queue, chunker, meter),
+                                          name=f'embed-{i}', daemon=True)
+                         for i in range(self._embed_workers)]
+        index_threads = [threading.Thread(target=self._index_loop, args=(index_queue, meter),
+                                          name=f'index-{i}', daemon=True)
+                         for i in range(self._index_workers)]
+        reporter = threading.Thread(target=self._report_loop, args=(reporting, meter), name='reporter', daemon=True)
+        for thread in embed_threads + index_threads + [reporter]:
+            thread.start()
+
+        for batch in self._batches(rows):
+            embed_queue.put(batch)
+
+        for doc_id in delete_ids:
+            for chunk in chunker.add(BulkChunker.delete_action(self._index_name, doc_id), doc_id):
+                index_queue.put(chunk)
+
+        for _ in embed_threads:
+            embed_queue.put(_STOP)
+        for thread in embed_threads:
+            thread.join()
+
+        last_chunk = chunker.flush()
+        if last_chunk is not None:
+            index_queue.put(last_chunk)
+        for _ in index_threads:
+            index_queue.put(_STOP)
+        for thread in index_threads:
+            thread.join()
+
+        reporting.set()
+        reporter.join()
+        return meter.report()
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self._embed_batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def _embed_loop(self, embed_queue, index_queue, chunker, meter):
+        while True:
+            batch = embed_queue.get()
+            if batch is _STOP:
+                return
+
+            # a worker must outlive a bad row, run() waits on the queues for all of them
+            rows = []
+            for row in batch:
+                missing = [field for field in (self._text_field,) + tuple(self._key_fields) if field not in row]
+                if len(missing) > 0:
+                    self._fail_rows([row], KeyError(f"row is missing fields {missing}"), meter)
+                else:
+                    rows.append(row)
+            try:
+                embedded = self._embed_rows(rows, meter) if len(rows) > 0 else []
+            except Exception as error:
+                self._fail_rows(rows, error, meter)
+                continue
+
+            for row, vector in embedded:
+                try:
+                    doc_id = document_id(row, self._key_fields)
+                    doc = dict(row)
+                    doc[CONTENT_HASH_FIELD] = content_hash(row)
+                    doc[self._vector_field] = vector
+                    chunks = chunker.add(BulkChunker.index_action(self._index_name, doc, doc_id), doc_id,
+                                         doc[CONTENT_HASH_FIELD])
+                except Exception as error:
+                    self._fail_rows([row], error, meter)
+                    continue
+                for chunk in chunks:
+                    index_queue.put(chunk)
+
+    def _embed_rows(self, batch, meter):
+        """
+        Returns (row, vector) of the rows of a batch which could be embedded. A batch failing with an error
+        which retries can't fix, e.g. a malformed row, is bisected, so that only the rows which still fail
+        alone are dead-lettered, and not the good rows batched with them
+        """
+        try:
+            vectors = self._embedding_client.generate_vectors([row[self._text_field] for row in batch])
+        except Exception as error:
+            if len(batch) > 1 and not is_retryable(error):
+                logger.warning(f"Couldn't generate embeddings for {len(batch)} rows, split them: {error!r}")
+                middle = len(batch) // 2
+                return self._embed_rows(batch[:middle], meter) + self._embed_rows(batch[middle:], meter)
+
+            self._fail_rows(batch, error, meter)
+            return []
+
+        meter.record_embedded(len(batch))
+        return list(zip(batch, vectors))
+
+    def _fail_rows(self, rows, error, meter):
+        """
+        Counts rows which can't be indexed as failed and writes them to the dead letter file
+        """
+        logger.error(f"Couldn't ingest {len(rows)} rows: {error!r}", exc_info=error)
+        meter.record_failed(len(rows))
+        if self._dead_letter is not None:
+            try:
+                self._dead_letter.write(rows, error)
+            except Exception:
+                logger.exception(f"Couldn't write {len(rows)} rows to the dead letter file")
+
+    def _index_loop(self, index_queue, meter):
+        while True:
+            chunk = index_queue.get()
+            if chunk is _STOP:
+                return
+
+            try:
+                result = self._bulk_indexer.send(chunk)
+            except Exception:
+                logger.exception(f"Couldn't send _bulk request with {chunk.doc_count} docs")
+                meter.record_failed(chunk.doc_count)
+                continue
+
+            if result.failed > 0:
+                logger.warning(f"{result.failed} docs failed in _bulk request, first error: {result.errors[0]}")
+            meter.record_indexed(result.indexed, len(chunk.body))
+            meter.record_failed(result.failed)
+            if self._checkpoint is not None:
+                failed_ids = {error['id'] for error in result.errors}
+                # deletes are planned from the index alone, only indexed contents are checkpointed
+                done = zip(chunk.doc_ids, chunk.content_hashes)
+                self._checkpoint.mark_done([(doc_id, doc_hash) for doc_id, doc_hash in done
+                                            if doc_hash is not None and doc_id not in failed_ids])
+
+    def _report_loop(self, reporting, meter):
+        while not reporting.wait(self._report_interval):
+            meter.report()
@@ -0,0 +1,87 @@
+import os
+import csv
+import json
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_INDEX_VERSION = 1
+
+
+def normalize_suggest_text(text):
+    """
+    Normalize a question or a typed prefix, must match lambda/semantic_search/suggest.py
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+
+def load_popularity(csv_path):
+    """
+    Read popularity counts of questions from a csv with question and count columns, e.g. exported from search logs
+    """
+    popularity = {}
+    with open(csv_path, encoding='utf-8') as csv_file_handler:
+        for row in csv.DictReader(csv_file_handler):
+            key = normalize_suggest_text(row['question'])
+            popularity[key] = popularity.get(key, 0) + int(row.get('count') or 0)
+    return popularity
+
+
+def build_suggest_index(questions, popularity=None, head_length=4, head_size=10):
+    """
+    Build the prefix index of the suggest route of the semantic search lambda.
+
+    Each question is keyed by its normalized text and by every suffix starting at a word, so that typing a word
+    from the middle of a question completes it too. Keys are sorted for a binary search of a prefix range, and the
+    most popular questions of every prefix up to head_length characters are precomputed, as short prefixes
+    have ranges too wide to scan per keystroke.
+
+    Args:
+        :questions: question texts
+        :popularity: dict of normalized question to count, questions absent count 0
+        :head_length: max length of the precomputed prefixes
+        :head_size: questions kept per precomputed prefix, the max size of a suggestion
+    """
+    popularity = popularity or {}
+    ranked = {}
+    for question in questions:
+        key = normalize_suggest_text(question)
+        if len(key) > 0 and key not in ranked:
+            ranked[key] = (' '.join(question.split()), popularity.get(key, 0))
+    # ids are ranks, so the best questions of a range are its smallest ids
+    ordered = sorted(ranked.items(), key=lambda item: (-item[1][1], len(item[0]), item[0]))
+
+    entries = []
+    heads = {}
+    for question_id, (key, _) in enumerate(ordered):
+        words = key.split(' ')
+        for start in range(len(words)):
+            suffix = ' '.join(words[start:])
+            entries.append((suffix, question_id))
+            for length in range(1, min(head_length, len(suffix)) + 1):
+                head = heads.setdefault(suffix[:length], [])
+                if len(head) < head_size and (len(head) == 0 or head[-1] != question_id):
+                    head.append(question_id)
+    entries.sort()
+
+    return {
+        'version': SUGGEST_INDEX_VERSION,
+        'head_length': head_length,
+        'head_size': head_size,
+        'questions': [[question, count] for _, (question, count) in ordered],
+        'keys': [key for key, _ in entries],
+        'ids': [question_id for _, question_id in entries],
+        'heads': heads,
+    }
+
+
+def write_suggest_index(path, suggest_index):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as index_file:
+        json.dump(suggest_index, index_file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f'{path}.tmp', path)
+    logger.info(f"Wrote suggest index of {len(suggest_index['questions'])} questions "
+                f"and {len(suggest_index['keys'])} keys to {path}")
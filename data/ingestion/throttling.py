@@ -0,0 +1,168 @@
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+logger = logging.getLogger(__name__)
+
+# error codes of sagemaker runtime for an endpoint which has more requests than it can serve
+THROTTLING_CODES = {'ThrottlingException', 'Throttling', 'TooManyRequestsException', 'ServiceUnavailable'}
+RETRYABLE_CODES = {'InternalFailure', 'InternalServerError', 'ModelNotReadyException'}
+
+
+def is_throttling(error):
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get('Error', {}).get('Code')
+    return code in THROTTLING_CODES or (code == 'ModelError' and error.response.get('OriginalStatusCode') == 429)
+
+
+def is_retryable(error):
+    """
+    Whether a failed embedding call may succeed when retried, e.g. not a validation error or a malformed input
+    """
+    if isinstance(error, (ConnectionError, HTTPClientError)) or is_throttling(error):
+        return True
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get('Error', {}).get('Code')
+    return code in RETRYABLE_CODES or (code == 'ModelError' and error.response.get('OriginalStatusCode', 0) >= 500)
+
+
+class AimdController(object):
+    """
+    An additive-increase/multiplicative-decrease limit of concurrent calls to the embedding endpoint.
+
+    The limit grows by about one call per limit successful calls, and is cut by decrease_factor when the
+    endpoint throttles or a call is slower than latency_target, at most once per cooldown so that the
+    throttled calls of one burst cut it once.
+    """
+
+    def __init__(self, initial_limit=1, min_limit=1, max_limit=8, decrease_factor=0.5, latency_target=None,
+                 cooldown=1.0, clock=time.monotonic):
+        """
+        Args:
+            :initial_limit: concurrent calls allowed at start
+            :min_limit: lowest limit
+            :max_limit: highest limit, there is no use above the number of embed workers
+            :decrease_factor: multiplier of the limit on congestion
+            :latency_target: seconds above which a successful call counts as congestion, None to ignore latency
+            :cooldown: min seconds between two decreases
+        """
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._decrease_factor = decrease_factor
+        self._latency_target = latency_target
+        self._cooldown = cooldown
+        self._clock = clock
+        self._last_decrease = None
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._throttled = 0
+        self._slow = 0
+        self._decreases = 0
+
+    @property
+    def limit(self):
+        with self._condition:
+            return int(self._limit)
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one of the limited concurrent calls, blocks until one is free
+        """
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self, latency):
+        with self._condition:
+            if self._latency_target is not None and latency > self._latency_target:
+                self._slow += 1
+                self._decrease()
+            else:
+                self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            self._throttled += 1
+            self._decrease()
+
+    def snapshot(self):
+        with self._condition:
+            return {'limit': int(self._limit), 'throttled': self._throttled, 'slow': self._slow,
+                    'decreases': self._decreases}
+
+    def _decrease(self):
+        now = self._clock()
+        if self._last_decrease is not None and now - self._last_decrease < self._cooldown:
+            return
+        self._last_decrease = now
+        self._decreases += 1
+        self._limit = max(self._min_limit, self._limit * self._decrease_factor)
+        logger.info(f"Embedding concurrency limit decreased to {int(self._limit)}")
+
+
+class AdaptiveEmbeddingClient(object):
+    """
+    An embedding client which paces calls by an AimdController and retries failed calls with exponential backoff
+    and full jitter, with the same generate_vectors interface as the client it wraps
+    """
+
+    def __init__(self, client, controller: AimdController, max_attempts=5, base_delay=0.5, max_delay=20.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            :client: the embedding client
+            :controller: limit of concurrent calls, shared by the embed workers
+            :max_attempts: calls of a batch before its error is raised
+            :base_delay: seconds of the first backoff
+            :max_delay: max seconds of a backoff
+        """
+        self._client = client
+        self._controller = controller
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    def generate_vectors(self, sentences: list[str]):
+        attempt = 1
+        while True:
+            with self._controller.slot():
+                start = self._clock()
+                try:
+                    vectors = self._client.generate_vectors(sentences)
+                except Exception as error:
+                    if is_throttling(error):
+                        self._controller.on_throttle()
+                    if attempt >= self._max_attempts or not is_retryable(error):
+                        raise
+                    failure = error
+                else:
+                    self._controller.on_success(self._clock() - start)
+                    return vectors
+
+            delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** (attempt - 1)))
+            logger.warning(f"Embedding call of {len(sentences)} sentences failed by {failure}, "
+                           f"retry {attempt} in {delay:.2f}s")
+            with self._lock:
+                self.retries += 1
+            self._sleep(delay)
+            attempt += 1
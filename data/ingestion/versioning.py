@@ -0,0 +1,144 @@
+import re
+import time
+import uuid
+import logging
+
+import requests
+
+from .opensearch import HEADERS
+
+logger = logging.getLogger(__name__)
+
+_VERSION_SUFFIX = re.compile(r'-v(\d{14})$')
+
+# key in the _meta of an index of the version of its content, which the lambda's faq table and semantic cache check
+CONTENT_VERSION_META = 'content_version'
+
+
+def new_version_name(alias, clock=time.time):
+    """
+    Name of a new versioned index behind an alias, e.g. qa_knowledge_index-v20240501083000
+    """
+    return f"{alias}-v{time.strftime('%Y%m%d%H%M%S', time.gmtime(clock()))}"
+
+
+def new_content_version(clock=time.time):
+    """
+    A unique content version, e.g. 20240501083000-3f2a9c1e
+    """
+    return f"{time.strftime('%Y%m%d%H%M%S', time.gmtime(clock()))}-{uuid.uuid4().hex[:8]}"
+
+
+def set_content_version(host, index_name, version, auth=None):
+    """
+    Record the content version in the _meta of the index, after the index was written to
+    """
+    response = requests.put(f'{host}{index_name}/_mapping', auth=auth, headers=HEADERS,
+                            json={'_meta': {CONTENT_VERSION_META: version}})
+    response.raise_for_status()
+
+
+def content_version(host, index_name, auth=None):
+    """
+    Version of the content behind an index or alias, the name and the recorded content version of each index,
+    so that it changes when the index is written by ingest.py or its alias is switched.
+    Must match index_version of the lambda.
+    """
+    response = requests.get(f'{host}{index_name}/_mapping', auth=auth, headers=HEADERS)
+    response.raise_for_status()
+    return ','.join(f"{name}:{(mapping.get('mappings') or {}).get('_meta', {}).get(CONTENT_VERSION_META)}"
+                    for name, mapping in sorted(response.json().items()))
+
+
+def list_versions(host, alias, auth=None):
+    """
+    Returns the versioned indexes of an alias, oldest first
+    """
+    response = requests.get(f'{host}_cat/indices/{alias}-v*', auth=auth, headers=HEADERS,
+                            params={'format': 'json', 'h': 'index'})
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    names = [item['index'] for item in response.json()]
+    return sorted(name for name in names if _VERSION_SUFFIX.search(name) and name.startswith(f'{alias}-v'))
+
+
+def get_alias_targets(host, alias, auth=None):
+    """
+    Returns the indexes the alias points to, empty if the alias is absent
+    """
+    response = requests.get(f'{host}_alias/{alias}', auth=auth, headers=HEADERS)
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    return sorted(response.json().keys())
+
+
+def is_concrete_index(host, name, auth=None):
+    """
+    Whether name is an index itself rather than an alias, e.g. an index created before versioning
+    """
+    response = requests.get(f'{host}{name}', auth=auth, headers=HEADERS)
+    if response.status_code == 404:
+        return False
+    response.raise_for_status()
+    return name in response.json()
+
+
+def swap_alias(host, alias, index_name, auth=None, replace_index=False):
+    """
+    Atomically point the alias to index_name only
+
+    Args:
+        :replace_index: delete a concrete index named as the alias in the same request, to migrate it
+    Returns:
+        the indexes the alias pointed to before
+    """
+    previous = get_alias_targets(host, alias, auth=auth)
+    actions = [{'remove': {'index': target, 'alias': alias}} for target in previous if target != index_name]
+    if replace_index and is_concrete_index(host, alias, auth=auth):
+        actions.append({'remove_index': {'index': alias}})
+    actions.append({'add': {'index': index_name, 'alias': alias}})
+
+    response = requests.post(f'{host}_aliases', auth=auth, headers=HEADERS, json={'actions': actions})
+    response.raise_for_status()
+    logger.info(f"Alias {alias} points to {index_name} instead of {', '.join(previous) or 'nothing'}")
+    return previous
+
+
+def rollback(host, alias, auth=None):
+    """
+    Point the alias to the version before the current one, returns it
+    """
+    targets = get_alias_targets(host, alias, auth=auth)
+    versions = list_versions(host, alias, auth=auth)
+    current = max(targets) if targets else None
+    older = [version for version in versions if current is None or version < current]
+    if len(older) == 0:
+        raise RuntimeError(f'Alias {alias} has no version before {current} to roll back to')
+
+    swap_alias(host, alias, older[-1], auth=auth)
+    return older[-1]
+
+
+def garbage_collect(host, alias, keep=2, auth=None):
+    """
+    Delete the versions older than the newest keep ones, never the ones the alias points to
+
+    Returns:
+        the deleted indexes
+    """
+    targets = set(get_alias_targets(host, alias, auth=auth))
+    versions = list_versions(host, alias, auth=auth)
+    kept = set(versions[-keep:]) if keep > 0 else set()
+    deleted = []
+    for version in versions:
+        if version in kept or version in targets:
+            continue
+        response = requests.delete(f'{host}{version}', auth=auth, headers=HEADERS)
+        if response.status_code != 404:
+            response.raise_for_status()
+        deleted.append(version)
+    if deleted:
+        logger.info(f"Deleted old versions of {alias}: {', '.join(deleted)}")
+    return deleted
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import base64
+import struct
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DIMENSION = 4
+
+
+class FakeOpenSearch(object):
+    """
+    In-process stand-in of the sagemaker embedding endpoint and the opensearch _bulk api
+
+    Sentences listed in bad_sentences fail their whole embedding call with a 400 ValidationError,
+    and ids listed in rejected_ids fail their _bulk item.
+    """
+
+    def __init__(self):
+        self.documents = {}
+        self.embed_calls = []
+        self.bulk_calls = []
+        self.bad_sentences = set()
+        self.rejected_ids = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self._server.server_port}/'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def vector(sentence):
+        return [float(len(sentence)), 1.0, 2.0, 3.0]
+
+    def _embed(self, body):
+        sentences = json.loads(body)['inputs']
+        with self._lock:
+            self.embed_calls.append(sentences)
+        if any(sentence in self.bad_sentences for sentence in sentences):
+            return 400, {'x-amzn-ErrorType': 'ValidationError'}, {'message': 'malformed input'}
+        vectors = [base64.b64encode(struct.pack(f'<{DIMENSION}f', *FakeOpenSearch.vector(sentence))).decode()
+                   for sentence in sentences]
+        return 200, {}, {'encoding': 'float32', 'dimension': DIMENSION, 'vectors': vectors}
+
+    def _bulk(self, body):
+        lines = iter(body.decode('utf-8').strip().split('\n'))
+        items = []
+        with self._lock:
+            self.bulk_calls.append(body)
+            for line in lines:
+                operation, meta = next(iter(json.loads(line).items()))
+                if operation == 'index':
+                    doc = json.loads(next(lines))
+                    if meta['_id'] in self.rejected_ids:
+                        items.append({operation: {'_id': meta['_id'], 'status': 400,
+                                                  'error': {'type': 'mapper_parsing_exception'}}})
+                        continue
+                    self.documents[meta['_id']] = doc
+                else:
+                    self.documents.pop(meta['_id'], None)
+                items.append({operation: {'_id': meta['_id'], 'status': 200}})
+        return 200, {}, {'errors': any('error' in next(iter(item.values())) for item in items), 'items': items}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.endswith('/invocations'):
+                    status, headers, output = fake._embed(body)
+                elif self.path == '/_bulk':
+                    status, headers, output = fake._bulk(body)
+                else:
+                    status, headers, output = 404, {}, {'error': 'not found'}
+
+                payload = json.dumps(output).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+@pytest.fixture
+def fake_opensearch(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    fake = FakeOpenSearch().start()
+    yield fake
+    fake.stop()
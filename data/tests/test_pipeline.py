@@ -0,0 +1,90 @@
+from ingestion.bulk import BulkIndexer
+from ingestion.embedding import SageMakerEmbeddingClient
+from ingestion.incremental import CONTENT_HASH_FIELD, Checkpoint, DeadLetterFile, content_hash, document_id
+from ingestion.pipeline import IngestionPipeline
+
+
+def _rows(count):
+    return [{'question': f'question {i}', 'answers': f'answer {i}'} for i in range(count)]
+
+
+def _pipeline(fake, **kwargs):
+    embedding_client = SageMakerEmbeddingClient('test-endpoint', endpoint_url=fake.url, max_attempts=1)
+    options = dict(index_name='kb', embed_batch_size=4, embed_workers=2, index_workers=2, bulk_max_docs=5,
+                   report_interval=60)
+    options.update(kwargs)
+    return IngestionPipeline(embedding_client, BulkIndexer(fake.url, pool_size=2), **options)
+
+
+def test_indexes_rows_with_vectors_and_content_hashes(fake_opensearch):
+    rows = _rows(23)
+
+    stats = _pipeline(fake_opensearch).run(rows)
+
+    assert stats['embedded'] == 23 and stats['indexed'] == 23 and stats['failed'] == 0
+    assert set(fake_opensearch.documents) == {document_id(row) for row in rows}
+    for row in rows:
+        doc = fake_opensearch.documents[document_id(row)]
+        assert doc['question_vector'] == fake_opensearch.vector(row['question'])
+        assert doc[CONTENT_HASH_FIELD] == content_hash(row)
+    assert all(len(sentences) <= 4 for sentences in fake_opensearch.embed_calls)
+    assert all(body.count(b'"index"') <= 5 for body in fake_opensearch.bulk_calls)
+
+
+def test_deletes_ids(fake_opensearch):
+    rows = _rows(3)
+    _pipeline(fake_opensearch).run(rows)
+
+    stats = _pipeline(fake_opensearch).run([], delete_ids=[document_id(rows[0])])
+
+    assert stats['indexed'] == 1
+    assert set(fake_opensearch.documents) == {document_id(row) for row in rows[1:]}
+
+
+def test_dead_letters_only_the_rows_which_fail_alone(fake_opensearch, tmp_path):
+    rows = _rows(8)
+    fake_opensearch.bad_sentences.add(rows[5]['question'])
+    dead_letter = DeadLetterFile(str(tmp_path / 'dead_letter.jsonl'))
+
+    stats = _pipeline(fake_opensearch, dead_letter=dead_letter).run(rows)
+
+    assert stats['indexed'] == 7 and stats['failed'] == 1
+    assert dead_letter.load() == [rows[5]]
+    assert document_id(rows[5]) not in fake_opensearch.documents
+
+
+def test_dead_letters_rows_missing_a_field_and_keeps_going(fake_opensearch, tmp_path):
+    rows = [dict(row, category='casting') for row in _rows(6)]
+    del rows[1]['category']
+    del rows[4]['question']
+    dead_letter = DeadLetterFile(str(tmp_path / 'dead_letter.jsonl'))
+
+    stats = _pipeline(fake_opensearch, embed_workers=1, key_fields=('question', 'category'),
+                      dead_letter=dead_letter).run(rows)
+
+    assert stats['indexed'] == 4 and stats['failed'] == 2
+    assert dead_letter.load() == [rows[1], rows[4]]
+    assert set(fake_opensearch.documents) == {document_id(row, ('question', 'category'))
+                                              for i, row in enumerate(rows) if i not in (1, 4)}
+
+
+def test_checkpoints_indexed_hashes_but_not_rejected_docs(fake_opensearch, tmp_path):
+    rows = _rows(6)
+    fake_opensearch.rejected_ids.add(document_id(rows[2]))
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.jsonl'))
+
+    stats = _pipeline(fake_opensearch, checkpoint=checkpoint).run(rows, delete_ids=['absent'])
+
+    assert stats['indexed'] == 6 and stats['failed'] == 1
+    expected = {document_id(row): content_hash(row) for i, row in enumerate(rows) if i != 2}
+    assert checkpoint.load() == expected
+
+
+def test_checkpoint_skips_a_partially_written_line(tmp_path):
+    path = tmp_path / 'checkpoint.jsonl'
+    checkpoint = Checkpoint(str(path))
+    checkpoint.mark_done([('a', 'hash-a')])
+    with open(path, 'a', encoding='utf-8') as checkpoint_file:
+        checkpoint_file.write('[["b", "ha')
+
+    assert checkpoint.load() == {'a': 'hash-a'}
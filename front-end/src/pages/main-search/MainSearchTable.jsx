@@ -37,11 +37,16 @@ const MainSearchTable = ({
     })
       .then((response) => {
         const _tmp_data = [];
-        if (!response || !response.data || !Array.isArray(response.data)) {
+        if (
+          !response ||
+          !response.data ||
+          !Array.isArray(response.data.results)
+        ) {
           setNewItems(_tmp_data);
+          return;
         }
 
-        response.data.forEach((item) => {
+        response.data.results.forEach((item) => {
           if (!item["source"]) {
             return;
           }
@@ -0,0 +1,106 @@
+import os
+import json
+import base64
+import logging
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+_MAX_LENGTH = int(os.environ.get("EMBEDDING_MAX_LENGTH", "512"))
+_DEFAULT_POOLING = os.environ.get("EMBEDDING_POOLING", "cls")
+_DEFAULT_ENCODING = os.environ.get("EMBEDDING_ENCODING", "json")
+
+_ENCODINGS = {
+    "float32": np.float32,
+    "float16": np.float16,
+}
+
+
+def model_fn(model_dir):
+    """
+    Load the tokenizer and model, from model_dir if the hub model was exported there or from HF_MODEL_ID
+    """
+    model_id = model_dir if os.path.exists(os.path.join(model_dir, "config.json")) else os.environ["HF_MODEL_ID"]
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModel.from_pretrained(model_id).to(device)
+    model.eval()
+
+    logger.info(f"Loaded embedding model {model_id} on {device}")
+    return {"tokenizer": tokenizer, "model": model, "device": device}
+
+
+def input_fn(request_body, content_type="application/json"):
+    if content_type != "application/json":
+        raise ValueError(f"Unsupported content type: {content_type}")
+
+    data = json.loads(request_body)
+    inputs = data.get("inputs")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if not isinstance(inputs, list) or len(inputs) == 0:
+        raise ValueError("inputs should be a string or a non-empty list of strings")
+
+    parameters = data.get("parameters") or {}
+    return {
+        "inputs": inputs,
+        "pooling": parameters.get("pooling", _DEFAULT_POOLING),
+        "encoding": parameters.get("encoding", _DEFAULT_ENCODING),
+    }
+
+
+def _pool(last_hidden_state, attention_mask, pooling):
+    if pooling == "cls":
+        return last_hidden_state[:, 0]
+
+    if pooling == "mean":
+        mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+        return (last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+    raise ValueError(f"Unsupported pooling: {pooling}")
+
+
+def predict_fn(data, model_and_tokenizer):
+    """
+    Run the model and pool the token embeddings into one sentence vector per input on the server
+    """
+    tokenizer = model_and_tokenizer["tokenizer"]
+    model = model_and_tokenizer["model"]
+    device = model_and_tokenizer["device"]
+
+    encoded = tokenizer(data["inputs"],
+                        padding=True,
+                        truncation=True,
+                        max_length=_MAX_LENGTH,
+                        return_tensors="pt").to(device)
+    with torch.no_grad():
+        output = model(**encoded)
+
+    pooled = _pool(output.last_hidden_state, encoded["attention_mask"], data["pooling"])
+    return {"vectors": pooled.float().cpu().numpy(), "encoding": data["encoding"]}
+
+
+def output_fn(prediction, accept="application/json"):
+    """
+    Serialize vectors as json floats or as base64 little-endian float32/float16 bytes
+    """
+    vectors = prediction["vectors"]
+    encoding = prediction["encoding"]
+
+    if encoding == "json":
+        serialized = vectors.tolist()
+    elif encoding in _ENCODINGS:
+        dtype = np.dtype(_ENCODINGS[encoding]).newbyteorder("<")
+        serialized = [base64.b64encode(vector.astype(dtype).tobytes()).decode("ascii") for vector in vectors]
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+    return json.dumps({
+        "encoding": encoding,
+        "dimension": int(vectors.shape[1]),
+        "vectors": serialized,
+    })
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Export the embedding model to onnx, quantized to int8 by default, for the local embedding provider
+of the semantic search lambda and of the ingestion tool.
+
+Example:
+    pip install torch transformers onnx onnxruntime
+    python export_onnx.py --model shibing624/text2vec-base-chinese --out-dir ./text2vec-onnx
+"""
+import os
+import json
+import argparse
+
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from transformers import AutoModel, AutoTokenizer
+
+
+def export(model_id, out_dir, max_length=128, pooling='cls', quantize=True, opset=14):
+    """
+    Args:
+        :model_id: hub model id or local model directory
+        :out_dir: output directory of model.onnx, tokenizer.json and embedding_config.json
+        :max_length: max tokens of a sentence
+        :pooling: cls or mean, cls matches the vectors of the sagemaker endpoint
+        :quantize: quantize weights to int8 dynamically
+        :opset: onnx opset version
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModel.from_pretrained(model_id).eval()
+
+    dummy = tokenizer(['embedding'], return_tensors='pt')
+    input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    fp32_path = os.path.join(out_dir, 'model.fp32.onnx' if quantize else 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(model,
+                          tuple(dummy[name] for name in input_names),
+                          fp32_path,
+                          input_names=input_names,
+                          output_names=['last_hidden_state'],
+                          dynamic_axes=dynamic_axes,
+                          opset_version=opset)
+
+    if quantize:
+        quantize_dynamic(fp32_path, os.path.join(out_dir, 'model.onnx'), weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+
+    backend_tokenizer = tokenizer.backend_tokenizer
+    backend_tokenizer.no_padding()
+    backend_tokenizer.no_truncation()
+    backend_tokenizer.save(os.path.join(out_dir, 'tokenizer.json'))
+
+    with open(os.path.join(out_dir, 'embedding_config.json'), 'w', encoding='utf-8') as config_file:
+        json.dump({'model_id': model_id, 'pooling': pooling, 'max_length': max_length, 'quantized': quantize},
+                  config_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='shibing624/text2vec-base-chinese', help='hub model id or directory')
+    parser.add_argument('--out-dir', required=True, help='output directory')
+    parser.add_argument('--max-length', type=int, default=128, help='max tokens of a sentence')
+    parser.add_argument('--pooling', choices=['cls', 'mean'], default='cls', help='pooling of token embeddings')
+    parser.add_argument('--no-quantize', action='store_true', help='keep float32 weights')
+    args = parser.parse_args()
+
+    export(args.model, args.out_dir, max_length=args.max_length, pooling=args.pooling, quantize=not args.no_quantize)
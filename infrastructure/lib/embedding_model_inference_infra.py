@@ -9,6 +9,7 @@ from aws_cdk import (
     aws_iam as iam,
     aws_cloudwatch as cloudwatch,
     aws_sagemaker as sagemaker,
+    aws_s3_assets as s3_assets,
     aws_applicationautoscaling as asg,
 )
 
@@ -54,6 +55,7 @@ class EmbeddingModelInferenceInfra(Construct):
         instance_type = self._instance_type
 
         image_uri = self._get_sagemaker_image_uri()
+        inference_code = self._create_inference_code_asset()
 
         model = sagemaker.CfnModel(
             self,
@@ -66,9 +68,12 @@ class EmbeddingModelInferenceInfra(Construct):
                     container_hostname=f"{self._project_name}ContainerHostname",
                     image=image_uri,
                     mode="SingleModel",
+                    # custom handler in code/inference.py pools token embeddings on the server
+                    model_data_url=inference_code.s3_object_url,
                     environment={
                         "HF_TASK": "feature-extraction",
                         "HF_MODEL_ID": "shibing624/text2vec-base-chinese",
+                        "EMBEDDING_POOLING": "cls",
                         "SAGEMAKER_CONTAINER_LOG_LEVEL": 20,
                         "SAGEMAKER_REGION": cdk.Aws.REGION,
                     },
@@ -141,6 +146,23 @@ class EmbeddingModelInferenceInfra(Construct):
 
         return endpoint
 
+    def _create_inference_code_asset(self):
+        """
+        Package the custom inference handler as model.tar.gz, the hub model is still loaded by HF_MODEL_ID
+        """
+        asset = s3_assets.Asset(
+            self,
+            "InferenceCode",
+            path="./embedding_model",
+            bundling=cdk.BundlingOptions(
+                image=cdk.DockerImage.from_registry("public.ecr.aws/docker/library/alpine:latest"),
+                command=["sh", "-c", "tar -czf /asset-output/model.tar.gz -C /asset-input code"],
+                output_type=cdk.BundlingOutput.ARCHIVED,
+            ),
+        )
+        asset.grant_read(self._sagemaker_role)
+        return asset
+
     def _create_sagemaker_role(self):
         # IAM Roles
         name = "Sagemaker"
@@ -46,6 +46,20 @@ class SemanticSearchLambdaStack(Stack):
 
     def _create_semantic_lambda(self, id, host, em_endpoint_name):
         index = self.node.try_get_context("semantic_search_index_name")
+        search_backend = self.node.try_get_context("semantic_search_backend") or "opensearch"
+        local_vector_path = self.node.try_get_context("semantic_search_local_vector_path") or ""
+        embedding_provider = self.node.try_get_context("semantic_search_embedding_provider") or "sagemaker"
+        local_embedding_model_path = self.node.try_get_context("semantic_search_local_embedding_model_path") or ""
+        # e.g. {"machining": ["machining_index", "casting_index"]}, the indices /smart_search may federate
+        index_groups = self.node.try_get_context("semantic_search_index_groups") or {}
+        # e.g. {"casting_index": "cosinesimil"}, indices absent use l2
+        index_space_types = self.node.try_get_context("semantic_search_index_space_types") or {}
+        # entries of the semantic result cache of the lambda, 0 turns it off
+        semantic_cache_size = int(self.node.try_get_context("semantic_search_semantic_cache_size") or 0)
+        # numpy, onnxruntime and tokenizers are bundled only for the in-process backends, or for the semantic cache
+        local_requirements = "local" in (search_backend, embedding_provider) or semantic_cache_size > 0 \
+            or str(self.node.try_get_context("semantic_search_local_requirements")).lower() == "true"
+        requirements_file = "requirements-local.txt" if local_requirements else "requirements.txt"
 
         # configure the lambda role
         _role_policy = iam.PolicyStatement(
@@ -55,6 +69,7 @@ class SemanticSearchLambdaStack(Stack):
                 "lambda:AWSLambdaBasicExecutionRole",
                 "secretsmanager:SecretsManagerReadWrite",
                 "es:ESHttpPost",
+                "s3:GetObject",
             ],
             resources=["*"],
         )
@@ -86,23 +101,33 @@ class SemanticSearchLambdaStack(Stack):
             role=semantic_search_role,
             code=_lambda.Code.from_asset(
                 "../lambda/" + function_name,
+                exclude=["tests"],
                 bundling=cdk.BundlingOptions(
                     image=_lambda.Runtime.PYTHON_3_9.bundling_image,
                     command=[
                         "bash",
                         "-c",
-                        "pip install -r requirements.txt --no-cache-dir -t /asset-output && cp -au . /asset-output",
+                        f"pip install -r {requirements_file} --no-cache-dir -t /asset-output && cp -au . /asset-output",
                     ],
                 ),
             ),
             handler="semantic_search" + ".lambda_handler",
-            memory_size=256,
+            # the local embedding provider keeps an onnx model warm in the container
+            memory_size=1024 if embedding_provider == "local" else 256,
             timeout=Duration.minutes(5),
         )
 
         semantic_lambda.add_environment("host", host)
         semantic_lambda.add_environment("index", index)
         semantic_lambda.add_environment("embedding_endpoint_name", em_endpoint_name)
+        semantic_lambda.add_environment("search_backend", search_backend)
+        semantic_lambda.add_environment("local_vector_path", local_vector_path)
+        semantic_lambda.add_environment("embedding_provider", embedding_provider)
+        semantic_lambda.add_environment("local_embedding_model_path", local_embedding_model_path)
+        semantic_lambda.add_environment("semantic_cache_size", str(semantic_cache_size))
+        # json objects from cdk.json, or json strings from -c on the command line
+        for env_key, value in (("index_groups", index_groups), ("index_space_types", index_space_types)):
+            semantic_lambda.add_environment(env_key, value if isinstance(value, str) else json.dumps(value))
 
         return semantic_lambda
 
@@ -112,12 +137,14 @@ class SemanticSearchLambdaStack(Stack):
             self,
             "semantic-search-api",
             endpoint_types=[apigw.EndpointType.REGIONAL],
+            # let the lambda return gzip or br compressed bodies, base64 encoded
+            binary_media_types=["*/*"],
         )
 
         semantic_lambda_root = self._api.root.add_resource(
             "smart_search",
             default_cors_preflight_options=apigw.CorsOptions(
-                allow_methods=["POST", "OPTIONS"],
+                allow_methods=["GET", "POST", "OPTIONS"],
                 allow_origins=apigw.Cors.ALL_ORIGINS,
                 allow_credentials=True,
                 allow_headers=[
@@ -156,6 +183,57 @@ class SemanticSearchLambdaStack(Stack):
             ],
         )
 
+        # batch search shares the same lambda integration and cors options
+        semantic_lambda_batch = semantic_lambda_root.add_resource("batch")
+        semantic_lambda_batch.add_method(
+            "POST",
+            semantic_lambda_api_integration,
+            method_responses=[
+                apigw.MethodResponse(
+                    status_code="200",
+                    response_parameters={
+                        "method.response.header.Access-Control-Allow-Origin": True
+                    },
+                )
+            ],
+        )
+
+        # full document by id, for results returned as snippets
+        semantic_lambda_doc = semantic_lambda_root.add_resource("doc").add_resource("{id}")
+        semantic_lambda_doc.add_method(
+            "GET",
+            semantic_lambda_api_integration,
+            method_responses=[
+                apigw.MethodResponse(
+                    status_code="200",
+                    response_parameters={
+                        "method.response.header.Access-Control-Allow-Origin": True
+                    },
+                )
+            ],
+        )
+
+        # question completions from the prefix index built by ingestion, no embedding or knn call
+        semantic_lambda_suggest = semantic_lambda_root.add_resource("suggest")
+        semantic_lambda_suggest.add_method(
+            "GET",
+            semantic_lambda_api_integration,
+            method_responses=[
+                apigw.MethodResponse(
+                    status_code="200",
+                    response_parameters={
+                        "method.response.header.Access-Control-Allow-Origin": True
+                    },
+                )
+            ],
+        )
+
+        # binary_media_types */* also converts the bodies of the MOCK integrations of the cors preflights,
+        # which then answer 500, so their bodies are kept as text
+        for construct in self._api.root.node.find_all():
+            if isinstance(construct, apigw.Method) and construct.http_method == "OPTIONS":
+                construct.node.default_child.add_property_override("Integration.ContentHandling", "CONVERT_TO_TEXT")
+
         CfnOutput(
             self,
             "SemanticSearchApi",
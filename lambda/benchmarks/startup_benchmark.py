@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Measure cold start of the semantic_search lambda locally against stubbed AWS services.
+
+Each iteration imports the lambda module in a fresh interpreter, like a cold container, and times
+the imports, the init phase and the first and second requests. Secrets Manager, the SageMaker runtime
+and OpenSearch are served by one local http stub with a configurable latency per call.
+
+Example:
+    pip install -r ../semantic_search/requirements.txt
+    python startup_benchmark.py --iterations 10 --latency-ms 30
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'semantic_search')
+RESULT_PREFIX = 'STARTUP_RESULT '
+
+_CHILD = '''
+import json, time
+start = time.perf_counter()
+import semantic_search
+init_seconds = time.perf_counter() - start
+event = {"requestContext": {"resourcePath": "/smart_search"}, "httpMethod": "POST",
+         "headers": {"Content-Type": "application/json"}, "body": json.dumps({"search_words": "quality control"})}
+requests_seconds = []
+for _ in range(2):
+    start = time.perf_counter()
+    response = semantic_search.lambda_handler(event, None)
+    assert response["statusCode"] == 200, response
+    requests_seconds.append(time.perf_counter() - start)
+print("%s" + json.dumps({"import_seconds": semantic_search._INIT_TIMINGS["import_seconds"],
+                         "init_seconds": init_seconds,
+                         "first_request_seconds": requests_seconds[0],
+                         "second_request_seconds": requests_seconds[1]}))
+''' % RESULT_PREFIX
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    latency_seconds = 0.0
+    dimension = 768
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, body, status=200):
+        time.sleep(self.latency_seconds)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        time.sleep(self.latency_seconds)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        target = self.headers.get('X-Amz-Target', '')
+        if target.endswith('GetSecretValue'):
+            return self._reply({'Name': 'VectorDBMasterUserCredentials',
+                                'SecretString': json.dumps({'username': 'admin', 'password': 'admin'})})
+        if self.path.endswith('/invocations'):
+            return self._reply({'encoding': 'json', 'dimension': self.dimension, 'vectors': [[0.0] * self.dimension]})
+        if self.path.endswith('/_search'):
+            return self._reply({'hits': {'hits': [{'_id': '1', '_score': 1.0, '_source': {'question': 'q'}}]}})
+        self._reply({'message': f'Unknown path {self.path}'}, status=404)
+
+
+def _run_once(port, warm_up):
+    stub_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ,
+               AWS_ACCESS_KEY_ID='stub', AWS_SECRET_ACCESS_KEY='stub', AWS_DEFAULT_REGION='us-east-1',
+               AWS_ENDPOINT_URL_SECRETS_MANAGER=stub_url, AWS_ENDPOINT_URL_SAGEMAKER_RUNTIME=stub_url,
+               host='127.0.0.1', port=str(port), opensearch_use_ssl='false', index='benchmark',
+               embedding_endpoint_name='benchmark', warm_up_on_init='true' if warm_up else 'false',
+               PYTHONDONTWRITEBYTECODE='1')
+    output = subprocess.run([sys.executable, '-c', _CHILD], cwd=LAMBDA_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    for line in output.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f'No result in output: {output[-2000:]}')
+
+
+def _summarize(results):
+    summary = {}
+    for key in results[0]:
+        values = sorted(result[key] * 1000 for result in results)
+        summary[key.replace('_seconds', '_ms')] = {'p50': statistics.median(values), 'max': values[-1]}
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5, help='cold starts per mode')
+    parser.add_argument('--latency-ms', type=float, default=30, help='latency of each stubbed AWS call')
+    parser.add_argument('--import-budget-ms', type=float, default=1000, help='fail if p50 import time is over it')
+    args = parser.parse_args(argv)
+
+    _StubHandler.latency_seconds = args.latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    report = {}
+    try:
+        for mode, warm_up in [('lazy', False), ('warm_up_on_init', True)]:
+            report[mode] = _summarize([_run_once(server.server_port, warm_up) for _ in range(args.iterations)])
+    finally:
+        server.shutdown()
+
+    for mode, summary in report.items():
+        print(f'{mode}:')
+        for key, value in summary.items():
+            print(f"  {key:<26} p50 {value['p50']:8.1f}  max {value['max']:8.1f}")
+    print(json.dumps(report))
+
+    import_p50 = report['warm_up_on_init']['import_ms']['p50']
+    if import_p50 > args.import_budget_ms:
+        print(f'Import time p50 {import_p50:.1f}ms is over the budget of {args.import_budget_ms:.0f}ms')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
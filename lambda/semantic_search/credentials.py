@@ -0,0 +1,130 @@
+import json
+import time
+import logging
+import threading
+
+import boto3
+from requests.auth import AuthBase, HTTPBasicAuth
+
+logger = logging.getLogger(__name__)
+
+
+class SecretCredentialProvider(object):
+    """
+    Cache the user name and password of a secrets manager secret with a TTL.
+
+    Once an entry is older than ttl - refresh_ahead, the next read triggers a background refresh and still
+    returns the cached value, so requests only wait on secrets manager when the entry fully expired or
+    a caller forces a refresh, e.g. after a 401 caused by a rotation.
+    """
+
+    def __init__(self,
+                 secret_id='VectorDBMasterUserCredentials',
+                 boto3_session: boto3.Session = None,
+                 ttl_seconds=300,
+                 refresh_ahead_seconds=60,
+                 secrets_client=None,
+                 clock=time.monotonic):
+        """
+        Args:
+            :secret_id: secret holding a json of username and password
+            :boto3_session: A Boto3 Session.
+            :ttl_seconds: seconds a fetched secret is used
+            :refresh_ahead_seconds: seconds before expiry when a background refresh starts
+            :secrets_client: secrets manager client, created from boto3_session if absent
+            :clock: time source
+        """
+        self._secret_id = secret_id
+        self._ttl_seconds = ttl_seconds
+        self._refresh_ahead_seconds = refresh_ahead_seconds
+        self._client = secrets_client or boto3_session.client(service_name='secretsmanager')
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._credentials = None
+        self._version_id = None
+        self._fetched_at = None
+
+        self._hits = 0
+        self._misses = 0
+        self._background_refreshes = 0
+        self._forced_refreshes = 0
+        self._failures = 0
+
+    def get(self):
+        """
+        Returns (username, password)
+        """
+        with self._lock:
+            age = None if self._fetched_at is None else self._clock() - self._fetched_at
+            if age is not None and age < self._ttl_seconds:
+                self._hits += 1
+                if age >= self._ttl_seconds - self._refresh_ahead_seconds and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._background_refresh, name='secret-refresh', daemon=True).start()
+                return self._credentials
+            self._misses += 1
+
+        return self._fetch()
+
+    def refresh(self):
+        """
+        Fetch the secret now, e.g. after the cached one was rejected
+        """
+        with self._lock:
+            self._forced_refreshes += 1
+        return self._fetch()
+
+    def _background_refresh(self):
+        try:
+            self._fetch()
+            with self._lock:
+                self._background_refreshes += 1
+        except Exception:
+            logger.warning("Couldn't refresh secret %s in background", self._secret_id, exc_info=True)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _fetch(self):
+        try:
+            response = self._client.get_secret_value(SecretId=self._secret_id)
+        except Exception:
+            with self._lock:
+                self._failures += 1
+            raise
+
+        user_data = json.loads(response['SecretString'])
+        credentials = (user_data.get('username'), user_data.get('password'))
+        with self._lock:
+            if self._version_id is not None and self._version_id != response.get('VersionId'):
+                logger.info("Secret %s rotated to version %s", self._secret_id, response.get('VersionId'))
+            self._credentials = credentials
+            self._version_id = response.get('VersionId')
+            self._fetched_at = self._clock()
+        return credentials
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'background_refreshes': self._background_refreshes,
+                'forced_refreshes': self._forced_refreshes,
+                'failures': self._failures,
+                'version_id': self._version_id,
+                'age_seconds': None if self._fetched_at is None else self._clock() - self._fetched_at,
+            }
+
+
+class ProviderAuth(AuthBase):
+    """
+    Basic auth of requests which reads the current credentials of a provider for every request
+    """
+
+    def __init__(self, provider: SecretCredentialProvider):
+        self._provider = provider
+
+    def __call__(self, request):
+        return HTTPBasicAuth(*self._provider.get())(request)
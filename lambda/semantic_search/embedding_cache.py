@@ -0,0 +1,190 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_search_words(search_words: str) -> str:
+    """
+    Normalize search words so that trivially different inputs share one cache entry
+    """
+    text = unicodedata.normalize('NFKC', search_words or '')
+    return ' '.join(text.split())
+
+
+class CacheStore(ABC):
+    """
+    Interface of a shared cache tier which outlives a single lambda container
+    """
+
+    @abstractmethod
+    def get(self, key: str):
+        """
+        Args:
+            :key: cache key
+        Returns:
+            a tuple of (value, expires_at) or None if key is absent
+        """
+
+    @abstractmethod
+    def put(self, key: str, value, expires_at: float):
+        """
+        Args:
+            :key: cache key
+            :value: json serializable value
+            :expires_at: wall clock seconds when the entry expires
+        """
+
+
+class SqliteCacheStore(CacheStore):
+    """
+    A shared cache tier on a local sqlite file, e.g. on /tmp or a mounted EFS path
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            :path: sqlite database file path
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=1)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)')
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires_at FROM embedding_cache WHERE key = ?',
+                                     (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, value, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO embedding_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                               (key, json.dumps(value), expires_at))
+
+
+class EmbeddingCache(object):
+    """
+    A bounded in-container LRU cache with TTL for query embeddings, optionally backed by a shared store
+    """
+
+    def __init__(self, max_size=1024, ttl_seconds=3600, shared_store: CacheStore = None, clock=time.time):
+        """
+        Args:
+            :max_size: max entries kept in memory, 0 disables the cache
+            :ttl_seconds: seconds an entry stays valid
+            :shared_store: optional shared tier consulted on a local miss
+            :clock: time source, wall clock so that expiry is comparable across containers
+        """
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._shared_store = shared_store
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._shared_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self):
+        return self._max_size > 0
+
+    @staticmethod
+    def _key(endpoint_name, search_words):
+        return f"{endpoint_name}\x1f{normalize_search_words(search_words)}"
+
+    def get(self, endpoint_name: str, search_words: str):
+        """
+        Get a cached vector
+
+        Args:
+            :endpoint_name: embedding endpoint which generated the vector
+            :search_words: raw search words
+        """
+        if not self.enabled:
+            return None
+
+        key = EmbeddingCache._key(endpoint_name, search_words)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return vector
+                del self._entries[key]
+
+        entry = self._get_shared(key)
+        if entry is not None and entry[1] > now:
+            with self._lock:
+                self._shared_hits += 1
+                self._put_local(key, entry[0], entry[1])
+            return entry[0]
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, endpoint_name: str, search_words: str, vector):
+        """
+        Put a vector into cache
+
+        Args:
+            :endpoint_name: embedding endpoint which generated the vector
+            :search_words: raw search words
+            :vector: generated vector
+        """
+        if not self.enabled:
+            return
+
+        key = EmbeddingCache._key(endpoint_name, search_words)
+        expires_at = self._clock() + self._ttl_seconds
+        with self._lock:
+            self._put_local(key, vector, expires_at)
+
+        if self._shared_store is not None:
+            try:
+                self._shared_store.put(key, vector, expires_at)
+            except Exception:
+                logger.warning("Couldn't put embedding into shared cache store", exc_info=True)
+
+    def _put_local(self, key, vector, expires_at):
+        self._entries[key] = (vector, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _get_shared(self, key):
+        if self._shared_store is None:
+            return None
+        try:
+            return self._shared_store.get(key)
+        except Exception:
+            logger.warning("Couldn't get embedding from shared cache store", exc_info=True)
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self._hits,
+                'shared_hits': self._shared_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
@@ -0,0 +1,91 @@
+import os
+import json
+import bisect
+import hashlib
+import logging
+import unicodedata
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+FAQ_TABLE_VERSION = 3
+
+
+def normalize_faq_question(text):
+    """
+    Casefold and drop punctuation and extra whitespace, must match data/ingestion/faq.py
+    """
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = ''.join(' ' if unicodedata.category(char).startswith('P') else char for char in text)
+    return ' '.join(text.split())
+
+
+def faq_key(normalized_question):
+    return hashlib.blake2b(normalized_question.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class FaqTable(object):
+    """
+    The kNN hits of the knowledge base questions, built by ingestion, see data/ingestion/faq.py.
+
+    A search whose words equal a question once normalized is answered from the table by a binary search
+    of the sorted hash keys, without embedding the search words or the kNN query. The table holds the ids
+    and scores of hits only, their sources are fetched when served, and it is valid only while the index
+    is at index_version, the version it was built against.
+    """
+
+    def __init__(self, path: str, boto3_session: boto3.Session = None, local_path='/tmp/faq_table.json'):
+        """
+        Args:
+            :path: the table file, or s3://bucket/key which is downloaded to local_path once
+            :boto3_session: A Boto3 Session, used for s3 paths
+            :local_path: download path for s3 paths
+        """
+        if path.startswith('s3://'):
+            if not os.path.exists(local_path):
+                bucket, _, key = path[len('s3://'):].partition('/')
+                (boto3_session or boto3.Session()).client(service_name='s3').download_file(bucket, key, local_path)
+            path = local_path
+
+        with open(path, encoding='utf-8') as table_file:
+            faq_table = json.load(table_file)
+        if faq_table.get('version') != FAQ_TABLE_VERSION:
+            raise ValueError(f"Unsupported faq table version {faq_table.get('version')}")
+
+        self._keys = faq_table['keys']
+        self._questions = faq_table['questions']
+        self._hits = faq_table['hits']
+        self._ids = faq_table['ids']
+        self._hits_size = faq_table['hits_size']
+        self._k = faq_table['k']
+        self._index_version = faq_table['index_version']
+        logger.info("Loaded faq table of %s questions from %s", len(self._keys), path)
+
+    @property
+    def hits_size(self):
+        return self._hits_size
+
+    @property
+    def k(self):
+        return self._k
+
+    @property
+    def index_version(self):
+        return self._index_version
+
+    def lookup(self, search_words, from_offset=0, size=6):
+        """
+        Returns the page of hits of the question equal to search_words as (doc id, score), None if there is none
+        """
+        normalized = normalize_faq_question(search_words)
+        key = faq_key(normalized)
+        position = bisect.bisect_left(self._keys, key)
+        if position == len(self._keys) or self._keys[position] != key:
+            return None
+
+        if self._questions[position] != normalized:
+            return None
+
+        return [(self._ids[doc_position], score)
+                for doc_position, score in self._hits[position][from_offset:from_offset + size]]
@@ -0,0 +1,97 @@
+import heapq
+
+
+class FederationError(ValueError):
+    pass
+
+
+def resolve_indices(requested, default_index, groups=None, max_indices=10):
+    """
+    Expand the indices of a federated search, in the order requested and without duplicates
+
+    Args:
+        :requested: list of index names and index group names
+        :default_index: the index of the lambda, always allowed
+        :groups: dict of group name to its index names, the indices of groups are the other allowed ones
+        :max_indices: max number of indices after expansion
+    Raises:
+        FederationError if an entry is neither an allowed index nor a group
+    """
+    groups = groups or {}
+    if not isinstance(requested, list) or len(requested) == 0 or not all(isinstance(name, str) for name in requested):
+        raise FederationError('indices should be a non empty list of index or index group names')
+
+    allowed = {default_index, *(index for members in groups.values() for index in members)}
+    indices = []
+    for name in requested:
+        if name in groups:
+            members = groups[name]
+        elif name in allowed:
+            members = [name]
+        else:
+            raise FederationError(f"Unknown index or index group {name}, allowed are "
+                                  f"{', '.join(sorted(allowed | set(groups)))}")
+        indices.extend(index for index in members if index not in indices)
+
+    if len(indices) > max_indices:
+        raise FederationError(f'indices should expand to at most {max_indices} indices, current is {len(indices)}')
+    return indices
+
+
+SPACE_TYPES = ('l2', 'cosinesimil', 'innerproduct')
+NORMALIZATION_METHODS = ('auto', 'none', 'rrf')
+
+
+def check_federation_config(space_types, default_space_type='l2', method='auto'):
+    """
+    Validate the federation config once when the lambda starts, rather than failing every federated search
+
+    Args:
+        :space_types: dict of index name to its space type
+        :default_space_type: space type of indices absent from space_types
+        :method: score normalization, auto, none or rrf
+    Raises:
+        FederationError if a space type or the method is unsupported
+    """
+    if not isinstance(space_types, dict):
+        raise FederationError(f'index_space_types should be a json object of index name to space type, '
+                              f'current is {space_types!r}')
+    for index, space_type in dict(space_types, **{'default': default_space_type}).items():
+        if space_type not in SPACE_TYPES:
+            raise FederationError(f"Unsupported space type {space_type!r} of {index}, "
+                                  f"expected {', '.join(SPACE_TYPES)}")
+    if method not in NORMALIZATION_METHODS:
+        raise FederationError(f"Unsupported score normalization {method!r}, "
+                              f"expected {', '.join(NORMALIZATION_METHODS)}")
+
+
+def normalization_method(space_types, method='auto'):
+    """
+    The score normalization of a federated search, auto normalizes only when the indices use different
+    space types, whose scores do not compare, e.g. 1 / (1 + d^2) of l2 and (1 + cos) / 2 of cosinesimil
+    """
+    if method != 'auto':
+        return method
+    return 'none' if len(set(space_types)) <= 1 else 'rrf'
+
+
+def normalize_scores(results, method, rank_constant=60):
+    """
+    Returns the results of an index with comparable scores. rrf, reciprocal rank fusion, scores a result by
+    1 / (rank_constant + rank) of its rank in its index, as raw scores of different space types don't compare
+    but ranks do. The results of each index should start at its first hit.
+    """
+    if method == 'none' or len(results) == 0:
+        return results
+    return [dict(result, raw_score=result['score'], score=1 / (rank_constant + rank))
+            for rank, result in enumerate(results, start=1)]
+
+
+def merge_top_k(result_lists, top_k):
+    """
+    Merge the results of indices into the global top k by score, ties keep the order of indices
+    """
+    candidates = ((result['score'], -list_position, -position, result)
+                  for list_position, results in enumerate(result_lists)
+                  for position, result in enumerate(results))
+    return [candidate[3] for candidate in heapq.nlargest(top_k, candidates, key=lambda candidate: candidate[:3])]
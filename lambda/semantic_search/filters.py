@@ -0,0 +1,120 @@
+import datetime
+import operator
+
+# metadata fields written by ingestion, see data/ingestion/metadata.py
+FIELD_TYPES = {
+    'category': 'keyword',
+    'source': 'keyword',
+    'language': 'keyword',
+    'updated_at': 'date',
+}
+
+_RANGE_OPERATORS = {'gt': operator.gt, 'gte': operator.ge, 'lt': operator.lt, 'lte': operator.le}
+
+
+class FilterError(ValueError):
+    pass
+
+
+def compile_filter(expression, field_types=None, max_clauses=32):
+    """
+    Compile a filter expression into an OpenSearch query for the filter of a knn query.
+
+    An expression is a json object of which all entries must match:
+        {"category": "casting"}                       term
+        {"language": ["en", "zh"]}                    any of terms
+        {"updated_at": {"gte": "2024-01-01"}}         range by gt, gte, lt and lte
+        {"or": [{...}, {...}]}, {"and": [...]}, {"not": {...}}
+
+    Args:
+        :expression: the filter expression
+        :field_types: filterable fields and their types, FIELD_TYPES if absent
+        :max_clauses: max number of entries in the expression
+    Raises:
+        FilterError if the expression is invalid
+    """
+    return _compile(expression, field_types or FIELD_TYPES, [max_clauses])
+
+
+def _compile(expression, field_types, budget):
+    if not isinstance(expression, dict) or len(expression) == 0:
+        raise FilterError('A filter should be a non empty json object')
+
+    clauses = []
+    for key, value in expression.items():
+        budget[0] -= 1
+        if budget[0] < 0:
+            raise FilterError('A filter has too many clauses')
+
+        if key in ('and', 'or'):
+            if not isinstance(value, list) or len(value) == 0:
+                raise FilterError(f'{key} of a filter should be a non empty list')
+            sub_clauses = [_compile(item, field_types, budget) for item in value]
+            clauses.append({'bool': {'filter': sub_clauses}} if key == 'and'
+                           else {'bool': {'should': sub_clauses, 'minimum_should_match': 1}})
+        elif key == 'not':
+            clauses.append({'bool': {'must_not': [_compile(value, field_types, budget)]}})
+        elif key in field_types:
+            clauses.append(_field_clause(key, value, field_types[key]))
+        else:
+            raise FilterError(f"Unknown filter field {key}, filterable fields are {', '.join(field_types)}")
+
+    return clauses[0] if len(clauses) == 1 else {'bool': {'filter': clauses}}
+
+
+def _field_clause(field, value, field_type):
+    if isinstance(value, dict):
+        if len(value) == 0 or any(range_operator not in _RANGE_OPERATORS for range_operator in value):
+            raise FilterError(f"Range of {field} should use {', '.join(_RANGE_OPERATORS)}")
+        for bound in value.values():
+            _check_value(field, bound, field_type)
+        return {'range': {field: value}}
+
+    if isinstance(value, list):
+        if len(value) == 0:
+            raise FilterError(f'Values of {field} should be a non empty list')
+        for item in value:
+            _check_value(field, item, field_type)
+        return {'terms': {field: value}}
+
+    _check_value(field, value, field_type)
+    return {'term': {field: value}}
+
+
+def _check_value(field, value, field_type):
+    if field_type == 'date':
+        try:
+            datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise FilterError(f'Value of {field} should be an ISO 8601 date, e.g. 2024-01-01')
+    elif not isinstance(value, str):
+        raise FilterError(f'Value of {field} should be a string')
+
+
+def matches(expression, source):
+    """
+    Whether a document source matches a valid filter expression, for backends without a query engine
+    """
+    for key, value in expression.items():
+        if key == 'and':
+            matched = all(matches(item, source) for item in value)
+        elif key == 'or':
+            matched = any(matches(item, source) for item in value)
+        elif key == 'not':
+            matched = not matches(value, source)
+        else:
+            matched = _field_matches(source.get(key), value)
+        if not matched:
+            return False
+    return True
+
+
+def _field_matches(actual, value):
+    if actual is None:
+        return False
+    if isinstance(value, dict):
+        # dates are ISO 8601 strings which compare in the order of time
+        return all(_RANGE_OPERATORS[range_operator](actual, bound) for range_operator, bound in value.items())
+    if isinstance(value, list):
+        return actual in value
+    return actual == value
@@ -0,0 +1,90 @@
+import os
+import json
+import logging
+
+import boto3
+import numpy as np
+import onnxruntime
+from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = 'model.onnx'
+TOKENIZER_FILE = 'tokenizer.json'
+CONFIG_FILE = 'embedding_config.json'
+
+
+class LocalEmbeddingClient(object):
+    """
+    Generate embeddings in process on CPU by an exported (and usually int8 quantized) transformer,
+    an alternative to SageMakerClient with the same generate_vectors interface.
+
+    The onnx session is created once per container and kept warm across invocations.
+    """
+
+    def __init__(self,
+                 model_path: str,
+                 boto3_session: boto3.Session = None,
+                 intra_op_threads=0,
+                 local_dir='/tmp/local_embedding_model'):
+        """
+        Args:
+            :model_path: directory exported by export_onnx.py, or s3://bucket/prefix which is downloaded to local_dir
+            :boto3_session: A Boto3 Session, used for s3 paths
+            :intra_op_threads: onnxruntime intra op threads, 0 lets onnxruntime decide
+            :local_dir: download directory for s3 paths
+        """
+        self._model_path = model_path
+        if model_path.startswith('s3://'):
+            model_path = LocalEmbeddingClient._download(model_path, local_dir, boto3_session)
+
+        with open(os.path.join(model_path, CONFIG_FILE), encoding='utf-8') as config_file:
+            config = json.load(config_file)
+        self._pooling = config.get('pooling', 'cls')
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_path, TOKENIZER_FILE))
+        self._tokenizer.enable_truncation(max_length=config.get('max_length', 128))
+        self._tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = onnxruntime.InferenceSession(os.path.join(model_path, MODEL_FILE),
+                                                     sess_options=options,
+                                                     providers=['CPUExecutionProvider'])
+        self._input_names = {model_input.name for model_input in self._session.get_inputs()}
+        logger.info("Loaded local embedding model %s from %s", config.get('model_id'), self._model_path)
+
+    @staticmethod
+    def _download(s3_path, local_dir, boto3_session):
+        bucket, _, prefix = s3_path[len('s3://'):].partition('/')
+        s3_client = (boto3_session or boto3.Session()).client(service_name='s3')
+        os.makedirs(local_dir, exist_ok=True)
+        for file_name in [CONFIG_FILE, TOKENIZER_FILE, MODEL_FILE]:
+            local_path = os.path.join(local_dir, file_name)
+            if not os.path.exists(local_path):
+                s3_client.download_file(bucket, f"{prefix.rstrip('/')}/{file_name}", local_path)
+        return local_dir
+
+    def generate_vectors(self, keywords: list[str]):
+        """
+        Generate one pooled vector per keyword
+
+        Args:
+            :keywords: keywords list to generate embeddings
+        """
+        encodings = self._tokenizer.encode_batch(keywords)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {
+            'input_ids': np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            'attention_mask': attention_mask,
+            'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        last_hidden_state = self._session.run(None, {k: v for k, v in feeds.items() if k in self._input_names})[0]
+
+        if self._pooling == 'mean':
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        else:
+            pooled = last_hidden_state[:, 0]
+        return pooled.astype(np.float32).tolist()
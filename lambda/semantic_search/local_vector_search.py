@@ -0,0 +1,230 @@
+import os
+import json
+import logging
+
+import boto3
+import numpy as np
+
+from filters import matches
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+VECTORS_FILE = 'vectors.npy'
+METADATA_FILE = 'metadata.jsonl'
+HNSW_FILE = 'vectors.hnsw'
+
+
+class LocalVectorSearchClient(object):
+    """
+    An embedded vector engine with the same interface as OpenSearchClient, answering kNN queries from a
+    memory-mapped float32 matrix and a sidecar metadata file produced by ingestion.
+
+    Search is exact top-k by numpy, or by an HNSW graph when the export has one and hnswlib is installed.
+    Scores follow the l2 space of the opensearch index, 1 / (1 + squared l2 distance).
+
+    Like the lucene engine, a filtered search walks the graph skipping unmatched documents, and is exact
+    over the matched ones when they are few.
+    """
+
+    _BLOCK_ROWS = 65536
+    _EXACT_FILTER_ROWS = 20000
+    _FILTER_CACHE_SIZE = 64
+
+    def __init__(self, path: str, boto3_session: boto3.Session = None, ef_search=100, local_dir='/tmp/local_vectors'):
+        """
+        Args:
+            :path: directory of the export, or s3://bucket/prefix which is downloaded to local_dir once
+            :boto3_session: A Boto3 Session, used for s3 paths
+            :ef_search: ef of the HNSW graph at query time
+            :local_dir: download directory for s3 paths
+        """
+        if path.startswith('s3://'):
+            path = LocalVectorSearchClient._download(path, local_dir, boto3_session)
+
+        with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as manifest_file:
+            self._manifest = json.load(manifest_file)
+        if self._manifest.get('space_type', 'l2') != 'l2':
+            raise ValueError(f"Unsupported space type {self._manifest['space_type']}")
+
+        self._vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r')
+        with open(os.path.join(path, METADATA_FILE), encoding='utf-8') as metadata_file:
+            self._metadata = [json.loads(line) for line in metadata_file]
+        if len(self._metadata) != self._vectors.shape[0]:
+            raise ValueError(f'Metadata size {len(self._metadata)} != vectors size {self._vectors.shape[0]}')
+
+        self._ef_search = ef_search
+        self._squared_norms = None
+        self._positions = None
+        self._filter_masks = {}
+        self._graph = None
+        graph_path = os.path.join(path, HNSW_FILE)
+        if os.path.exists(graph_path) and hnswlib is not None:
+            self._graph = hnswlib.Index(space='l2', dim=self._vectors.shape[1])
+            self._graph.load_index(graph_path, max_elements=self._vectors.shape[0])
+            self._graph.set_ef(ef_search)
+
+        logger.info("Loaded %s local vectors from %s, search by %s", self._vectors.shape[0], path,
+                    'hnsw' if self._graph is not None else 'exact')
+
+    def warm_up(self):
+        """
+        Page the matrix in and precompute norms, so that the first search does not pay for it
+        """
+        if self._graph is None:
+            self._ensure_squared_norms()
+        return True
+
+    @staticmethod
+    def _download(s3_path, local_dir, boto3_session):
+        bucket, _, prefix = s3_path[len('s3://'):].partition('/')
+        s3_client = (boto3_session or boto3.Session()).client(service_name='s3')
+        os.makedirs(local_dir, exist_ok=True)
+        for file_name in [MANIFEST_FILE, VECTORS_FILE, METADATA_FILE, HNSW_FILE]:
+            local_path = os.path.join(local_dir, file_name)
+            if os.path.exists(local_path):
+                continue
+            try:
+                s3_client.download_file(bucket, f"{prefix.rstrip('/')}/{file_name}", local_path)
+            except Exception:
+                if file_name != HNSW_FILE:
+                    raise
+        return local_dir
+
+    def knn_search_by_text_vectors(self,
+                                   text_vector,
+                                   knn_k=6,
+                                   size_output=6,
+                                   from_offset=0,
+                                   ef_search=None,
+                                   filter_expression=None):
+        """
+        Search by vectors
+
+        Args:
+            :text_vector: text vector. must not null or empty
+            :size_output: max output size
+            :knn_k: param k of knn
+            :from_offset: offset of the first output in the k nearest neighbors
+            :ef_search: ef of the HNSW graph for this query, the one of the constructor if absent
+            :filter_expression: metadata filter of filters.compile_filter
+        """
+        if text_vector is None or len(text_vector) == 0:
+            raise ValueError('Text vectors cannot be null or empty')
+
+        mask, positions = None, None
+        candidate_count = self._vectors.shape[0]
+        if filter_expression is not None:
+            mask, positions = self._filter_mask(filter_expression)
+            candidate_count = len(positions)
+
+        query = np.asarray(text_vector, dtype=np.float32)
+        top_k = min(knn_k, from_offset + size_output, 256, candidate_count)
+        if top_k <= from_offset:
+            return []
+
+        if self._graph is not None and (positions is None or len(positions) > self._EXACT_FILTER_ROWS):
+            self._graph.set_ef(max(ef_search or self._ef_search, top_k))
+            try:
+                if mask is None:
+                    labels, distances = self._graph.knn_query(query, k=top_k)
+                else:
+                    labels, distances = self._graph.knn_query(query, k=top_k, filter=lambda label: mask[label])
+            finally:
+                self._graph.set_ef(self._ef_search)
+            return self._resolve_result(labels[0][from_offset:], distances[0][from_offset:])
+
+        if positions is not None and len(positions) <= self._EXACT_FILTER_ROWS:
+            indexes, distances = self._exact_top_k_of(query, top_k, positions)
+        else:
+            indexes, distances = self._exact_top_k(query, top_k, mask)
+        return self._resolve_result(indexes[from_offset:], distances[from_offset:])
+
+    def _filter_mask(self, filter_expression):
+        """
+        Returns a boolean mask and the positions of documents matching a filter, cached per filter
+        """
+        key = json.dumps(filter_expression, sort_keys=True)
+        cached = self._filter_masks.get(key)
+        if cached is None:
+            mask = np.fromiter((matches(filter_expression, metadata['source']) for metadata in self._metadata),
+                               dtype=bool, count=len(self._metadata))
+            cached = (mask, np.flatnonzero(mask))
+            if len(self._filter_masks) >= self._FILTER_CACHE_SIZE:
+                self._filter_masks.pop(next(iter(self._filter_masks)))
+            self._filter_masks[key] = cached
+        return cached
+
+    def knn_search_by_text_vectors_batch(self,
+                                         text_vectors,
+                                         knn_k=6,
+                                         size_output=6,
+                                         ef_search=None,
+                                         filter_expression=None):
+        """
+        Search by many vectors, returns a list of (results, error) aligned with text_vectors
+        """
+        if text_vectors is None or len(text_vectors) == 0:
+            raise ValueError('Text vectors cannot be null or empty')
+
+        return [(self.knn_search_by_text_vectors(text_vector, knn_k=knn_k, size_output=size_output,
+                                                 ef_search=ef_search, filter_expression=filter_expression), None)
+                for text_vector in text_vectors]
+
+    def get_document(self, doc_id):
+        """
+        Get a document by id, returns None if it does not exist
+        """
+        if self._positions is None:
+            self._positions = {metadata['id']: i for i, metadata in enumerate(self._metadata)}
+
+        position = self._positions.get(doc_id)
+        if position is None:
+            return None
+        return {'id': doc_id, 'source': self._metadata[position]['source']}
+
+    def _ensure_squared_norms(self):
+        if self._squared_norms is None:
+            self._squared_norms = np.concatenate([np.einsum('ij,ij->i', block, block) for block in self._blocks()])
+
+    def _exact_top_k(self, query, top_k, mask=None):
+        self._ensure_squared_norms()
+        candidates = []
+        for offset, block in zip(range(0, self._vectors.shape[0], self._BLOCK_ROWS), self._blocks()):
+            distances = self._squared_norms[offset:offset + len(block)] - 2 * (block @ query) + query @ query
+            if mask is not None:
+                distances = np.where(mask[offset:offset + len(block)], distances, np.inf)
+            k = min(top_k, len(block))
+            indexes = np.argpartition(distances, k - 1)[:k]
+            candidates.extend(zip(distances[indexes].tolist(), (indexes + offset).tolist()))
+
+        candidates.sort()
+        best = [candidate for candidate in candidates[:top_k] if candidate[0] != np.inf]
+        return [index for _, index in best], [max(distance, 0.0) for distance, _ in best]
+
+    def _exact_top_k_of(self, query, top_k, positions):
+        """
+        Exact top-k among a few positions, e.g. the documents matching a narrow filter
+        """
+        self._ensure_squared_norms()
+        vectors = np.asarray(self._vectors[positions], dtype=np.float32)
+        distances = self._squared_norms[positions] - 2 * (vectors @ query) + query @ query
+        indexes = np.argpartition(distances, top_k - 1)[:top_k]
+        indexes = indexes[np.argsort(distances[indexes])]
+        return positions[indexes].tolist(), np.maximum(distances[indexes], 0.0).tolist()
+
+    def _blocks(self):
+        for offset in range(0, self._vectors.shape[0], self._BLOCK_ROWS):
+            yield np.asarray(self._vectors[offset:offset + self._BLOCK_ROWS], dtype=np.float32)
+
+    def _resolve_result(self, indexes, squared_distances):
+        results = []
+        for index, distance in zip(indexes, squared_distances):
+            metadata = self._metadata[int(index)]
+            results.append({'id': metadata['id'], 'score': 1 / (1 + float(distance)), 'source': metadata['source']})
+        return results
@@ -0,0 +1,27 @@
+import random
+
+
+class Truncated(object):
+    """
+    A log argument formatted only when the record is emitted, and cut to max_chars,
+    e.g. logger.debug("Queried %s", Truncated(response)) costs nothing below DEBUG
+    """
+
+    def __init__(self, value, max_chars=256):
+        self._value = value
+        self._max_chars = max_chars
+
+    def __str__(self):
+        text = str(self._value)
+        if len(text) <= self._max_chars:
+            return text
+        return f'{text[:self._max_chars]}...({len(text)} chars)'
+
+    __repr__ = __str__
+
+
+def sampled(rate, random_source=random.random):
+    """
+    Whether a request with a sample rate in [0, 1] logs its details
+    """
+    return rate >= 1.0 or (rate > 0.0 and random_source() < rate)
@@ -0,0 +1,80 @@
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+def emf_record(namespace, dimensions, metrics, properties=None, timestamp_ms=None):
+    """
+    A CloudWatch Embedded Metric Format record, which CloudWatch Logs turns into metrics without an api call
+
+    Args:
+        :namespace: metric namespace
+        :dimensions: dict of dimension name to value
+        :metrics: dict of metric name to (value, unit), e.g. {'Calls': (3, 'Count')}
+        :properties: dict of values searchable in logs insights but not metrics, e.g. a request id
+        :timestamp_ms: epoch millis, now if absent
+    """
+    record = {
+        '_aws': {
+            'Timestamp': timestamp_ms if timestamp_ms is not None else int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+    }
+    record.update(properties or {})
+    record.update(dimensions)
+    record.update({name: value for name, (value, _) in metrics.items()})
+    return record
+
+
+def emit_metrics(namespace, dimensions, metrics, properties=None, stream=None):
+    """
+    Write an EMF record as one line of the function log
+    """
+    stream = stream or sys.stdout
+    record = emf_record(namespace, dimensions, metrics, properties=properties)
+    stream.write(json.dumps(record, separators=(',', ':')) + '\n')
+    stream.flush()
+
+
+class StageTimer(object):
+    """
+    Wall time of the stages of a request, e.g. parse, embed, search and serialize, summed per stage,
+    as a Server-Timing header and as metrics. Stages may be timed from other threads, e.g. a deadline search.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self.properties = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.add(name, self._clock() - started)
+
+    def add(self, name, seconds):
+        with self._lock:
+            self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    def timings_ms(self):
+        """
+        Returns milliseconds of each stage and the total since the timer was created
+        """
+        with self._lock:
+            timings = {name: seconds * 1000 for name, seconds in self._stages.items()}
+        timings['total'] = (self._clock() - self._started) * 1000
+        return timings
+
+    def server_timing(self):
+        return ', '.join(f'{name};dur={ms:.1f}' for name, ms in self.timings_ms().items())
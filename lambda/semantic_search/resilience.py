@@ -0,0 +1,302 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+from opensearchpy import ConnectionError as OpenSearchConnectionError, TransportError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+_SAGEMAKER_FAILURE_CODES = {'ThrottlingException', 'ModelError', 'ModelNotReadyException', 'ServiceUnavailable',
+                            'InternalFailure'}
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open
+    """
+
+
+class InjectedFault(RuntimeError):
+    """
+    Raised by a FaultInjector in place of a dependency failure
+    """
+
+
+def is_sagemaker_failure(exception):
+    """
+    Whether an exception of a sagemaker runtime call means the endpoint is unhealthy, rather than a bad request
+    """
+    if isinstance(exception, (BotocoreConnectionError, HTTPClientError, InjectedFault)):
+        return True
+    if isinstance(exception, ClientError):
+        status_code = exception.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status_code >= 500 or status_code == 429 \
+            or exception.response.get('Error', {}).get('Code') in _SAGEMAKER_FAILURE_CODES
+    return False
+
+
+def is_opensearch_failure(exception):
+    """
+    Whether an exception of an opensearch call means the domain is unhealthy, rather than a bad request
+    """
+    if isinstance(exception, (OpenSearchConnectionError, InjectedFault)):
+        return True
+    if isinstance(exception, TransportError):
+        return isinstance(exception.status_code, int) and (exception.status_code >= 500 or exception.status_code == 429)
+    return False
+
+
+class CircuitBreaker(object):
+    """
+    Stop calling a dependency after consecutive failures, so that requests during an outage fail fast
+    instead of each waiting for its timeout.
+
+    Closed, calls pass and failure_threshold consecutive failures open the breaker. Open, calls are rejected
+    with CircuitOpenError for reset_seconds, then the breaker is half open and lets half_open_calls trial
+    calls through, closing on a success and opening again on a failure. Exceptions which is_failure rejects,
+    e.g. a 400 of a bad query, prove the dependency answered and count as successes.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30, half_open_calls=1, is_failure=None,
+                 clock=time.monotonic):
+        """
+        Args:
+            :name: dependency name in errors and logs
+            :failure_threshold: consecutive failures which open the breaker
+            :reset_seconds: seconds an open breaker rejects calls before trial calls
+            :half_open_calls: concurrent trial calls of a half open breaker
+            :is_failure: predicate of exceptions which count as failures, all if absent
+            :clock: time source
+        """
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self._half_open_calls = half_open_calls
+        self._is_failure = is_failure or (lambda exception: True)
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = None
+        self._consecutive_failures = 0
+        self._trial_calls = 0
+
+        self._calls = 0
+        self._failures = 0
+        self._rejections = 0
+        self._opens = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self._reset_seconds:
+            logger.info("Circuit breaker of %s is half open, let trial calls through", self._name)
+            self._state = HALF_OPEN
+            self._trial_calls = 0
+        return self._state
+
+    def before_call(self):
+        """
+        Admit a call or raise CircuitOpenError
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._trial_calls >= self._half_open_calls):
+                self._rejections += 1
+                raise CircuitOpenError(f'Circuit breaker of {self._name} is {state}, the call is rejected')
+            if state == HALF_OPEN:
+                self._trial_calls += 1
+            self._calls += 1
+
+    def on_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                logger.info("Circuit breaker of %s is closed after a successful trial call", self._name)
+                self._state = CLOSED
+            self._consecutive_failures = 0
+
+    def on_failure(self, exception):
+        if not self._is_failure(exception):
+            self.on_success()
+            return
+
+        with self._lock:
+            self._failures += 1
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN or self._consecutive_failures >= self._failure_threshold:
+                if self._state != OPEN:
+                    logger.warning("Circuit breaker of %s is open after %s consecutive failures, the last %r",
+                                   self._name, self._consecutive_failures, exception)
+                    self._opens += 1
+                self._state = OPEN
+                self._opened_at = self._clock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'calls': self._calls,
+                'failures': self._failures,
+                'rejections': self._rejections,
+                'opens': self._opens,
+            }
+
+
+class FaultInjector(object):
+    """
+    Delay calls of a dependency or fail them with InjectedFault, to exercise breakers and hedging without an outage
+    """
+
+    def __init__(self, error_rate=0.0, delay_ms=0, random_source=random.random, sleep=time.sleep):
+        """
+        Args:
+            :error_rate: share of calls which raise InjectedFault
+            :delay_ms: delay before each call
+            :random_source: uniform [0, 1) source
+            :sleep: sleep function
+        """
+        self._error_rate = error_rate
+        self._delay_ms = delay_ms
+        self._random_source = random_source
+        self._sleep = sleep
+
+    def __call__(self):
+        if self._delay_ms > 0:
+            self._sleep(self._delay_ms / 1000)
+        if self._random_source() < self._error_rate:
+            raise InjectedFault('Injected fault')
+
+
+class Dependency(object):
+    """
+    Calls of a remote dependency guarded by a circuit breaker, optionally hedged.
+
+    A hedged call sends a duplicate request when the first has not answered after the hedge_percentile
+    latency of recent calls and returns whichever answers first, so that one slow replica doesn't set the
+    tail latency. Hedging only suits idempotent reads, and starts once hedge_min_samples latencies are known.
+    """
+
+    def __init__(self, name, breaker: CircuitBreaker, hedge_executor=None, hedge_percentile=95, hedge_min_samples=20,
+                 hedge_min_delay_ms=5, latency_window=200, fault_injector=None, clock=time.monotonic):
+        """
+        Args:
+            :name: dependency name in metrics
+            :breaker: circuit breaker of the dependency
+            :hedge_executor: executor of hedged calls, no hedging if absent
+            :hedge_percentile: percentile of recent latencies after which a duplicate request is sent
+            :hedge_min_samples: latencies needed before hedging
+            :hedge_min_delay_ms: lower bound of the hedge delay
+            :latency_window: recent latencies kept
+            :fault_injector: callable run before each request, e.g. a FaultInjector
+            :clock: time source
+        """
+        self._name = name
+        self._breaker = breaker
+        self._hedge_executor = hedge_executor
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._hedge_min_delay = hedge_min_delay_ms / 1000
+        self._fault_injector = fault_injector
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._reported = {}
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def breaker(self):
+        return self._breaker
+
+    def call(self, request):
+        """
+        Returns the result of request(), raises CircuitOpenError without calling it if the breaker is open
+        """
+        self._breaker.before_call()
+        try:
+            result = self._hedged(request) if self._hedge_executor is not None else self._attempt(request)
+        except Exception as e:
+            self._breaker.on_failure(e)
+            raise e
+
+        self._breaker.on_success()
+        return result
+
+    def _attempt(self, request):
+        if self._fault_injector is not None:
+            self._fault_injector()
+        started = self._clock()
+        result = request()
+        with self._lock:
+            self._latencies.append(self._clock() - started)
+        return result
+
+    def hedge_delay(self):
+        """
+        Seconds after which a call is hedged, None until enough latencies are known
+        """
+        with self._lock:
+            if len(self._latencies) < self._hedge_min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        position = min(int(len(latencies) * self._hedge_percentile / 100), len(latencies) - 1)
+        return max(latencies[position], self._hedge_min_delay)
+
+    def _hedged(self, request):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._attempt(request)
+
+        first = self._hedge_executor.submit(self._attempt, request)
+        done, _ = wait([first], timeout=delay)
+        if first in done:
+            return first.result()
+
+        with self._lock:
+            self._hedges += 1
+        second = self._hedge_executor.submit(self._attempt, request)
+        pending = [first, second]
+        while len(pending) > 0:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return future.result()
+            pending = list(not_done)
+        # both failed, the first request tells why
+        return first.result()
+
+    def stats(self):
+        with self._lock:
+            hedges = {'hedges': self._hedges, 'hedge_wins': self._hedge_wins}
+        return dict(self._breaker.stats(), **hedges, hedge_delay=self.hedge_delay())
+
+    def metrics(self):
+        """
+        Returns the breaker state as 0 closed, 1 half open or 2 open, and the counts since the last metrics
+        """
+        stats = self.stats()
+        counts = {name: stats[name] for name in ('calls', 'failures', 'rejections', 'opens', 'hedges', 'hedge_wins')}
+        with self._lock:
+            deltas = {name: value - self._reported.get(name, 0) for name, value in counts.items()}
+            self._reported = counts
+        return dict(deltas, state=_STATE_VALUES[stats['state']])
@@ -0,0 +1,150 @@
+import time
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticResultCache(object):
+    """
+    A bounded in-container cache of search results keyed by query vectors, so that paraphrases of a recent
+    query, e.g. "QC methods for machined parts" and "quality control for machined parts", reuse its results
+    instead of searching the vector db again.
+
+    Vectors are rows of a preallocated float32 matrix, a lookup compares the query with all of them at once.
+    An entry hits when it was searched with the same params and its vector is within threshold of the query,
+    cosine similarity at least threshold or l2 distance at most threshold. The least recently used entry is
+    evicted when the matrix is full, and all entries are dropped when the index version changes.
+
+    Lookups also count how many would have hit at each of report_thresholds, to tune the threshold.
+    """
+
+    def __init__(self, max_size=256, threshold=0.98, metric='cosine', ttl_seconds=300, report_thresholds=(),
+                 clock=time.time):
+        """
+        Args:
+            :max_size: max cached queries
+            :threshold: min cosine similarity or max l2 distance of a hit
+            :metric: cosine or l2
+            :ttl_seconds: seconds an entry stays valid
+            :report_thresholds: thresholds of which the hit rates are reported
+        """
+        if metric not in ('cosine', 'l2'):
+            raise ValueError(f'Unsupported metric {metric}, expected cosine or l2')
+
+        self._max_size = max_size
+        self._threshold = threshold
+        self._metric = metric
+        self._ttl_seconds = ttl_seconds
+        self._report_thresholds = sorted(report_thresholds)
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._matrix = None
+        self._entries = [None] * max_size
+        self._last_used = np.zeros(max_size, dtype=np.int64)
+        self._tick = 0
+        self._version = None
+
+        self._lookups = 0
+        self._hits = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._threshold_hits = {threshold: 0 for threshold in self._report_thresholds}
+
+    def get(self, vector, params_key: str, version):
+        """
+        Returns the results of a cached query close to vector with the same params, None on a miss
+
+        Args:
+            :vector: query vector
+            :params_key: key of the params which shaped the results, e.g. k, size and filter
+            :version: version of the searched index, entries of another version are dropped
+        """
+        query = self._prepare(vector)
+        now = self._clock()
+        with self._lock:
+            self._check_version(version)
+            self._lookups += 1
+            if self._matrix is None:
+                return None
+
+            valid = np.array([entry is not None and entry[0] == params_key and entry[2] > now
+                              for entry in self._entries])
+            if not valid.any():
+                return None
+
+            scores = self._scores(query)
+            scores[~valid] = -np.inf if self._metric == 'cosine' else np.inf
+            best = int(np.argmax(scores)) if self._metric == 'cosine' else int(np.argmin(scores))
+            for threshold in self._report_thresholds:
+                if self._within(scores[best], threshold):
+                    self._threshold_hits[threshold] += 1
+            if not self._within(scores[best], self._threshold):
+                return None
+
+            self._hits += 1
+            self._tick += 1
+            self._last_used[best] = self._tick
+            return self._entries[best][1]
+
+    def put(self, vector, params_key: str, version, results):
+        query = self._prepare(vector)
+        now = self._clock()
+        with self._lock:
+            self._check_version(version)
+            if self._matrix is None or self._matrix.shape[1] != len(query):
+                self._matrix = np.zeros((self._max_size, len(query)), dtype=np.float32)
+                self._entries = [None] * self._max_size
+
+            # an empty or expired slot is reused before the least recently used one is evicted
+            free = [slot for slot, entry in enumerate(self._entries) if entry is None or entry[2] <= now]
+            if free:
+                slot = free[0]
+            else:
+                slot = int(np.argmin(self._last_used))
+                self._evictions += 1
+
+            self._matrix[slot] = query
+            self._entries[slot] = (params_key, results, now + self._ttl_seconds)
+            self._tick += 1
+            self._last_used[slot] = self._tick
+
+    def stats(self):
+        with self._lock:
+            lookups = max(self._lookups, 1)
+            return {
+                'size': sum(entry is not None for entry in self._entries),
+                'lookups': self._lookups,
+                'hits': self._hits,
+                'hit_rate': self._hits / lookups,
+                'hit_rates_by_threshold': {threshold: hits / lookups
+                                           for threshold, hits in self._threshold_hits.items()},
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
+
+    def _prepare(self, vector):
+        query = np.asarray(vector, dtype=np.float32)
+        if self._metric == 'cosine':
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+        return query
+
+    def _scores(self, query):
+        if self._metric == 'cosine':
+            return self._matrix @ query
+        return np.sqrt(((self._matrix - query) ** 2).sum(axis=1))
+
+    def _within(self, score, threshold):
+        return score >= threshold if self._metric == 'cosine' else score <= threshold
+
+    def _check_version(self, version):
+        if version == self._version:
+            return
+        if self._version is not None:
+            logger.info("Index version changed from %s to %s, drop the semantic cache", self._version, version)
+            self._invalidations += 1
+        self._version = version
+        self._entries = [None] * self._max_size
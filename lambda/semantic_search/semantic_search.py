@@ -1,13 +1,55 @@
 import os
 import sys
 import time
+import base64
+import gzip
+import struct
 import logging
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# measure the third-party imports which dominate the init phase of a cold container
+_IMPORT_START = time.perf_counter()
+
 import boto3
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from botocore.config import Config
+from opensearchpy import AuthenticationException, NotFoundError, OpenSearch
+
+from credentials import ProviderAuth, SecretCredentialProvider
+from embedding_cache import EmbeddingCache, SqliteCacheStore, normalize_search_words
+from faq import FaqTable
+from federation import (FederationError, check_federation_config, merge_top_k, normalization_method, normalize_scores,
+                        resolve_indices)
+from filters import FilterError, compile_filter
+from logs import Truncated, sampled
+from metrics import StageTimer, emit_metrics
+from resilience import (CircuitBreaker, CircuitOpenError, Dependency, FaultInjector, is_opensearch_failure,
+                        is_sagemaker_failure)
+from suggest import SuggestIndex
+from transport import PooledHttpConnection
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
 
 _OS_CLIENT = None
 _EMBEDDING_CLIENT = None
+_EMBEDDING_CACHE = None
+_SEARCH_EXECUTOR = None
+_DEADLINE_EXECUTOR = None
+_HEDGE_EXECUTOR = None
+_DEPENDENCIES = {}
+_DEPENDENCIES_LOCK = threading.Lock()
+_SUGGEST_INDEX = None
+_FAQ_TABLE = None
+_FAQ_STALE_VERSION = None
+_SEMANTIC_CACHE = None
+_SEMANTIC_CACHE_UNAVAILABLE = False
+_INDEX_VERSION = (None, 0.0)
 _SESSION = None
 
 
@@ -34,6 +76,22 @@ def _get_string_from_env(env_key, default_value=""):
     return string_value
 
 
+def _get_float_from_env(env_key, default_value=0.0):
+    string_value = os.environ.get(env_key)
+    if string_value is None or len(string_value) == 0:
+        return default_value
+
+    return float(string_value)
+
+
+def _get_json_from_env(env_key, default_value=None):
+    string_value = os.environ.get(env_key)
+    if string_value is None or len(string_value) == 0:
+        return default_value
+
+    return json.loads(string_value)
+
+
 def _setup_logging(cur_logger) -> None:
     logging.basicConfig(
         format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
@@ -42,12 +100,11 @@ def _setup_logging(cur_logger) -> None:
 
     handler = logging.StreamHandler(sys.stdout)
     cur_logger.propagate = False
-    cur_logger.setLevel(logging.DEBUG)
+    cur_logger.setLevel(_get_string_from_env('log_level', 'INFO').upper())
     cur_logger.addHandler(handler)
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 _setup_logging(logger)
 
 
@@ -59,52 +116,143 @@ class OpenSearchClient(object):
     def __init__(self,
                  request_timeout=30,
                  index_name='qa_knowledge_index',
-                 boto3_session: boto3.Session = None):
+                 boto3_session: boto3.Session = None,
+                 credential_provider: SecretCredentialProvider = None,
+                 search_timeout=None,
+                 connect_timeout=None,
+                 pool_maxsize=10,
+                 http_compress=True,
+                 max_retries=3,
+                 dependency: Dependency = None):
         """
         Args:
-            :param request_timeout: search timeout
+            :param request_timeout: default timeout of a request
             :param index_name: index name
             :param boto3_session: A Boto3 Session.
+            :param credential_provider: provider of the master user, a cached VectorDBMasterUserCredentials if absent
+            :param search_timeout: read timeout of a search request, request_timeout if absent
+            :param connect_timeout: timeout to open a connection, request_timeout if absent
+            :param pool_maxsize: kept-alive connections to the domain
+            :param http_compress: gzip request bodies and ask for gzip responses
+            :param max_retries: retries of a request which failed to connect or with a 502, 503 or 504
+            :param dependency: circuit breaker and hedging of the requests, none if absent
         """
         self._index = index_name
         self._request_timeout = request_timeout
-
-        self._client = self._create_opensearch_client(boto3_session=boto3_session)
-
-    def _create_opensearch_client(self,
-                                  boto3_session=None):
-
-        sm_client = boto3_session.client(service_name="secretsmanager")
+        self._search_timeout = search_timeout or request_timeout
+        self._connect_timeout = connect_timeout
+        self._pool_maxsize = pool_maxsize
+        self._http_compress = http_compress
+        self._max_retries = max_retries
+        self._dependency = dependency
+        self._credential_provider = credential_provider or SecretCredentialProvider(
+            secret_id='VectorDBMasterUserCredentials',
+            boto3_session=boto3_session,
+            ttl_seconds=_get_int_from_env('credentials_ttl_seconds', 300),
+            refresh_ahead_seconds=_get_int_from_env('credentials_refresh_ahead_seconds', 60))
+
+        self._client = self._create_opensearch_client()
+
+    @property
+    def credential_provider(self):
+        return self._credential_provider
+
+    @property
+    def index_name(self):
+        return self._index
+
+    def _create_opensearch_client(self):
         host = _get_string_from_env('host', '')
-        master_user = sm_client.get_secret_value(SecretId='VectorDBMasterUserCredentials')['SecretString']
-
-        user_data = json.loads(master_user)
-        username = user_data.get('username')
-        password = user_data.get('password')
+        # prefetch the secret, later requests read the cached one which is refreshed before it expires
+        self._credential_provider.get()
 
-        auth = (username, password)  # For testing only. Don't store credentials in code.
-        return OpenSearch(hosts=[{'host': host, 'port': 443}],
-                          http_auth=auth,
-                          use_ssl=True,
+        return OpenSearch(hosts=[{'host': host, 'port': _get_int_from_env('port', 443)}],
+                          http_auth=ProviderAuth(self._credential_provider),
+                          use_ssl=_get_string_from_env('opensearch_use_ssl', 'true') == 'true',
                           verify_certs=True,
-                          connection_class=RequestsHttpConnection,
+                          connection_class=PooledHttpConnection,
+                          pool_maxsize=self._pool_maxsize,
+                          connect_timeout=self._connect_timeout,
+                          http_compress=self._http_compress,
+                          timeout=self._request_timeout,
+                          max_retries=self._max_retries,
                           ssl_assert_hostname=False,
                           ssl_show_warn=False)
 
+    def stats(self):
+        """
+        Returns the credential cache and connection reuse statistics
+        """
+        connections = self._client.transport.connection_pool.connections
+        return {
+            'credentials': self._credential_provider.stats(),
+            'transport': [connection.stats() for connection in connections],
+        }
+
+    def _with_auth_retry(self, request):
+        """
+        Send a request, on 401 refresh the credentials once and retry, e.g. after the secret is rotated
+        """
+        try:
+            return request()
+        except AuthenticationException:
+            logger.warning("Request to open search index %s is unauthorized, retry with refreshed credentials", self._index)
+            self._credential_provider.refresh()
+            return request()
+
+    def _guarded(self, request):
+        """
+        Send a request through the circuit breaker of the dependency, with the auth retry
+        """
+        if self._dependency is None:
+            return self._with_auth_retry(request)
+        return self._dependency.call(lambda: self._with_auth_retry(request))
+
+    def warm_up(self):
+        """
+        Open a pooled connection, so that the first search skips the TLS handshake
+
+        Returns:
+            whether the domain answered the ping, which returns False rather than raising on a failure
+        """
+        if self._client.ping(request_timeout=self._connect_timeout or self._request_timeout):
+            return True
+        logger.warning("Ping of open search index %s failed, the first search opens its own connection", self._index)
+        return False
+
+    def index_version(self):
+        """
+        Returns the version of the content of the index, the name and the content version which ingest.py records
+        in the _meta of each index behind the name, so that it changes when the index is written to by ingestion
+        or its alias is switched, but not on cluster maintenance, e.g. a node restart or a shard relocation
+        """
+        response = self._guarded(lambda: self._client.indices.get_mapping(index=self._index,
+                                                                          request_timeout=self._search_timeout))
+        return ','.join(f"{name}:{(mapping.get('mappings') or {}).get('_meta', {}).get('content_version')}"
+                        for name, mapping in sorted(response.items()))
+
     @staticmethod
-    def _get_query(vector=[], size_output=5, knn_k=6):
+    def _get_query(vector=[], size_output=5, knn_k=6, from_offset=0, ef_search=None, filter_expression=None):
+        knn_query = {
+            "vector": vector,
+            "k": min(knn_k, 256)
+        }
+        if filter_expression is not None:
+            # efficient filtering of the lucene or faiss engine, k neighbors are searched among matched documents
+            knn_query["filter"] = compile_filter(filter_expression)
+        if ef_search is not None:
+            # query time ef_search needs OpenSearch 2.16 or later
+            knn_query["method_parameters"] = {"ef_search": ef_search}
+
         query = {
             "size": size_output,
-            "from": 0,
+            "from": from_offset,
             "_source": {
                 "excludes": ["question_vector"]
             },
             "query": {
                 "knn": {
-                    "question_vector": {
-                        "vector": vector,
-                        "k": min(knn_k, 256)
-                    }
+                    "question_vector": knn_query
                 }
             }
         }
@@ -113,7 +261,12 @@ class OpenSearchClient(object):
     def knn_search_by_text_vectors(self,
                                    text_vector,
                                    knn_k=6,
-                                   size_output=8):
+                                   size_output=6,
+                                   from_offset=0,
+                                   ef_search=None,
+                                   filter_expression=None,
+                                   index_name=None,
+                                   request_timeout=None):
         """
         Search by vectors
 
@@ -121,30 +274,164 @@ class OpenSearchClient(object):
             :text_vector: text vector. must not null or empty
             :size_output: max output size
             :knn_k: param k of knn
-            :min_confidence: The minimum confidence level for the labels to return
+            :from_offset: offset of the first output in the k nearest neighbors
+            :ef_search: size of the candidate list of HNSW, the index setting if absent
+            :filter_expression: metadata filter of filters.compile_filter
+            :index_name: index to search instead of the one of the client, e.g. in a federated search
+            :request_timeout: read timeout of the request, search_timeout if absent
         """
         if text_vector is None or len(text_vector) == 0:
             raise ValueError('Text vectors cannot be null or empty')
 
         query = OpenSearchClient._get_query(vector=text_vector,
                                             size_output=size_output,
-                                            knn_k=knn_k)
+                                            knn_k=knn_k,
+                                            from_offset=from_offset,
+                                            ef_search=ef_search,
+                                            filter_expression=filter_expression)
+        index = index_name or self._index
         try:
-            logger.debug(
-                f"Querying answers from index {self._index} by vector with length {len(text_vector)}")
+            logger.debug("Querying answers from index %s by vector with length %s", index, len(text_vector))
 
-            response = self._client.search(request_timeout=self._request_timeout,
-                                           index=self._index,
-                                           body=query)
+            response = self._guarded(lambda: self._client.search(
+                request_timeout=request_timeout or self._search_timeout,
+                index=index,
+                body=query))
 
-            logger.debug(f"Queried answers from open search index {self._index} by {query}: {response}")
+            logger.debug("Queried answers from open search index %s by %s: %s",
+                         index, Truncated(query), Truncated(response))
             return self._resolve_result(response)
         except Exception as e:
-            logger.exception(
-                f"Couldn't query image materials from open search index {self._index} by {query}")
+            logger.exception("Couldn't query image materials from open search index %s by %s", index, Truncated(query))
+
+            raise e
+
+    def keyword_search(self,
+                       search_words,
+                       size_output=6,
+                       from_offset=0,
+                       filter_expression=None,
+                       index_name=None,
+                       request_timeout=None):
+        """
+        Search by a BM25 match of the search words on the question and answers text fields, which needs
+        no embedding, e.g. when the embedding endpoint is too slow
+
+        Args:
+            :search_words: search words. must not null or empty
+            :size_output: max output size
+            :from_offset: offset of the first output
+            :filter_expression: metadata filter of filters.compile_filter
+            :index_name: index, comma separated indices or alias to search instead of the one of the client
+            :request_timeout: read timeout of the request, search_timeout if absent
+        """
+        if search_words is None or len(search_words) == 0:
+            raise ValueError('Search words cannot be null or empty')
+
+        bool_query = {"must": {"multi_match": {"query": search_words, "fields": ["question", "answers"]}}}
+        if filter_expression is not None:
+            bool_query["filter"] = compile_filter(filter_expression)
+        query = {
+            "size": size_output,
+            "from": from_offset,
+            "_source": {
+                "excludes": ["question_vector"]
+            },
+            "query": {
+                "bool": bool_query
+            }
+        }
+        index = index_name or self._index
+        try:
+            response = self._guarded(lambda: self._client.search(
+                request_timeout=request_timeout or self._search_timeout,
+                index=index,
+                body=query))
+            return self._resolve_result(response)
+        except Exception as e:
+            logger.exception("Couldn't keyword search open search index %s by %s", index, Truncated(search_words))
+            raise e
+
+    def knn_search_by_text_vectors_batch(self,
+                                         text_vectors,
+                                         knn_k=6,
+                                         size_output=6,
+                                         ef_search=None,
+                                         filter_expression=None):
+        """
+        Search by many vectors in one multi-search request
+
+        Args:
+            :text_vectors: list of text vectors. must not null or empty
+            :size_output: max output size per vector
+            :knn_k: param k of knn
+            :ef_search: size of the candidate list of HNSW, the index setting if absent
+            :filter_expression: metadata filter of filters.compile_filter
+        Returns:
+            a list of (results, error) aligned with text_vectors
+        """
+        if text_vectors is None or len(text_vectors) == 0:
+            raise ValueError('Text vectors cannot be null or empty')
+
+        body = []
+        for text_vector in text_vectors:
+            body.append({'index': self._index})
+            body.append(OpenSearchClient._get_query(vector=text_vector,
+                                                    size_output=size_output,
+                                                    knn_k=knn_k,
+                                                    ef_search=ef_search,
+                                                    filter_expression=filter_expression))
+        try:
+            logger.debug("Multi-searching answers from index %s by %s vectors", self._index, len(text_vectors))
+
+            response = self._guarded(lambda: self._client.msearch(request_timeout=self._search_timeout, body=body))
+        except Exception as e:
+            logger.exception("Couldn't multi-search from open search index %s by %s vectors", self._index,
+                             len(text_vectors))
 
             raise e
 
+        responses = response.get('responses') or []
+        results = []
+        for i in range(len(text_vectors)):
+            item = responses[i] if i < len(responses) else {'error': 'Missing response'}
+            error = item.get('error')
+            if error is not None:
+                results.append(([], error if isinstance(error, str) else json.dumps(error)))
+            else:
+                results.append((self._resolve_result(item), None))
+
+        return results
+
+    def get_document(self, doc_id):
+        """
+        Get a document by id excluding vectors, returns None if it does not exist
+        """
+        try:
+            response = self._guarded(lambda: self._client.get(index=self._index,
+                                                              id=doc_id,
+                                                              _source_excludes='question_vector',
+                                                              request_timeout=self._search_timeout))
+        except NotFoundError:
+            return None
+
+        return {'id': response['_id'], 'source': response.get('_source')}
+
+    def get_documents(self, doc_ids, fields=None):
+        """
+        Get documents by ids in one request excluding vectors, in the order of ids and without absent ones
+
+        Args:
+            :doc_ids: document ids
+            :fields: source fields to fetch, all if absent
+        """
+        response = self._guarded(lambda: self._client.mget(index=self._index,
+                                                           body={'ids': list(doc_ids)},
+                                                           _source_excludes='question_vector',
+                                                           _source_includes=','.join(fields) if fields else None,
+                                                           request_timeout=self._search_timeout))
+        return [{'id': doc['_id'], 'source': doc.get('_source')} for doc in response['docs'] if doc.get('found')]
+
     @staticmethod
     def _resolve_result(response):
         """
@@ -171,28 +458,77 @@ class SageMakerClient(object):
     around parts of the Boto3 Amazon Session API.
     """
 
-    def __init__(self, endpoint_name: str = "", boto3_session: boto3.Session = None):
+    _STRUCT_FORMATS = {'float32': 'f', 'float16': 'e'}
+
+    def __init__(self,
+                 endpoint_name: str = "",
+                 boto3_session: boto3.Session = None,
+                 encoding: str = "float32",
+                 connect_timeout=None,
+                 read_timeout=None,
+                 max_attempts=None,
+                 retry_mode='standard',
+                 dependency: Dependency = None):
         """
         Args:
             :endpoint_name: A sagemaker endpoint name.
             :boto3_session: A Boto3 session.
+            :encoding: vector encoding asked from the endpoint, json, float32 or float16
+            :connect_timeout: seconds to open a connection, the botocore default if absent
+            :read_timeout: seconds to wait for a response, the botocore default if absent
+            :max_attempts: attempts of a call including retries, the botocore default if absent
+            :retry_mode: botocore retry mode, legacy, standard or adaptive
+            :dependency: circuit breaker and hedging of the calls, none if absent
         """
         self._endpoint_name = endpoint_name
-        self._client = boto3_session.client(service_name="sagemaker-runtime")
+        self._encoding = encoding
+        self._dependency = dependency
+        config = {'retries': {'mode': retry_mode}}
+        if max_attempts is not None:
+            config['retries']['total_max_attempts'] = max_attempts
+        if connect_timeout is not None:
+            config['connect_timeout'] = connect_timeout
+        if read_timeout is not None:
+            config['read_timeout'] = read_timeout
+        self._client = boto3_session.client(service_name="sagemaker-runtime", config=Config(**config))
 
     def _invoke(self, json_body):
+        def invoke_endpoint():
+            return self._client.invoke_endpoint(EndpointName=self._endpoint_name,
+                                                ContentType='application/json',
+                                                Body=json_body,
+                                                Accept='application/json')
+
         try:
-            response = self._client.invoke_endpoint(EndpointName=self._endpoint_name,
-                                                    ContentType='application/json',
-                                                    Body=json_body,
-                                                    Accept='application/json')
-            return response
+            if self._dependency is None:
+                return invoke_endpoint()
+            return self._dependency.call(invoke_endpoint)
+        except CircuitOpenError as e:
+            logger.warning("Skip sagemaker endpoint %s: %s", self._endpoint_name, e)
+            raise e
         except Exception as e:
-            logger.exception(
-                f"Invoke sagemaker endpoint {self._endpoint_name} by {json_body} has exception: {json_body}, by endpoint {self._endpoint_name}")
+            logger.exception("Invoke sagemaker endpoint %s by %s has exception", self._endpoint_name, Truncated(json_body))
 
             raise e
 
+    @staticmethod
+    def _decode_vectors(output):
+        """
+        Decode pooled vectors from the custom inference handler, or the token embeddings of
+        the default feature-extraction handler, of which the first token is kept
+        """
+        if isinstance(output, list):
+            return [vector[0][0] for vector in output]
+
+        encoding = output.get('encoding')
+        vectors = output.get('vectors') or []
+        if encoding == 'json':
+            return vectors
+
+        struct_format = SageMakerClient._STRUCT_FORMATS[encoding]
+        dimension = output['dimension']
+        return [list(struct.unpack(f'<{dimension}{struct_format}', base64.b64decode(vector))) for vector in vectors]
+
     def generate_vectors(self, keywords: list[str]):
         """
         Send request to sagemaker endpoint to generate labels
@@ -200,48 +536,284 @@ class SageMakerClient(object):
         Args:
             :keywords: keywords list to generate embeddings
         """
-        json_input = json.dumps({'inputs': keywords, "options": {"wait_for_model": True}})
-        logger.debug(f"Generate embedding from sagemaker {self._endpoint_name} by {json_input}")
+        json_input = json.dumps({'inputs': keywords,
+                                 'parameters': {'pooling': 'cls', 'encoding': self._encoding},
+                                 "options": {"wait_for_model": True}})
+        logger.debug("Generate embedding from sagemaker %s by %s", self._endpoint_name, Truncated(json_input))
 
         response = self._invoke(json_body=json_input)
         try:
-            vectors = json.loads(response['Body'].read())
-            if not isinstance(vectors, list) or len(vectors) == 0:
-                logger.warning(
-                    f"Generate embedding from sagemaker {self._endpoint_name} by {json_input} has unsuccessful result: {vectors}")
+            vectors = SageMakerClient._decode_vectors(json.loads(response['Body'].read()))
+            if len(vectors) == 0:
+                logger.warning("Generate embedding from sagemaker %s by %s has unsuccessful result: %s",
+                               self._endpoint_name, Truncated(json_input), Truncated(vectors))
                 return []
 
             if len(vectors) != len(keywords):
-                logger.warning(
-                    f"Generate embedding from sagemaker {self._endpoint_name} by {json_input} has umatched output witu input, vectors len {len(vectors)} != keywords len {len(keywords)}")
+                logger.warning("Generate embedding from sagemaker %s by %s has umatched output witu input, "
+                               "vectors len %s != keywords len %s",
+                               self._endpoint_name, Truncated(json_input), len(vectors), len(keywords))
                 return []
 
-            results = [vector[0][0] for vector in vectors]
-            logger.debug(f"Generated embedding from  sagemaker {self._endpoint_name} by {json_input}: {results}")
-            return results
+            logger.debug("Generated embedding from sagemaker %s by %s: %s",
+                         self._endpoint_name, Truncated(json_input), Truncated(vectors))
+            return vectors
         except Exception as e:
-            logger.exception(
-                f"Generate embedding from sagemaker {self._endpoint_name} by {json_input} has exception: {json_input}")
+            logger.exception("Generate embedding from sagemaker %s by %s has exception",
+                             self._endpoint_name, Truncated(json_input))
             raise e
 
 
+def _create_opensearch_client(boto3_session):
+    if _get_string_from_env('search_backend', 'opensearch') == 'local':
+        # imported lazily so that the opensearch backend does not pay for numpy
+        from local_vector_search import LocalVectorSearchClient
+        return LocalVectorSearchClient(path=_get_string_from_env('local_vector_path'),
+                                       boto3_session=boto3_session,
+                                       ef_search=_get_int_from_env('local_vector_ef_search', 100))
+
+    return OpenSearchClient(request_timeout=20,
+                            dependency=_get_dependency('opensearch', is_opensearch_failure),
+                            max_retries=_get_int_from_env('opensearch_max_retries', 3),
+                            index_name=_get_string_from_env('index', 'qa_knowledge_index'),
+                            boto3_session=boto3_session,
+                            search_timeout=_get_int_from_env('opensearch_search_timeout_seconds', 0) or None,
+                            connect_timeout=_get_int_from_env('opensearch_connect_timeout_seconds', 3) or None,
+                            pool_maxsize=_get_int_from_env('opensearch_pool_maxsize', 10),
+                            http_compress=_get_string_from_env('opensearch_http_compress', 'true') == 'true')
+
+
+def _get_hedge_executor():
+    global _HEDGE_EXECUTOR
+    if _HEDGE_EXECUTOR is None:
+        _HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=_get_int_from_env('hedge_workers', 8),
+                                             thread_name_prefix='hedge')
+    return _HEDGE_EXECUTOR
+
+
+def _get_dependency(name, is_failure):
+    """
+    The circuit breaker and hedging of a dependency, shared by its clients, e.g. those of warm up threads,
+    configured by env keys prefixed with its name, and faults injected by the fault_injection env,
+    e.g. {"sagemaker": {"error_rate": 0.5, "delay_ms": 200}}
+    """
+    with _DEPENDENCIES_LOCK:
+        if name not in _DEPENDENCIES:
+            faults = _get_json_from_env('fault_injection', {}).get(name)
+            hedge = _get_string_from_env(f'{name}_hedge', 'false') == 'true'
+            _DEPENDENCIES[name] = Dependency(
+                name,
+                CircuitBreaker(name,
+                               failure_threshold=_get_int_from_env(f'{name}_breaker_failures', 5),
+                               reset_seconds=_get_int_from_env(f'{name}_breaker_reset_seconds', 30),
+                               is_failure=is_failure),
+                hedge_executor=_get_hedge_executor() if hedge else None,
+                hedge_percentile=_get_int_from_env(f'{name}_hedge_percentile', 95),
+                hedge_min_samples=_get_int_from_env(f'{name}_hedge_min_samples', 20),
+                fault_injector=FaultInjector(**faults) if faults else None)
+        return _DEPENDENCIES[name]
+
+
+def _dependency_stats():
+    return {name: dependency.stats() for name, dependency in list(_DEPENDENCIES.items())}
+
+
+def _emit_dependency_metrics():
+    """
+    Breaker states and call, failure, rejection and hedge counts of each dependency as CloudWatch metrics
+    """
+    namespace = _get_string_from_env('metrics_namespace', 'SmartSearch')
+    if namespace == 'none':
+        return
+    for name, dependency in list(_DEPENDENCIES.items()):
+        metrics = dependency.metrics()
+        emit_metrics(namespace, {'Dependency': name}, {
+            'BreakerState': (metrics['state'], 'None'),
+            'Calls': (metrics['calls'], 'Count'),
+            'Failures': (metrics['failures'], 'Count'),
+            'Rejections': (metrics['rejections'], 'Count'),
+            'BreakerOpens': (metrics['opens'], 'Count'),
+            'Hedges': (metrics['hedges'], 'Count'),
+            'HedgeWins': (metrics['hedge_wins'], 'Count'),
+        })
+
+
 def _get_opensearch_client():
     global _OS_CLIENT
     if _OS_CLIENT is None:
-        _OS_CLIENT = OpenSearchClient(request_timeout=20,
-                                      index_name=_get_string_from_env('index', 'qa_knowledge_index'),
-                                      boto3_session=_get_session())
+        _OS_CLIENT = _create_opensearch_client(_get_session())
     return _OS_CLIENT
 
 
+def _create_embedding_client(boto3_session):
+    if _get_string_from_env('embedding_provider', 'sagemaker') == 'local':
+        # imported lazily so that the sagemaker provider does not pay for onnxruntime
+        from local_embedding import LocalEmbeddingClient
+        return LocalEmbeddingClient(model_path=_get_string_from_env('local_embedding_model_path'),
+                                    boto3_session=boto3_session,
+                                    intra_op_threads=_get_int_from_env('local_embedding_threads', 0))
+
+    return SageMakerClient(endpoint_name=_get_string_from_env('embedding_endpoint_name'),
+                           boto3_session=boto3_session,
+                           encoding=_get_string_from_env('embedding_encoding', 'float32'),
+                           connect_timeout=_get_int_from_env('sagemaker_connect_timeout_seconds', 2),
+                           read_timeout=_get_int_from_env('sagemaker_read_timeout_seconds', 10),
+                           max_attempts=_get_int_from_env('sagemaker_max_attempts', 2),
+                           retry_mode=_get_string_from_env('sagemaker_retry_mode', 'standard'),
+                           dependency=_get_dependency('sagemaker', is_sagemaker_failure))
+
+
 def _get_embedding_client():
     global _EMBEDDING_CLIENT
     if _EMBEDDING_CLIENT is None:
-        _EMBEDDING_CLIENT = SageMakerClient(
-            endpoint_name=_get_string_from_env('embedding_endpoint_name'), boto3_session=_get_session())
+        _EMBEDDING_CLIENT = _create_embedding_client(_get_session())
     return _EMBEDDING_CLIENT
 
 
+def _opensearch_stats():
+    opensearch_client = _get_opensearch_client()
+    if isinstance(opensearch_client, OpenSearchClient):
+        return opensearch_client.stats()
+    return None
+
+
+def _get_search_executor():
+    global _SEARCH_EXECUTOR
+    if _SEARCH_EXECUTOR is None:
+        _SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=_get_int_from_env('federated_search_workers', 8),
+                                              thread_name_prefix='federated-search')
+    return _SEARCH_EXECUTOR
+
+
+def _get_deadline_executor():
+    global _DEADLINE_EXECUTOR
+    if _DEADLINE_EXECUTOR is None:
+        # apart from the federated search executor, which a vector search may wait for in it
+        _DEADLINE_EXECUTOR = ThreadPoolExecutor(max_workers=_get_int_from_env('search_deadline_workers', 8),
+                                                thread_name_prefix='deadline-search')
+    return _DEADLINE_EXECUTOR
+
+
+def _get_embedding_cache():
+    global _EMBEDDING_CACHE
+    if _EMBEDDING_CACHE is None:
+        shared_path = _get_string_from_env('embedding_cache_shared_path')
+        _EMBEDDING_CACHE = EmbeddingCache(
+            max_size=_get_int_from_env('embedding_cache_size', 1024),
+            ttl_seconds=_get_int_from_env('embedding_cache_ttl_seconds', 3600),
+            shared_store=SqliteCacheStore(shared_path) if shared_path else None)
+    return _EMBEDDING_CACHE
+
+
+def _get_built_file_path(env_key, default_value):
+    """
+    Path of a file built by ingestion, shipped with the lambda or on s3, None if it was not built
+    """
+    path = _get_string_from_env(env_key, default_value)
+    if path.startswith('s3://'):
+        return path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    return path if os.path.exists(path) else None
+
+
+def _get_suggest_index():
+    global _SUGGEST_INDEX
+    if _SUGGEST_INDEX is None:
+        path = _get_built_file_path('suggest_index_path', 'suggest_index.json')
+        if path is None:
+            return None
+        # a session of its own, as the index is also loaded by a warm up thread
+        _SUGGEST_INDEX = SuggestIndex(path)
+    return _SUGGEST_INDEX
+
+
+def _get_faq_table():
+    global _FAQ_TABLE
+    if _FAQ_TABLE is None:
+        path = _get_built_file_path('faq_table_path', 'faq_table.json')
+        if path is None:
+            return None
+        _FAQ_TABLE = FaqTable(path)
+    return _FAQ_TABLE
+
+
+def _get_semantic_cache():
+    """
+    The semantic result cache, None if semantic_cache_size is 0 or numpy is not bundled with the lambda
+    """
+    global _SEMANTIC_CACHE, _SEMANTIC_CACHE_UNAVAILABLE
+    if _SEMANTIC_CACHE is None and not _SEMANTIC_CACHE_UNAVAILABLE and _get_int_from_env('semantic_cache_size', 0) > 0:
+        # imported lazily so that the opensearch backend does not pay for numpy unless the cache is on
+        try:
+            from semantic_cache import SemanticResultCache
+        except ImportError as e:
+            logger.warning("Semantic cache is off, it needs numpy of requirements-local.txt: %s", e)
+            _SEMANTIC_CACHE_UNAVAILABLE = True
+            return None
+        _SEMANTIC_CACHE = SemanticResultCache(
+            max_size=_get_int_from_env('semantic_cache_size', 0),
+            threshold=_get_float_from_env('semantic_cache_threshold', 0.98),
+            metric=_get_string_from_env('semantic_cache_metric', 'cosine'),
+            ttl_seconds=_get_int_from_env('semantic_cache_ttl_seconds', 300),
+            report_thresholds=_get_json_from_env('semantic_cache_report_thresholds', [0.9, 0.95, 0.98, 0.99]))
+    return _SEMANTIC_CACHE
+
+
+def _index_version():
+    """
+    Version of the searched index, which the semantic cache and the faq table are valid for,
+    checked at most every semantic_cache_version_seconds
+    """
+    global _INDEX_VERSION
+    version, checked_at = _INDEX_VERSION
+    if version is None or time.time() - checked_at >= _get_int_from_env('semantic_cache_version_seconds', 30):
+        opensearch_client = _get_opensearch_client()
+        if isinstance(opensearch_client, OpenSearchClient):
+            version = opensearch_client.index_version()
+        else:
+            version = _get_string_from_env('local_vector_path')
+        _INDEX_VERSION = (version, time.time())
+    return version
+
+
+def _semantic_cache_key(knn_params):
+    return json.dumps({key: knn_params[key] for key in ('size', 'from', 'k', 'ef_search', 'filter')},
+                      sort_keys=True, separators=(',', ':'))
+
+
+def _cached_semantic_search(search_vector, knn_params):
+    """
+    Results of a recent search with a vector close to search_vector and the same knn params, or a search
+    of the index which is then cached
+
+    Returns:
+        the results and whether they were served by the cache
+    """
+    semantic_cache = _get_semantic_cache()
+    if semantic_cache is None:
+        return _semantic_search(search_vector, knn_params), False
+
+    try:
+        version = _index_version()
+    except Exception:
+        logger.warning("Couldn't get the index version, search without the semantic cache", exc_info=True)
+        return _semantic_search(search_vector, knn_params), False
+
+    params_key = _semantic_cache_key(knn_params)
+    cached_results = semantic_cache.get(search_vector, params_key, version)
+    if cached_results is not None:
+        return cached_results, True
+
+    searched_results = _semantic_search(search_vector, knn_params)
+    semantic_cache.put(search_vector, params_key, version, searched_results)
+    return searched_results, False
+
+
+def _semantic_cache_stats():
+    semantic_cache = _get_semantic_cache()
+    return semantic_cache.stats() if semantic_cache is not None else None
+
+
 def _not_support(error_code, message):
     return _error_response(405, error_code, message)
 
@@ -267,6 +839,53 @@ def _json_response(status_code, body):
     }
 
 
+def _negotiate_encoding(accept_encoding):
+    """
+    Pick br or gzip from an Accept-Encoding header, None for identity
+    """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for coding in ('br', 'gzip'):
+        if coding == 'br' and brotli is None:
+            continue
+        if accepted.get(coding, accepted.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+
+def _compress_response(response, event):
+    """
+    Compress a json response as the client accepts, base64 encoded for API Gateway
+    """
+    body = response.get('body')
+    if response.get('isBase64Encoded') or body is None:
+        return response
+
+    data = body.encode('utf-8')
+    if len(data) < _get_int_from_env('response_compression_min_bytes', 1024):
+        return response
+
+    coding = _negotiate_encoding(_lowercase(event.get('headers')).get('accept-encoding'))
+    if coding is None:
+        return response
+
+    compressed = brotli.compress(data, quality=5) if coding == 'br' else gzip.compress(data, compresslevel=5)
+    headers = dict(response.get('headers') or {})
+    headers['content-encoding'] = coding
+    headers['vary'] = 'Accept-Encoding'
+    return dict(response, headers=headers, body=base64.b64encode(compressed).decode('ascii'), isBase64Encoded=True)
+
+
 class Stopwatch(object):
     def start(self):
         self._start = time.time()
@@ -290,65 +909,721 @@ def _check_len(max_len, str_value, str_name):
     return None
 
 
-def _param_check(event):
+def _request_check(event):
     resource_path = event.get('requestContext', {}).get('resourcePath')
+    http_method = event.get('httpMethod')
     headers = _lowercase(event.get('headers'))
     content_type = headers.get('content-type', '')
 
-    ## check headers and http method, path
-    if content_type != 'application/json':
-        return _not_support(error_code="UnsupportedMediaType",
-                            message=f'Unsupported request with content type: {content_type}'), None, None
+    ## check path, http method and headers
+    if resource_path is None or resource_path not in _ROUTES:
+        return _not_support(error_code="PathNotAllowed",
+                            message=f'Unsupported request with path: {resource_path}, this lambda allows {", ".join(_ROUTES)}'), None
 
-    if event.get('httpMethod') is None or event.get('httpMethod').upper() != 'POST':
+    allowed_method, route_handler = _ROUTES[resource_path]
+    if http_method is None or http_method.upper() != allowed_method:
         return _not_support(error_code="MethodNotAllowed",
-                            message=f"Unsupported request with method: {event['httpMethod']}"), None, None
+                            message=f"Unsupported request with method: {http_method}"), None
 
-    if resource_path is None or resource_path != f'/smart_search':
-        return _not_support(error_code="PathNotAllowed",
-                            message=f'Unsupported request with path: {resource_path}, this lambda allows /smart_search'), None, None
+    if allowed_method == 'POST':
+        if content_type != 'application/json':
+            return _not_support(error_code="UnsupportedMediaType",
+                                message=f'Unsupported request with content type: {content_type}'), None
+
+        if event.get('body') is None:
+            return _bad_request(message='Message body is empty'), None
+
+    return None, route_handler
+
+
+def _load_body(event):
+    try:
+        body = event["body"]
+        if event.get('isBase64Encoded'):
+            # API Gateway encodes request bodies too since responses may be binary
+            body = base64.b64decode(body).decode('utf-8')
+        json_body = json.loads(body)
+    except (ValueError, UnicodeDecodeError) as e:
+        return _bad_request(message=f'Message body is not a valid json: {e}'), None
+
+    if not isinstance(json_body, dict):
+        return _bad_request(message='Message body should be a json object'), None
+
+    return None, json_body
+
+
+def _view_param_check(json_body):
+    """
+    Check fields and snippet_chars which shape the returned source of each result
+    """
+    fields = json_body.get('fields')
+    fields_max_size = _get_int_from_env('fields_max_size', 20)
+    if fields is not None and (not isinstance(fields, list) or len(fields) == 0 or len(fields) > fields_max_size
+                               or not all(isinstance(field, str) for field in fields)):
+        return _bad_request(
+            message=f'fields should be a list of field names with size in the range of (0, {fields_max_size}]'), None
+
+    snippet_chars = json_body.get('snippet_chars')
+    if snippet_chars is not None and (isinstance(snippet_chars, bool) or not isinstance(snippet_chars, int)
+                                      or snippet_chars <= 0):
+        return _bad_request(message='snippet_chars should be a positive integer'), None
+
+    return None, {'fields': fields, 'snippet_chars': snippet_chars}
+
+
+def _int_param_check(json_body, name, default_value, min_value, max_value):
+    value = json_body.get(name, default_value)
+    if value is None:
+        return None, None
+
+    if isinstance(value, bool) or not isinstance(value, int) or value < min_value or value > max_value:
+        return _bad_request(message=f'{name} should be an integer in the range of [{min_value}, {max_value}]'), None
+    return None, value
+
+
+def _knn_param_check(json_body):
+    """
+    Check k, size, from and ef_search of the knn query against the bounds of env and its filter,
+    k is raised to from + size so that the requested page can be met
+    """
+    knn_k_max = _get_int_from_env('knn_k_max', 100)
+    checks = [
+        ('size', _get_int_from_env('search_size_default', 6), 1, _get_int_from_env('search_size_max', 50)),
+        ('from', 0, 0, knn_k_max - 1),
+        ('k', None, 1, knn_k_max),
+        ('ef_search', None, _get_int_from_env('ef_search_min', 10), _get_int_from_env('ef_search_max', 1024)),
+    ]
+    knn_params = {}
+    for name, default_value, min_value, max_value in checks:
+        errors, knn_params[name] = _int_param_check(json_body, name, default_value, min_value, max_value)
+        if errors:
+            return errors, None
+
+    ## query time ef_search needs OpenSearch 2.16 or later, which the domain of this workshop is not
+    if knn_params['ef_search'] is not None and _get_string_from_env('search_backend', 'opensearch') != 'local' \
+            and _get_string_from_env('opensearch_query_ef_search', 'false') != 'true':
+        return _bad_request(message='ef_search needs OpenSearch 2.16 or later, '
+                                    'set opensearch_query_ef_search=true on such a domain'), None
+
+    filter_expression = json_body.get('filter')
+    if filter_expression is not None:
+        try:
+            compile_filter(filter_expression)
+        except FilterError as e:
+            return _bad_request(message=f'filter is invalid: {e}'), None
+    knn_params['filter'] = filter_expression
+
+    indices = json_body.get('indices')
+    if indices is not None:
+        if _get_string_from_env('search_backend', 'opensearch') == 'local':
+            return _bad_request(message='indices are not supported by the local search backend'), None
+        try:
+            indices = resolve_indices(indices,
+                                      default_index=_get_string_from_env('index', 'qa_knowledge_index'),
+                                      groups=_get_json_from_env('index_groups', {}),
+                                      max_indices=_get_int_from_env('federated_indices_max', 10))
+        except FederationError as e:
+            return _bad_request(message=f'indices are invalid: {e}'), None
+    knn_params['indices'] = indices
+
+    page_end = knn_params['from'] + knn_params['size']
+    if page_end > knn_k_max:
+        return _bad_request(message=f'from + size should not be larger than {knn_k_max}, current is {page_end}'), None
+
+    knn_params['k'] = max(knn_params['k'] or 0, page_end)
+    return None, knn_params
+
+
+def _encode_cursor(vector, knn_params):
+    """
+    A cursor of the next page, carrying the query vector so that the next page skips embedding
+    """
+    payload = dict(knn_params,
+                   vector=base64.b64encode(struct.pack(f'<{len(vector)}f', *vector)).decode('ascii'),
+                   expires_at=int(time.time()) + _get_int_from_env('cursor_ttl_seconds', 300))
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        vector_bytes = base64.b64decode(payload.pop('vector'))
+        vector = list(struct.unpack(f'<{len(vector_bytes) // 4}f', vector_bytes))
+        expires_at = payload.pop('expires_at')
+    except (ValueError, TypeError, KeyError, AttributeError, struct.error):
+        return _bad_request(message='search_after is not a valid cursor'), None, None
 
-    if 'body' not in event:
-        return _bad_request(message=f'Message body is empty'), None, None
+    if len(vector) == 0 or not isinstance(expires_at, int) or expires_at < time.time():
+        return _error_response(400, 'CursorExpired', 'search_after cursor is expired, search again'), None, None
+    return None, vector, payload
 
-    ## check input body
-    json_body = json.loads(event["body"])
+
+def _param_check(event):
+    errors, json_body = _load_body(event)
+    if errors:
+        return errors, None
+
+    search_after = json_body.get('search_after')
     search_words = json_body.get('search_words')
-    search_words_max_len = _get_int_from_env('search_words_max_size', 100)
+    vector = None
+    if search_after is not None:
+        ## the next page of a previous search, its vector and knn params are in the cursor
+        if not isinstance(search_after, str) or 'from' in json_body:
+            return _bad_request(message='search_after should be a cursor string and not be used with from'), None
+
+        errors, vector, cursor_params = _decode_cursor(search_after)
+        if errors:
+            return errors, None
+        json_body = dict(cursor_params, **{key: json_body[key] for key in ('size', 'k', 'ef_search', 'fields', 'snippet_chars')
+                                           if key in json_body})
+        ## the filter is part of the query, so a page keeps the one of its cursor
+        search_words = None
+    else:
+        ## check search_words
+        search_words_max_len = _get_int_from_env('search_words_max_size', 100)
+        if not isinstance(search_words, str):
+            search_words = None
+        checked_search_words = _check_len(search_words_max_len, search_words, 'search_words')
+        if checked_search_words:
+            return checked_search_words, None
+
+    errors, knn_params = _knn_param_check(json_body)
+    if errors:
+        return errors, None
+
+    errors, view = _view_param_check(json_body)
+    if errors:
+        return errors, None
 
-    ## check search_words
-    checked_search_words = _check_len(search_words_max_len, search_words, 'search_words')
-    if checked_search_words:
-        return checked_search_words, None
+    return None, dict(view, search_words=search_words, vector=vector, knn=knn_params)
 
-    return None, search_words
+
+def _batch_param_check(event):
+    errors, json_body = _load_body(event)
+    if errors:
+        return errors, None
+
+    search_words_list = json_body.get('search_words_list')
+    batch_max_size = _get_int_from_env('batch_max_size', 100)
+    if not isinstance(search_words_list, list) or len(search_words_list) == 0 or len(search_words_list) > batch_max_size:
+        return _bad_request(
+            message=f'search_words_list should be a list with size in the range of (0, {batch_max_size}]'), None
+
+    ## one page per search words, from and search_after are not supported
+    errors, knn_params = _knn_param_check({key: json_body[key] for key in ('size', 'k', 'ef_search', 'filter')
+                                           if key in json_body})
+    if errors:
+        return errors, None
+
+    errors, view = _view_param_check(json_body)
+    if errors:
+        return errors, None
+
+    return None, dict(view, search_words_list=search_words_list, knn=knn_params)
+
+
+def _embedding_model_name():
+    if _get_string_from_env('embedding_provider', 'sagemaker') == 'local':
+        return f"local:{_get_string_from_env('local_embedding_model_path')}"
+    return _get_string_from_env('embedding_endpoint_name')
 
 
 def _generate_embedding(search_words):
+    endpoint_name = _embedding_model_name()
+    embedding_cache = _get_embedding_cache()
+    cached_vector = embedding_cache.get(endpoint_name, search_words)
+    if cached_vector is not None:
+        return [cached_vector]
+
+    embedding_client = _get_embedding_client()
+    vectors = embedding_client.generate_vectors([search_words])
+    if len(vectors) > 0:
+        embedding_cache.put(endpoint_name, search_words, vectors[0])
+    return vectors
+
+
+def _generate_embeddings(search_words_list):
+    """
+    Generate embeddings for many search words by cache and chunked endpoint calls,
+    returns a list aligned with the input, the item is None if its embedding failed
+    """
+    endpoint_name = _embedding_model_name()
+    embedding_cache = _get_embedding_cache()
+    vectors = [embedding_cache.get(endpoint_name, search_words) for search_words in search_words_list]
+
+    missed = {}
+    for search_words, vector in zip(search_words_list, vectors):
+        if vector is None:
+            missed.setdefault(normalize_search_words(search_words), search_words)
+
+    missed_words = list(missed.values())
+    generated = {}
+    chunk_size = max(_get_int_from_env('embedding_batch_size', 16), 1)
     embedding_client = _get_embedding_client()
-    return embedding_client.generate_vectors([search_words])
+    for start in range(0, len(missed_words), chunk_size):
+        chunk = missed_words[start:start + chunk_size]
+        try:
+            chunk_vectors = embedding_client.generate_vectors(chunk)
+        except Exception:
+            logger.warning("Couldn't generate embeddings for chunk at %s with size %s", start, len(chunk), exc_info=True)
+            continue
 
+        for search_words, vector in zip(chunk, chunk_vectors):
+            generated[normalize_search_words(search_words)] = vector
+            embedding_cache.put(endpoint_name, search_words, vector)
 
-def _semantic_search(search_vector):
+    return [vector if vector is not None else generated.get(normalize_search_words(search_words))
+            for search_words, vector in zip(search_words_list, vectors)]
+
+
+def _semantic_search(search_vector, knn_params):
+    opensearch_client = _get_opensearch_client()
+    return opensearch_client.knn_search_by_text_vectors(search_vector,
+                                                        knn_k=knn_params['k'],
+                                                        size_output=knn_params['size'],
+                                                        from_offset=knn_params['from'],
+                                                        ef_search=knn_params['ef_search'],
+                                                        filter_expression=knn_params['filter'])
+
+
+def _federated_search(search_vector, knn_params):
+    """
+    Fan the knn query out to the indices concurrently and merge their results into the global top k,
+    indices which fail or do not answer in federated_search_timeout_ms are left out of a partial result
+
+    Returns:
+        the page of merged results, each with its index, and the status of each index, ok, timeout or error
+    """
+    opensearch_client = _get_opensearch_client()
+    timeout_seconds = _get_int_from_env('federated_search_timeout_ms', 3000) / 1000
+    page_end = knn_params['from'] + knn_params['size']
+    executor = _get_search_executor()
+    futures = {executor.submit(opensearch_client.knn_search_by_text_vectors,
+                               search_vector,
+                               knn_k=knn_params['k'],
+                               size_output=page_end,
+                               ef_search=knn_params['ef_search'],
+                               filter_expression=knn_params['filter'],
+                               index_name=index,
+                               request_timeout=timeout_seconds): index
+               for index in knn_params['indices']}
+    done, _ = wait(futures, timeout=timeout_seconds)
+
+    statuses = {}
+    result_lists = []
+    for future, index in futures.items():
+        if future not in done:
+            logger.warning("Federated search of index %s did not finish in %ss", index, timeout_seconds)
+            statuses[index] = 'timeout'
+        elif future.exception() is not None:
+            statuses[index] = 'error'
+        else:
+            statuses[index] = 'ok'
+            result_lists.append((index, [dict(result, index=index) for result in future.result()]))
+
+    ## indices with different space types are merged by rank, whichever of them answered
+    space_types = _get_json_from_env('index_space_types', {})
+    default_space_type = _get_string_from_env('space_type', 'l2')
+    method = normalization_method([space_types.get(index, default_space_type) for index in knn_params['indices']],
+                                  _get_string_from_env('federated_score_normalization', 'auto'))
+    rank_constant = _get_int_from_env('federated_rrf_rank_constant', 60)
+    merged = merge_top_k([normalize_scores(results, method, rank_constant) for _, results in result_lists], page_end)
+    return merged[knn_params['from']:], statuses
+
+
+def _vector_search(search_words, search_vector, knn_params, timer: StageTimer):
+    """
+    Embed the search words unless the vector is given, and search the vector db by it
+
+    Returns:
+        the vector, the results, the status of each index of a federated search and what served the results
+    """
+    if search_vector is None:
+        logger.debug("Start to search by %s", Truncated(search_words))
+        with timer.stage('embed'):
+            search_vector = _generate_embedding(search_words)[0]
+    with timer.stage('search'):
+        if knn_params['indices'] is not None:
+            searched_results, statuses = _federated_search(search_vector, knn_params)
+            return search_vector, searched_results, statuses, 'semantic'
+
+        searched_results, cached = _cached_semantic_search(search_vector, knn_params)
+    return search_vector, searched_results, None, 'semantic_cache' if cached else 'semantic'
+
+
+def _keyword_search(search_words, knn_params, request_timeout, timer: StageTimer):
     opensearch_client = _get_opensearch_client()
-    return opensearch_client.knn_search_by_text_vectors(search_vector)
+    indices = knn_params['indices']
+    with timer.stage('keyword'):
+        return opensearch_client.keyword_search(search_words,
+                                                size_output=knn_params['size'],
+                                                from_offset=knn_params['from'],
+                                                filter_expression=knn_params['filter'],
+                                                index_name=','.join(indices) if indices is not None else None,
+                                                request_timeout=request_timeout)
+
+
+def _deadline_search(search_words, knn_params, deadline_seconds, timer: StageTimer):
+    """
+    Race the vector search against a keyword search issued speculatively alongside it, the vector search
+    answers if it finishes in deadline_seconds, else the keyword search does, e.g. while the embedding
+    endpoint is scaling out
+
+    Returns:
+        as _vector_search, served by keyword without a vector when the keyword search answered,
+        None if neither answered in time
+    """
+    started = time.time()
+    executor = _get_deadline_executor()
+    vector_future = executor.submit(_vector_search, search_words, None, knn_params, timer)
+    keyword_future = executor.submit(_keyword_search, search_words, knn_params, deadline_seconds, timer)
+
+    wait([vector_future], timeout=deadline_seconds)
+    if vector_future.done() and vector_future.exception() is None:
+        return vector_future.result()
+    if vector_future.done():
+        logger.warning("Vector search by %s failed, fall back to the keyword search",
+                       Truncated(search_words), exc_info=vector_future.exception())
+    else:
+        logger.warning("Vector search by %s missed the deadline of %ss, fall back to the keyword search",
+                       Truncated(search_words), deadline_seconds)
+
+    wait([keyword_future], timeout=max(deadline_seconds - (time.time() - started), 0))
+    if keyword_future.done() and keyword_future.exception() is None:
+        return None, keyword_future.result(), None, 'keyword'
+    if vector_future.done():
+        raise vector_future.exception()
+    return None
+
+
+def _faq_search(search_words, knn_params, fields=None):
+    """
+    Hits of a knowledge base question equal to the search words with their sources fetched by id, None if there
+    is none, the table can't serve the knn params, e.g. a filter which was not applied when the table was built,
+    or the index changed since the table was built
+    """
+    global _FAQ_STALE_VERSION
+    faq_table = _get_faq_table()
+    ## the hits of an approximate knn search depend on k, a request of another k is searched
+    if faq_table is None or knn_params['filter'] is not None or knn_params['indices'] is not None \
+            or knn_params['ef_search'] is not None or knn_params['k'] != faq_table.k:
+        return None
+
+    hits = faq_table.lookup(search_words, from_offset=knn_params['from'], size=knn_params['size'])
+    if hits is None:
+        return None
+
+    opensearch_client = _get_opensearch_client()
+    if isinstance(opensearch_client, OpenSearchClient):
+        try:
+            version = _index_version()
+        except Exception:
+            logger.warning("Couldn't get the index version, search without the faq table", exc_info=True)
+            return None
+        if version != faq_table.index_version:
+            if version != _FAQ_STALE_VERSION:
+                logger.warning("Index version %s differs from %s of the faq table, rebuild it by ingest.py --faq-table",
+                               version, faq_table.index_version)
+                _FAQ_STALE_VERSION = version
+            return None
+        documents = opensearch_client.get_documents([doc_id for doc_id, _ in hits], fields=fields)
+    else:
+        # the local vectors are exported by the same ingestion run as the table
+        documents = [opensearch_client.get_document(doc_id) for doc_id, _ in hits]
+
+    sources = {document['id']: document['source'] for document in documents if document is not None}
+    return [{'id': doc_id, 'score': score, 'source': sources[doc_id]} for doc_id, score in hits if doc_id in sources]
+
+
+def _batch_semantic_search(search_vectors, knn_params):
+    opensearch_client = _get_opensearch_client()
+    return opensearch_client.knn_search_by_text_vectors_batch(search_vectors,
+                                                              knn_k=knn_params['k'],
+                                                              size_output=knn_params['size'],
+                                                              ef_search=knn_params['ef_search'],
+                                                              filter_expression=knn_params['filter'])
+
+
+def _shape_results(results, fields=None, snippet_chars=None):
+    """
+    Keep only fields of each result source and cut strings longer than snippet_chars,
+    the names of cut fields are listed in truncated so that clients fetch the full document on demand
+    """
+    if fields is None and snippet_chars is None:
+        return results
+
+    shaped_results = []
+    for result in results:
+        source = result.get('source')
+        if source is None:
+            shaped_results.append(result)
+            continue
+
+        shaped_source = {}
+        truncated = []
+        for field in (fields if fields is not None else source):
+            if field not in source:
+                continue
+            value = source[field]
+            if snippet_chars is not None and isinstance(value, str) and len(value) > snippet_chars:
+                value = value[:snippet_chars]
+                truncated.append(field)
+            shaped_source[field] = value
+
+        shaped = dict(result, source=shaped_source)
+        if truncated:
+            shaped['truncated'] = truncated
+        shaped_results.append(shaped)
+
+    return shaped_results
 
 
 def _search_response(searched_results):
     return _success_response(searched_results)
 
 
+def _log_sampled():
+    """
+    Whether this request logs its details at INFO, a log_sample_rate share of the requests
+    """
+    return logger.isEnabledFor(logging.INFO) and sampled(_get_float_from_env('log_sample_rate', 0.05))
+
+
+def _search(event, timer: StageTimer):
+    with timer.stage('parse'):
+        errors, params = _param_check(event)
+    if errors:
+        return errors
+
+    search_words = params['search_words']
+    knn_params = params['knn']
+
+    search_vector = None
+    statuses = None
+    deadline_ms = _get_int_from_env('search_deadline_ms', 0)
+    searched_results = None
+    if search_words is not None:
+        with timer.stage('faq'):
+            searched_results = _faq_search(search_words, knn_params, params['fields'])
+    served_by = 'faq'
+    if searched_results is not None:
+        logger.debug("Served %s by the faq table", Truncated(search_words))
+    elif params['vector'] is not None:
+        logger.debug("Start to search the page from %s of a cursor", knn_params['from'])
+        search_vector, searched_results, statuses, served_by = _vector_search(None, params['vector'], knn_params,
+                                                                               timer)
+    elif deadline_ms > 0 and _get_string_from_env('search_backend', 'opensearch') != 'local':
+        searched = _deadline_search(search_words, knn_params, deadline_ms / 1000, timer)
+        if searched is None:
+            return _error_response(504, 'SearchTimeout', f'No search answered in {deadline_ms}ms')
+        search_vector, searched_results, statuses, served_by = searched
+    else:
+        search_vector, searched_results, statuses, served_by = _vector_search(search_words, None, knn_params, timer)
+    timer.properties['served_by'] = served_by
+    if _log_sampled():
+        max_chars = _get_int_from_env('log_max_chars', 1024)
+        logger.info("searched timings %s by %s, served by %s, knn params %s, indices %s, embedding cache %s, "
+                    "semantic cache %s, dependencies %s, opensearch %s, searched result: %s",
+                    timer.timings_ms(), Truncated(search_words), served_by, Truncated(knn_params, max_chars), statuses,
+                    _get_embedding_cache().stats(), _semantic_cache_stats(), _dependency_stats(),
+                    Truncated(_opensearch_stats(), max_chars), Truncated(searched_results, max_chars))
+
+    if statuses is not None and 'ok' not in statuses.values():
+        if 'timeout' in statuses.values():
+            return _error_response(504, 'SearchTimeout', f'No index answered in time: {statuses}')
+        return _error_response(502, 'SearchError', f'All indices failed: {statuses}')
+
+    ## a faq or keyword hit has no vector for a cursor, its next page is asked by from
+    next_cursor = None
+    next_from = knn_params['from'] + knn_params['size']
+    if search_vector is not None and len(searched_results) == knn_params['size'] \
+            and next_from + knn_params['size'] <= _get_int_from_env('knn_k_max', 100):
+        next_cursor = _encode_cursor(search_vector, dict(knn_params, **{'from': next_from}))
+
+    with timer.stage('serialize'):
+        response = {'results': _shape_results(searched_results, params['fields'], params['snippet_chars']),
+                    'params': knn_params,
+                    'next_cursor': next_cursor,
+                    'served_by': served_by}
+        if statuses is not None:
+            response['indices'] = statuses
+            response['partial'] = any(status != 'ok' for status in statuses.values())
+        return _search_response(response)
+
+
+def _batch_search(event, timer: StageTimer):
+    with timer.stage('parse'):
+        errors, params = _batch_param_check(event)
+    if errors:
+        return errors
+
+    search_words_list = params['search_words_list']
+    logger.debug("Start to batch search by %s search words", len(search_words_list))
+
+    search_words_max_len = _get_int_from_env('search_words_max_size', 100)
+    outputs = [{'search_words': search_words} for search_words in search_words_list]
+    valid_indexes = []
+    for i, search_words in enumerate(search_words_list):
+        if not isinstance(search_words, str) or len(search_words) == 0 or len(search_words) > search_words_max_len:
+            outputs[i]['error'] = {'code': 'ParamsError',
+                                   'message': f'search_words should be a string with length in the range of (0, {search_words_max_len}]'}
+        else:
+            valid_indexes.append(i)
+
+    with timer.stage('embed'):
+        vectors = _generate_embeddings([search_words_list[i] for i in valid_indexes])
+    search_indexes = []
+    for i, vector in zip(valid_indexes, vectors):
+        if vector is None:
+            outputs[i]['error'] = {'code': 'EmbeddingError', 'message': 'Failed to generate embedding'}
+        else:
+            search_indexes.append(i)
+
+    searched = []
+    if len(search_indexes) > 0:
+        with timer.stage('search'):
+            searched = _batch_semantic_search([vector for vector in vectors if vector is not None], params['knn'])
+
+    if _log_sampled():
+        logger.info("batch searched timings %s by %s search words, embedding cache %s",
+                    timer.timings_ms(), len(search_words_list), _get_embedding_cache().stats())
+
+    with timer.stage('serialize'):
+        for i, (searched_results, error) in zip(search_indexes, searched):
+            if error is not None:
+                outputs[i]['error'] = {'code': 'SearchError', 'message': error}
+            else:
+                outputs[i]['results'] = _shape_results(searched_results, params['fields'], params['snippet_chars'])
+        return _search_response(outputs)
+
+
+def _get_document(event, timer: StageTimer):
+    doc_id = (event.get('pathParameters') or {}).get('id')
+    checked_doc_id = _check_len(_get_int_from_env('doc_id_max_size', 512), doc_id, 'id')
+    if checked_doc_id:
+        return checked_doc_id
+
+    with timer.stage('search'):
+        document = _get_opensearch_client().get_document(doc_id)
+    if document is None:
+        return _error_response(404, 'NotFound', f'Document {doc_id} is not found')
+
+    return _success_response(document)
+
+
+def _suggest(event, timer: StageTimer):
+    query = event.get('queryStringParameters') or {}
+    prefix = query.get('q')
+    checked_prefix = _check_len(_get_int_from_env('search_words_max_size', 100), prefix, 'q')
+    if checked_prefix:
+        return checked_prefix
+
+    suggest_index = _get_suggest_index()
+    if suggest_index is None:
+        return _error_response(503, 'SuggestUnavailable', 'No suggest index is built, see ingest.py --suggest-index')
+
+    size = query.get('size', '5')
+    if not size.isdigit() or not 1 <= int(size) <= suggest_index.max_size:
+        return _bad_request(message=f'size should be an integer in the range of [1, {suggest_index.max_size}]')
+
+    with timer.stage('search'):
+        suggestions = suggest_index.suggest(prefix, int(size))
+    response = _success_response({'prefix': prefix, 'suggestions': suggestions})
+    ## completions only change with ingestion, so browsers may reuse them while the user types and erases
+    response['headers']['cache-control'] = f"public, max-age={_get_int_from_env('suggest_cache_seconds', 60)}"
+    return response
+
+
+_ROUTES = {
+    '/smart_search': ('POST', _search),
+    '/smart_search/batch': ('POST', _batch_search),
+    '/smart_search/doc/{id}': ('GET', _get_document),
+    '/smart_search/suggest': ('GET', _suggest),
+}
+
+
 # Lambda execution starts here
+def _emit_request_metrics(event, timer: StageTimer, response):
+    """
+    Stage timings of a request as CloudWatch metrics per route, e.g. EmbedTime, with its status and served_by
+    """
+    namespace = _get_string_from_env('metrics_namespace', 'SmartSearch')
+    if namespace == 'none':
+        return
+    emit_metrics(namespace,
+                 {'Route': event.get('requestContext', {}).get('resourcePath')},
+                 {f'{name.capitalize()}Time': (ms, 'Milliseconds') for name, ms in timer.timings_ms().items()},
+                 properties=dict(timer.properties, status_code=response.get('statusCode')))
+
+
 def lambda_handler(event, context):
-    errors, search_words = _param_check(event)
+    timer = StageTimer()
+    errors, route_handler = _request_check(event)
     if errors:
         return errors
 
+    try:
+        response = route_handler(event, timer)
+    except CircuitOpenError as e:
+        response = _error_response(503, 'DependencyUnavailable', str(e))
+    finally:
+        _emit_dependency_metrics()
+    with timer.stage('serialize'):
+        response = _compress_response(response, event)
+
+    _emit_request_metrics(event, timer, response)
+    if _get_string_from_env('server_timing_header', 'true') == 'true':
+        headers = dict(response.get('headers') or {})
+        headers['Server-Timing'] = timer.server_timing()
+        ## lets browsers of other origins, e.g. the front end, read the timings
+        headers['Timing-Allow-Origin'] = '*'
+        response = dict(response, headers=headers)
+    return response
+
+
+def _warm_up_opensearch():
+    global _OS_CLIENT
+    # boto3 sessions are not thread safe, each warm up task creates its own
+    opensearch_client = _create_opensearch_client(boto3.Session())
+    opensearch_client.warm_up()
+    _OS_CLIENT = opensearch_client
+
+
+def _warm_up_embedding():
+    global _EMBEDDING_CLIENT
+    _EMBEDDING_CLIENT = _create_embedding_client(boto3.Session())
+
+
+def _warm_up(timeout_seconds):
+    """
+    Fetch the vector db secret, create both clients, open the opensearch connection and load the suggest index
+    and the faq table concurrently in the init phase, instead of serially in the first request
+    """
     stopwatch = Stopwatch().start()
-    logger.debug(f"Start to search by {search_words}")
-    search_vector = _generate_embedding(search_words)
-    searched_results = _semantic_search(search_vector[0])
-    lapsed = stopwatch.stop()
-    logger.info(f"searched lapsed time {lapsed} by {search_words}, searched result: {searched_results}")
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='warm-up')
+    futures = {executor.submit(_warm_up_opensearch): 'opensearch', executor.submit(_warm_up_embedding): 'embedding',
+               executor.submit(_get_suggest_index): 'suggest', executor.submit(_get_faq_table): 'faq'}
+    done, not_done = wait(futures, timeout=timeout_seconds)
+    for future in done:
+        if future.exception() is not None:
+            logger.warning("Warm up %s failed: %s", futures[future], future.exception())
+    for future in not_done:
+        logger.warning("Warm up %s did not finish in %ss", futures[future], timeout_seconds)
+    executor.shutdown(wait=False)
+
+    return stopwatch.stop()
+
+
+## a bad federation config fails the init phase, rather than every federated search
+check_federation_config(_get_json_from_env('index_space_types', {}), _get_string_from_env('space_type', 'l2'),
+                        _get_string_from_env('federated_score_normalization', 'auto'))
+
+_INIT_TIMINGS = {'import_seconds': _IMPORT_SECONDS, 'warm_up_seconds': None}
+
+if _get_string_from_env('warm_up_on_init', 'true' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ else 'false') == 'true':
+    _INIT_TIMINGS['warm_up_seconds'] = _warm_up(_get_int_from_env('warm_up_timeout_seconds', 5))
 
-    return _search_response(searched_results)
\ No newline at end of file
+if _IMPORT_SECONDS * 1000 > _get_int_from_env('import_time_budget_ms', 1000):
+    logger.warning("Imports took %.0fms, over the budget of %sms", _IMPORT_SECONDS * 1000,
+                   _get_int_from_env('import_time_budget_ms', 1000))
+logger.info("Init timings: %s", _INIT_TIMINGS)
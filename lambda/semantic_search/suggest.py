@@ -0,0 +1,83 @@
+import os
+import json
+import bisect
+import heapq
+import logging
+import unicodedata
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_INDEX_VERSION = 1
+
+
+def normalize_suggest_text(text):
+    """
+    Normalize a question or a typed prefix, must match data/ingestion/suggest.py
+    """
+    return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+
+class SuggestIndex(object):
+    """
+    Question completions by prefix from the index built by ingestion, see data/ingestion/suggest.py.
+
+    Questions are ranked by popularity and their ids are their ranks. A prefix up to head_length characters
+    reads its precomputed questions, a longer one binary searches its range of the sorted keys and keeps the
+    smallest ids, so a suggestion never calls the embedding endpoint or the vector db.
+    """
+
+    def __init__(self, path: str, boto3_session: boto3.Session = None, local_path='/tmp/suggest_index.json'):
+        """
+        Args:
+            :path: the index file, or s3://bucket/key which is downloaded to local_path once
+            :boto3_session: A Boto3 Session, used for s3 paths
+            :local_path: download path for s3 paths
+        """
+        if path.startswith('s3://'):
+            if not os.path.exists(local_path):
+                bucket, _, key = path[len('s3://'):].partition('/')
+                (boto3_session or boto3.Session()).client(service_name='s3').download_file(bucket, key, local_path)
+            path = local_path
+
+        with open(path, encoding='utf-8') as index_file:
+            suggest_index = json.load(index_file)
+        if suggest_index.get('version') != SUGGEST_INDEX_VERSION:
+            raise ValueError(f"Unsupported suggest index version {suggest_index.get('version')}")
+
+        self._questions = suggest_index['questions']
+        self._keys = suggest_index['keys']
+        self._ids = suggest_index['ids']
+        self._heads = suggest_index['heads']
+        self._head_length = suggest_index['head_length']
+        self._head_size = suggest_index['head_size']
+        logger.info("Loaded suggest index of %s questions from %s", len(self._questions), path)
+
+    @property
+    def max_size(self):
+        return self._head_size
+
+    def suggest(self, prefix, size=5):
+        """
+        Returns up to size questions completing prefix, the most popular first
+
+        Args:
+            :prefix: typed text, a trailing space completes whole words only
+            :size: max number of suggestions, at most max_size
+        """
+        key = normalize_suggest_text(prefix)
+        if len(key) == 0:
+            return []
+        if prefix[-1].isspace():
+            key += ' '
+
+        if len(key) <= self._head_length:
+            question_ids = self._heads.get(key, [])[:size]
+        else:
+            start = bisect.bisect_left(self._keys, key)
+            end = bisect.bisect_left(self._keys, key + '\U0010ffff', lo=start)
+            question_ids = heapq.nsmallest(size, set(self._ids[start:end]))
+
+        return [{'question': self._questions[question_id][0], 'popularity': self._questions[question_id][1]}
+                for question_id in question_ids]
@@ -0,0 +1,191 @@
+import json
+import time
+import base64
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+from opensearchpy import AuthenticationException
+
+from credentials import ProviderAuth, SecretCredentialProvider
+
+
+class FakeClock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSecretsClient(object):
+    """
+    A secrets manager of one secret, rotate() moves it to a new version and password
+    """
+
+    def __init__(self):
+        self.version = 1
+        self.calls = 0
+        self.fetched = threading.Event()
+
+    def rotate(self):
+        self.version += 1
+
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        self.fetched.set()
+        return {'VersionId': f'v{self.version}',
+                'SecretString': json.dumps({'username': 'master', 'password': f'password-{self.version}'})}
+
+
+def _provider(secrets_client, clock):
+    return SecretCredentialProvider(ttl_seconds=300, refresh_ahead_seconds=60, secrets_client=secrets_client,
+                                    clock=clock)
+
+
+def test_caches_the_secret_for_its_ttl():
+    secrets_client, clock = FakeSecretsClient(), FakeClock()
+    provider = _provider(secrets_client, clock)
+
+    assert provider.get() == ('master', 'password-1')
+    secrets_client.rotate()
+    clock.now = 200
+    assert provider.get() == ('master', 'password-1')
+    assert secrets_client.calls == 1
+
+    clock.now = 300
+    assert provider.get() == ('master', 'password-2')
+    assert provider.stats()['version_id'] == 'v2'
+    assert provider.stats()['misses'] == 2
+
+
+def test_refreshes_ahead_of_expiry_in_background():
+    secrets_client, clock = FakeSecretsClient(), FakeClock()
+    provider = _provider(secrets_client, clock)
+    provider.get()
+    secrets_client.rotate()
+    secrets_client.fetched.clear()
+
+    clock.now = 250
+    # the cached secret answers while the refresh runs
+    assert provider.get() == ('master', 'password-1')
+    assert secrets_client.fetched.wait(5)
+
+    for _ in range(500):
+        if provider.stats()['background_refreshes'] == 1:
+            break
+        time.sleep(0.01)
+    assert provider.get() == ('master', 'password-2')
+    assert secrets_client.calls == 2
+
+
+def test_forced_refresh_picks_up_a_rotation():
+    secrets_client, clock = FakeSecretsClient(), FakeClock()
+    provider = _provider(secrets_client, clock)
+    provider.get()
+    secrets_client.rotate()
+
+    assert provider.refresh() == ('master', 'password-2')
+    assert provider.get() == ('master', 'password-2')
+    assert provider.stats()['forced_refreshes'] == 1
+
+
+def test_provider_auth_reads_the_current_credentials():
+    secrets_client, clock = FakeSecretsClient(), FakeClock()
+    provider = _provider(secrets_client, clock)
+    auth = ProviderAuth(provider)
+
+    first = auth(requests.Request('GET', 'https://domain/').prepare()).headers['Authorization']
+    secrets_client.rotate()
+    provider.refresh()
+    assert auth(requests.Request('GET', 'https://domain/').prepare()).headers['Authorization'] != first
+
+
+class FakeDomain(object):
+    """
+    An opensearch domain over http which accepts only the password of the current secret version,
+    other requests fail with a 401, as do all of them while locked
+    """
+
+    def __init__(self, secrets_client):
+        self.secrets_client = secrets_client
+        self.locked = False
+        self.requests = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.port = self._server.server_port
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        domain = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                credentials = base64.b64decode(self.headers.get('Authorization', 'Basic ')[len('Basic '):]).decode()
+                domain.requests.append((self.path, credentials))
+                if domain.locked or credentials != f'master:password-{domain.secrets_client.version}':
+                    status, output = 401, {'error': {'type': 'security_exception'}, 'status': 401}
+                else:
+                    status, output = 200, {'hits': {'hits': [{'_id': 'doc', '_score': 0.5,
+                                                              '_source': {'question': 'q'}}]}}
+
+                payload = json.dumps(output).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+@pytest.fixture
+def domain(monkeypatch):
+    domain = FakeDomain(FakeSecretsClient()).start()
+    monkeypatch.setenv('host', '127.0.0.1')
+    monkeypatch.setenv('port', str(domain.port))
+    monkeypatch.setenv('opensearch_use_ssl', 'false')
+    yield domain
+    domain.stop()
+
+
+def _opensearch_client(provider):
+    import semantic_search
+
+    return semantic_search.OpenSearchClient(index_name='kb', credential_provider=provider, request_timeout=5,
+                                            max_retries=0)
+
+
+def test_unauthorized_search_is_retried_once_with_refreshed_credentials(domain):
+    provider = _provider(domain.secrets_client, FakeClock())
+    opensearch_client = _opensearch_client(provider)
+    # the domain accepts only the rotated password
+    domain.secrets_client.rotate()
+
+    results = opensearch_client.knn_search_by_text_vectors([0.1, 0.2], knn_k=1, size_output=1)
+
+    assert results == [{'id': 'doc', 'score': 0.5, 'source': {'question': 'q'}}]
+    assert domain.requests == [('/kb/_search', 'master:password-1'), ('/kb/_search', 'master:password-2')]
+    assert provider.stats()['forced_refreshes'] == 1
+
+
+def test_unauthorized_retry_gives_up_after_one_refresh(domain):
+    provider = _provider(domain.secrets_client, FakeClock())
+    opensearch_client = _opensearch_client(provider)
+    domain.locked = True
+
+    with pytest.raises(AuthenticationException):
+        opensearch_client.knn_search_by_text_vectors([0.1, 0.2], knn_k=1, size_output=1)
+    assert len(domain.requests) == 2
+    assert provider.stats()['forced_refreshes'] == 1
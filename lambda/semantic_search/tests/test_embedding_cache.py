@@ -0,0 +1,83 @@
+from embedding_cache import CacheStore, EmbeddingCache, SqliteCacheStore
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_after_put_shares_normalized_search_words():
+    cache = EmbeddingCache(max_size=4, ttl_seconds=60, clock=FakeClock())
+    assert cache.get('endpoint', 'machining  quality') is None
+
+    cache.put('endpoint', 'machining quality', [1.0, 2.0])
+
+    assert cache.get('endpoint', ' machining\tquality ') == [1.0, 2.0]
+    assert cache.get('other-endpoint', 'machining quality') is None
+    assert cache.stats() == {'size': 1, 'hits': 1, 'shared_hits': 0, 'misses': 2, 'evictions': 0}
+
+
+def test_entry_expires_after_ttl():
+    clock = FakeClock()
+    cache = EmbeddingCache(max_size=4, ttl_seconds=60, clock=clock)
+    cache.put('endpoint', 'casting', [1.0])
+
+    clock.now += 59
+    assert cache.get('endpoint', 'casting') == [1.0]
+    clock.now += 1
+    assert cache.get('endpoint', 'casting') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_evicts_least_recently_used():
+    cache = EmbeddingCache(max_size=2, ttl_seconds=60, clock=FakeClock())
+    cache.put('endpoint', 'a', [1.0])
+    cache.put('endpoint', 'b', [2.0])
+    cache.get('endpoint', 'a')
+
+    cache.put('endpoint', 'c', [3.0])
+
+    assert cache.get('endpoint', 'b') is None
+    assert cache.get('endpoint', 'a') == [1.0]
+    assert cache.get('endpoint', 'c') == [3.0]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_zero_size_disables_the_cache():
+    cache = EmbeddingCache(max_size=0, clock=FakeClock())
+    cache.put('endpoint', 'a', [1.0])
+
+    assert not cache.enabled
+    assert cache.get('endpoint', 'a') is None
+
+
+def test_shared_store_serves_other_containers_until_expiry(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / 'embedding_cache.sqlite')
+    EmbeddingCache(ttl_seconds=60, shared_store=SqliteCacheStore(path), clock=clock).put('endpoint', 'a', [1.0])
+
+    other = EmbeddingCache(ttl_seconds=60, shared_store=SqliteCacheStore(path), clock=clock)
+    assert other.get('endpoint', 'a') == [1.0]
+    assert other.get('endpoint', 'a') == [1.0]
+    assert other.stats()['shared_hits'] == 1 and other.stats()['hits'] == 1
+
+    clock.now += 60
+    assert EmbeddingCache(ttl_seconds=60, shared_store=SqliteCacheStore(path), clock=clock).get('endpoint', 'a') is None
+
+
+def test_failing_shared_store_is_a_miss():
+    class BrokenStore(CacheStore):
+        def get(self, key):
+            raise OSError('store is down')
+
+        def put(self, key, value, expires_at):
+            raise OSError('store is down')
+
+    cache = EmbeddingCache(shared_store=BrokenStore(), clock=FakeClock())
+    cache.put('endpoint', 'a', [1.0])
+
+    assert cache.get('endpoint', 'a') == [1.0]
+    assert cache.get('endpoint', 'b') is None
@@ -0,0 +1,43 @@
+import pytest
+
+from federation import FederationError, check_federation_config, merge_top_k, normalization_method, normalize_scores
+
+
+def _results(index, scores):
+    return [{'id': f'{index}-{i}', 'index': index, 'score': score} for i, score in enumerate(scores)]
+
+
+def test_same_space_types_merge_raw_scores():
+    method = normalization_method(['l2', 'l2'])
+    lists = [normalize_scores(_results('a', [0.9, 0.5]), method), normalize_scores(_results('b', [0.7]), method)]
+
+    assert method == 'none'
+    assert [result['id'] for result in merge_top_k(lists, 3)] == ['a-0', 'b-0', 'a-1']
+
+
+def test_different_space_types_merge_by_rank():
+    method = normalization_method(['l2', 'cosinesimil'])
+    # raw l2 scores of unnormalized vectors are tiny next to cosinesimil scores, ranks still interleave
+    lists = [normalize_scores(_results('l2', [0.004, 0.003]), method),
+             normalize_scores(_results('cosine', [0.95, 0.94]), method)]
+
+    merged = merge_top_k(lists, 4)
+
+    assert method == 'rrf'
+    assert [result['id'] for result in merged] == ['l2-0', 'cosine-0', 'l2-1', 'cosine-1']
+    assert merged[0]['score'] == pytest.approx(1 / 61) and merged[0]['raw_score'] == 0.004
+
+
+@pytest.mark.parametrize('space_types, default_space_type, method', [
+    ({'casting_index': 'cosine'}, 'l2', 'auto'),
+    ({}, 'hamming', 'auto'),
+    (['l2'], 'l2', 'auto'),
+    ({}, 'l2', 'min_max'),
+])
+def test_rejects_unsupported_config(space_types, default_space_type, method):
+    with pytest.raises(FederationError):
+        check_federation_config(space_types, default_space_type, method)
+
+
+def test_accepts_supported_config():
+    check_federation_config({'a': 'l2', 'b': 'cosinesimil', 'c': 'innerproduct'}, 'l2', 'rrf')
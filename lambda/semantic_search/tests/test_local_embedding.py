@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+onnx = pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+tokenizers = pytest.importorskip('tokenizers')
+
+from local_embedding import CONFIG_FILE, MODEL_FILE, TOKENIZER_FILE, LocalEmbeddingClient  # noqa: E402
+
+VOCAB = {'[PAD]': 0, '[UNK]': 1, 'hello': 2, 'world': 3, 'again': 4}
+# the hidden state of a token is its row, so that pooled vectors are known
+EMBEDDINGS = np.array([[0, 0, 0], [9, 9, 9], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32)
+
+
+def _export_model(model_dir, pooling, max_length=8):
+    """
+    A stand-in of export_onnx.py, a model whose last_hidden_state looks the input ids up in EMBEDDINGS
+    """
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(VOCAB, unk_token='[UNK]'))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.save(str(model_dir / TOKENIZER_FILE))
+
+    helper = onnx.helper
+    graph = helper.make_graph(
+        [helper.make_node('Gather', ['embeddings', 'input_ids'], ['last_hidden_state'])],
+        'lookup',
+        [helper.make_tensor_value_info('input_ids', onnx.TensorProto.INT64, ['batch', 'tokens'])],
+        [helper.make_tensor_value_info('last_hidden_state', onnx.TensorProto.FLOAT, ['batch', 'tokens', 3])],
+        initializer=[onnx.numpy_helper.from_array(EMBEDDINGS, 'embeddings')])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 14)])
+    model.ir_version = 8
+    onnx.save(model, str(model_dir / MODEL_FILE))
+
+    (model_dir / CONFIG_FILE).write_text(json.dumps({'model_id': 'test', 'pooling': pooling, 'max_length': max_length}))
+    return str(model_dir)
+
+
+def test_cls_pooling_keeps_the_first_token(tmp_path):
+    client = LocalEmbeddingClient(_export_model(tmp_path, 'cls'))
+
+    assert client.generate_vectors(['world hello', 'again']) == [[0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]
+
+
+def test_mean_pooling_ignores_padding(tmp_path):
+    client = LocalEmbeddingClient(_export_model(tmp_path, 'mean'))
+
+    vectors = client.generate_vectors(['hello', 'hello world'])
+
+    assert vectors[0] == [1.0, 0.0, 0.0]
+    assert vectors[1] == [0.5, 0.5, 0.0]
+
+
+def test_truncates_to_max_length(tmp_path):
+    client = LocalEmbeddingClient(_export_model(tmp_path, 'mean', max_length=2))
+
+    assert client.generate_vectors(['hello world again again']) == [[0.5, 0.5, 0.0]]
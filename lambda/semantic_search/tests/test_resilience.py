@@ -0,0 +1,181 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from opensearchpy import ConnectionError as OpenSearchConnectionError, RequestError
+
+from resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, Dependency, FaultInjector,
+                        InjectedFault, is_opensearch_failure)
+
+
+class FakeClock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class ScheduledSleep(object):
+    """
+    Sleep of a FaultInjector which delays the calls by the scheduled seconds in turn, then not at all
+    """
+
+    def __init__(self, delays=()):
+        self._delays = list(delays)
+        self._lock = threading.Lock()
+
+    def schedule(self, *delays):
+        with self._lock:
+            self._delays.extend(delays)
+
+    def __call__(self, seconds):
+        with self._lock:
+            delay = self._delays.pop(0) if self._delays else 0
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _fail():
+    raise OpenSearchConnectionError('N/A', 'connection refused', None)
+
+
+def test_breaker_opens_after_consecutive_failures_and_recovers_by_a_trial_call():
+    clock = FakeClock()
+    breaker = CircuitBreaker('opensearch', failure_threshold=3, reset_seconds=30, is_failure=is_opensearch_failure,
+                             clock=clock)
+    dependency = Dependency('opensearch', breaker)
+
+    for _ in range(3):
+        with pytest.raises(OpenSearchConnectionError):
+            dependency.call(_fail)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError):
+        dependency.call(lambda: 'never called')
+
+    clock.now = 30
+    assert breaker.state == HALF_OPEN
+    assert dependency.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED
+    assert breaker.stats() == {'state': CLOSED, 'calls': 4, 'failures': 3, 'rejections': 1, 'opens': 1}
+
+
+def test_failed_trial_call_opens_the_breaker_again():
+    clock = FakeClock()
+    breaker = CircuitBreaker('opensearch', failure_threshold=1, reset_seconds=30, clock=clock)
+    dependency = Dependency('opensearch', breaker)
+    with pytest.raises(OpenSearchConnectionError):
+        dependency.call(_fail)
+
+    clock.now = 30
+    with pytest.raises(OpenSearchConnectionError):
+        dependency.call(_fail)
+    assert breaker.state == OPEN
+
+    clock.now = 59
+    with pytest.raises(CircuitOpenError):
+        dependency.call(lambda: 'ok')
+
+
+def test_half_open_breaker_admits_only_the_trial_calls():
+    clock = FakeClock()
+    breaker = CircuitBreaker('sagemaker', failure_threshold=1, reset_seconds=30, half_open_calls=1, clock=clock)
+    breaker.on_failure(InjectedFault('down'))
+    clock.now = 30
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_bad_requests_do_not_count_as_failures():
+    breaker = CircuitBreaker('opensearch', failure_threshold=2, is_failure=is_opensearch_failure, clock=FakeClock())
+    dependency = Dependency('opensearch', breaker)
+
+    def bad_query():
+        raise RequestError(400, 'parsing_exception', {})
+
+    for _ in range(5):
+        with pytest.raises(RequestError):
+            dependency.call(bad_query)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['failures'] == 0
+
+
+def test_injected_faults_open_the_breaker():
+    breaker = CircuitBreaker('sagemaker', failure_threshold=2, clock=FakeClock())
+    dependency = Dependency('sagemaker', breaker, fault_injector=FaultInjector(error_rate=1.0))
+
+    for _ in range(2):
+        with pytest.raises(InjectedFault):
+            dependency.call(lambda: 'never called')
+
+    with pytest.raises(CircuitOpenError):
+        dependency.call(lambda: 'never called')
+    assert dependency.metrics() == {'calls': 2, 'failures': 2, 'rejections': 1, 'opens': 1, 'hedges': 0,
+                                    'hedge_wins': 0, 'state': 2}
+    assert dependency.metrics()['calls'] == 0
+
+
+def test_fault_injector_fails_the_rate_of_calls():
+    draws = iter([0.1, 0.6, 0.3, 0.9])
+    injector = FaultInjector(error_rate=0.5, random_source=lambda: next(draws))
+
+    outcomes = []
+    for _ in range(4):
+        try:
+            injector()
+            outcomes.append('ok')
+        except InjectedFault:
+            outcomes.append('fault')
+    assert outcomes == ['fault', 'ok', 'fault', 'ok']
+
+
+def _hedged_dependency(sleep, executor, hedge_min_samples=3):
+    breaker = CircuitBreaker('opensearch')
+    return Dependency('opensearch', breaker, hedge_executor=executor, hedge_min_samples=hedge_min_samples,
+                      hedge_min_delay_ms=20, fault_injector=FaultInjector(delay_ms=1, sleep=sleep))
+
+
+def test_hedges_a_slow_call_once_enough_latencies_are_known():
+    sleep = ScheduledSleep()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        dependency = _hedged_dependency(sleep, executor)
+        for _ in range(3):
+            assert dependency.hedge_delay() is None
+            dependency.call(lambda: 'warm')
+        assert dependency.hedge_delay() == pytest.approx(0.02, abs=0.01)
+
+        # the first request stalls on a slow replica, the duplicate answers
+        sleep.schedule(1.0, 0)
+        started = time.monotonic()
+        assert dependency.call(lambda: 'ok') == 'ok'
+        assert time.monotonic() - started < 0.5
+
+        stats = dependency.stats()
+        assert stats['hedges'] == 1 and stats['hedge_wins'] == 1
+
+
+def test_fast_call_is_not_hedged():
+    sleep = ScheduledSleep()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        dependency = _hedged_dependency(sleep, executor, hedge_min_samples=1)
+        dependency.call(lambda: 'warm')
+
+        assert dependency.call(lambda: 'ok') == 'ok'
+        assert dependency.stats()['hedges'] == 0
+
+
+def test_hedged_call_fails_when_both_requests_fail():
+    sleep = ScheduledSleep()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        dependency = _hedged_dependency(sleep, executor, hedge_min_samples=1)
+        dependency.call(lambda: 'warm')
+
+        sleep.schedule(0.1, 0)
+        with pytest.raises(OpenSearchConnectionError):
+            dependency.call(_fail)
+        stats = dependency.stats()
+        assert stats['hedges'] == 1 and stats['hedge_wins'] == 0 and stats['failures'] == 1
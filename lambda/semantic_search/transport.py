@@ -0,0 +1,71 @@
+import threading
+
+from opensearchpy import RequestsHttpConnection
+from requests.adapters import HTTPAdapter
+
+
+class PooledHttpConnection(RequestsHttpConnection):
+    """
+    Keep-alive connection of opensearch-py with a sized pool, a connect timeout of its own and
+    connection reuse statistics.
+
+    The read timeout of a request is still the request_timeout of the opensearch call, so slow
+    searches and unreachable hosts are bounded separately. With http_compress, request bodies are
+    gzipped and gzip responses are asked for.
+    """
+
+    def __init__(self, pool_connections=1, pool_maxsize=10, connect_timeout=None, **kwargs):
+        """
+        Args:
+            :pool_connections: number of host pools kept
+            :pool_maxsize: max kept-alive connections per host, at least the concurrency of the process
+            :connect_timeout: seconds to open a connection, the read timeout applies if absent
+            :kwargs: arguments of RequestsHttpConnection, e.g. http_compress, http_auth, timeout
+        """
+        kwargs.pop('pool_maxsize', None)
+        super().__init__(**kwargs)
+
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self._connect_timeout = connect_timeout
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._compressed_responses = 0
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, allow_redirects=True,
+                        ignore=(), headers=None):
+        timeout = timeout or self.timeout
+        if self._connect_timeout is not None and not isinstance(timeout, tuple):
+            timeout = (self._connect_timeout, timeout)
+
+        status, response_headers, data = super().perform_request(method, url, params=params, body=body,
+                                                                  timeout=timeout, allow_redirects=allow_redirects,
+                                                                  ignore=ignore, headers=headers)
+        with self._lock:
+            self._requests += 1
+            if response_headers.get('content-encoding') == 'gzip':
+                self._compressed_responses += 1
+        return status, response_headers, data
+
+    def stats(self):
+        """
+        Returns requests sent, connections opened, i.e. TLS handshakes for https, and requests which reused one
+        """
+        pools = self._adapter.poolmanager.pools
+        connections = 0
+        pooled_requests = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                pooled_requests += pool.num_requests
+
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'connections_opened': connections,
+                'reused_requests': max(pooled_requests - connections, 0),
+                'compressed_responses': self._compressed_responses,
+            }